@@ -0,0 +1,428 @@
+"""
+基于 asyncio 的同步引擎，与 sync_logic.run_one_time_sync 并列，可在配置或命令行中选择。
+
+解析 Markdown 和读写命令存储复用 sync_logic.VaultSync 的 plan / finish，在线程中执行，不阻塞事件循环；
+CopyQ 调用使用 asyncio 子进程，由信号量限制同时运行的客户端进程数。
+大批量导出时把待导出内容分成多批并发写入，吞吐量随并发上限提高。
+"""
+import asyncio
+import json
+import logging
+import subprocess
+import threading
+
+import sync_logic
+import sync_metrics
+from content_hash import content_digest
+from clipboard_manager import (EXPORT_BATCH_SCRIPT, LEGACY_MARKER, REMOVE_ITEMS_SCRIPT, TAB_CONTENTS_SCRIPT,
+                               TAB_FINGERPRINT_SCRIPT, UPDATE_TAGS_SCRIPT, cached_tab_index, discard_tab_index,
+                               tab_lock, unique_tag_updates)
+from copyq_session import get_session, COPYQ_ERRORS
+from config import (COPYQ_PATH, COPYQ_TIMEOUT, DEFAULT_TAB, CHECK_DUPLICATES, USE_TAB_INDEX,
+                    EXPORT_BATCH_SIZE, ASYNC_COPYQ_CONCURRENCY, SYNC_DEBOUNCE_SECONDS, VAULT_SYNC_WORKERS,
+                    SHUTDOWN_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+class AsyncCopyQClient:
+    def __init__(self, copyq_path=COPYQ_PATH, concurrency=ASYNC_COPYQ_CONCURRENCY, timeout=COPYQ_TIMEOUT):
+        """
+        :param copyq_path: CopyQ 可执行文件路径
+        :param concurrency: 同时运行的 CopyQ 客户端进程数上限
+        :param timeout: 单次调用的超时时间（秒）
+        """
+        self.copyq_path = copyq_path
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.call_count = 0
+        self._semaphore = None  # 在事件循环中首次调用时创建
+
+    async def run(self, args, input=None, retry=False):
+        """
+        执行一条 CopyQ 命令，错误类型与 CopyQSession.run 相同
+        :param args: COPYQ_PATH 之后的命令行参数
+        :param input: 传给标准输入的文本
+        :param retry: 失败后是否在重新连接后重试一次，只应对只读操作开启
+        :return: 命令的标准输出
+        """
+        try:
+            return await self._spawn(args, input)
+        except COPYQ_ERRORS:
+            # 重新连接是少见的慢路径，复用同步会话的逻辑
+            if not (await asyncio.to_thread(get_session().reconnect) and retry):
+                raise
+            return await self._spawn(args, input)
+
+    async def _spawn(self, args, input=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            self.call_count += 1
+            sync_metrics.count("copyq_calls")
+            data = input.encode('utf-8') if input is not None else None
+            if data is not None:
+                sync_metrics.count("copyq_bytes_out", len(data))
+            process = await asyncio.create_subprocess_exec(
+                self.copyq_path, *args,
+                stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            try:
+                with sync_metrics.stage("copyq"):
+                    stdout, stderr = await asyncio.wait_for(process.communicate(data), self.timeout)
+            except asyncio.TimeoutError:
+                if process.returncode is None:
+                    process.kill()
+                await process.wait()
+                raise subprocess.TimeoutExpired([self.copyq_path, *args], self.timeout)
+            except asyncio.CancelledError:
+                if process.returncode is None:
+                    process.kill()
+                raise
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, [self.copyq_path, *args],
+                                                stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace'))
+        sync_metrics.count("copyq_bytes_in", len(stdout))
+        return stdout.decode('utf-8')
+
+    async def eval_json(self, script, payload=None, tab=DEFAULT_TAB, retry=False):
+        """与 clipboard_manager._eval_json 相同，通过标准输入传递 JSON 数据并解析脚本输出"""
+        output = await self.run(
+            ['tab', tab, 'eval', '--', script],
+            input=json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+            retry=retry
+        )
+        return json.loads(output)
+
+    async def get_tab_index(self, tab=DEFAULT_TAB):
+        """
+        获取指定标签页的内容索引，与 clipboard_manager.get_tab_index 共用进程内缓存
+        :return: 最新的 TabIndex；读取失败或未启用索引时返回 None
+        """
+        if not USE_TAB_INDEX:
+            return None
+        index = cached_tab_index(tab)
+        try:
+            with sync_metrics.stage("tab_index"):
+                fresh = False
+                if index.fingerprint is not None:
+                    fresh = index.is_current(await self.eval_json(TAB_FINGERPRINT_SCRIPT, tab=tab, retry=True))
+                if not fresh:
+                    index.load(await self.eval_json(TAB_CONTENTS_SCRIPT, tab=tab, retry=True))
+        except (*COPYQ_ERRORS, ValueError) as e:
+            logger.error(f"读取标签页索引时发生错误: {e}")
+            discard_tab_index(tab)
+            return None
+        return index
+
+    async def export_batch(self, items, tab=DEFAULT_TAB, need_check=CHECK_DUPLICATES,
+                           batch_size=EXPORT_BATCH_SIZE, index=None, marker=LEGACY_MARKER):
+        """
+        并发批量导出，参数和返回值与 clipboard_manager.export_batch 相同。
+        检查重复时先按内容去重，并发的各批内容互不重叠，CopyQ 端各自检查也不会重复写入。
+        """
+        inserted = [False] * len(items)
+        positions = list(range(len(items)))
+        if need_check:
+            seen = set()
+            positions = []
+            for position, (content, _) in enumerate(items):
+                key = content_digest(content)
+                if key in seen or (index is not None and key in index.keys):
+                    continue
+                seen.add(key)
+                positions.append(position)
+        if not positions:
+            return inserted
+
+        # 批次大小不超过 batch_size，同时至少分成并发上限那么多批
+        chunk_size = max(1, min(batch_size, -(-len(positions) // self.concurrency)))
+        chunks = [positions[start:start + chunk_size] for start in range(0, len(positions), chunk_size)]
+
+        done = 0
+
+        async def export_chunk(chunk):
+            nonlocal done
+            payload = {
+                "check": need_check and index is None,
+                "marker": marker,
+                "items": [{"content": items[p][0], "tags": items[p][1]} for p in chunk]
+            }
+            try:
+                return await self.eval_json(EXPORT_BATCH_SCRIPT, payload, tab)
+            finally:
+                done += len(chunk)
+                sync_metrics.progress(done, len(positions))
+
+        sync_metrics.count("export_batches", len(chunks))
+        sync_metrics.progress(0, len(positions))
+        with sync_metrics.stage("export"):
+            results = await asyncio.gather(*(export_chunk(chunk) for chunk in chunks), return_exceptions=True)
+        written = []
+        failed = False
+        for chunk, flags in zip(chunks, results):
+            if isinstance(flags, BaseException):
+                if not isinstance(flags, (*COPYQ_ERRORS, ValueError)):
+                    raise flags
+                logger.error(f"批量导出时发生错误: {flags}")
+                for position in chunk:
+                    inserted[position] = None
+                failed = True
+                continue
+            for position, flag in zip(chunk, flags):
+                inserted[position] = bool(flag)
+            written.extend(items[p][0] for p, flag in zip(chunk, flags) if flag)
+
+        if index is not None:
+            if failed:
+                # 写入结果未知，丢弃索引以便下次重新读取
+                discard_tab_index(tab)
+            elif len(chunks) == 1:
+                index.record_inserted(written)
+            else:
+                # 各批写入的先后顺序未知，重新读取一次指纹
+                try:
+                    index.record_inserted(written, await self.eval_json(TAB_FINGERPRINT_SCRIPT, tab=tab, retry=True))
+                except (*COPYQ_ERRORS, ValueError):
+                    discard_tab_index(tab)
+        sync_metrics.count("items_written", inserted.count(True))
+        return inserted
+
+    async def update_tags(self, items, tab=DEFAULT_TAB):
+        """与 clipboard_manager.update_tags 相同，在一次调用中为已存在的条目追加标签"""
+        if not items:
+            return []
+        payload, slots = unique_tag_updates(items)
+        try:
+            with sync_metrics.stage("update_tags"):
+                states = await self.eval_json(UPDATE_TAGS_SCRIPT, payload, tab)
+        except (*COPYQ_ERRORS, ValueError) as e:
+            logger.error(f"批量更新标签时发生错误: {e}")
+            return None
+        sync_metrics.count("items_retagged", sum(1 for state in states if state > 0))
+        return [states[slot] for slot in slots]
+
+    async def remove_items(self, contents, tab=DEFAULT_TAB, marker=LEGACY_MARKER):
+        """与 clipboard_manager.remove_from_clipboard 相同，返回实际删除的条目数，调用失败时返回 None"""
+        if not contents:
+            return 0
+        try:
+            with sync_metrics.stage("remove"):
+                removed = await self.eval_json(REMOVE_ITEMS_SCRIPT, {"contents": list(contents), "marker": marker},
+                                               tab)
+        except (*COPYQ_ERRORS, ValueError) as e:
+            logger.error(f"批量删除时发生错误: {e}")
+            removed = None
+        discard_tab_index(tab)
+        return removed
+
+async def _acquire(lock):
+    """轮询获取线程锁，等待期间不阻塞事件循环，也可以被取消"""
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(0.05)
+
+class _EventBridge:
+    """把监控线程中的文件变化转交给事件循环，接口与 SyncScheduler.submit 相同"""
+    def __init__(self, loop, queue, vault):
+        self.loop = loop
+        self.queue = queue
+        self.vault = vault
+
+    def submit(self, path):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (self.vault, path))
+
+class AsyncSyncEngine:
+    def __init__(self, client=None, quiet_seconds=SYNC_DEBOUNCE_SECONDS):
+        """
+        :param client: AsyncCopyQClient，默认按配置创建
+        :param quiet_seconds: 监控模式下合并文件变化的安静窗口（秒）
+        """
+        self.client = client or AsyncCopyQClient()
+        self.quiet_seconds = quiet_seconds
+        self._vault_semaphore = None  # 限制同时同步的笔记数，在事件循环中首次同步时创建
+
+    async def sync(self, md_path=None, data_dir=None):
+        """执行一次同步，参数和返回值与 sync_logic.run_one_time_sync 相同"""
+        vault = sync_logic.get_vault(md_path, data_dir)
+        if self._vault_semaphore is None:
+            self._vault_semaphore = asyncio.Semaphore(max(1, VAULT_SYNC_WORKERS))
+        async with self._vault_semaphore:
+            # 与同一进程中其他线程的同步（如守护进程的请求）互斥
+            await _acquire(vault.lock)
+            try:
+                vault.state = "syncing"
+                try:
+                    result = await self._sync_locked(vault)
+                except Exception as e:
+                    vault.record_result(error=str(e))
+                    raise
+                vault.record_result(result)
+                return result
+            finally:
+                vault.lock.release()
+
+    async def _sync_locked(self, vault):
+        with sync_metrics.collecting() as metrics:
+            plan, result = await asyncio.to_thread(vault.plan)
+            if plan is not None:
+                # 写入同一标签页的同步依次进行
+                await _acquire(tab_lock(vault.tab))
+                try:
+                    if plan.pending_retags:
+                        plan.apply_retag_results(await self.client.update_tags(plan.retag_items, tab=vault.tab))
+
+                    inserted = []
+                    if plan.pending_exports:
+                        index = await self.client.get_tab_index(vault.tab) if CHECK_DUPLICATES else None
+                        inserted = await self.client.export_batch(plan.export_items, tab=vault.tab, index=index,
+                                                                    marker=vault.marker)
+                        if False in inserted:
+                            plan.present_states = await self.client.update_tags(plan.present_items(inserted),
+                                                                                tab=vault.tab)
+
+                    removed_count = 0
+                    if plan.to_remove:
+                        removed_count = await self.client.remove_items(plan.to_remove, tab=vault.tab, marker=vault.marker)
+                finally:
+                    tab_lock(vault.tab).release()
+
+                result = await asyncio.to_thread(vault.finish, plan, inserted, removed_count)
+        result["metrics"] = metrics.as_dict()
+        return result
+
+    async def sync_all(self, vaults=None):
+        """并发同步多个笔记，参数和返回值与 sync_logic.sync_all 相同"""
+        vaults = sync_logic.configured_vaults() if vaults is None else vaults
+        results = await asyncio.gather(*(self.sync(vault.md_path) for vault in vaults), return_exceptions=True)
+        summary = {}
+        for vault, result in zip(vaults, results):
+            if isinstance(result, Exception):
+                # 与 sync_logic.sync_all 相同，一个笔记出错不影响其他笔记
+                logger.error(f"同步笔记 {vault.md_path} 失败: {result}")
+                result = {"new": 0, "updated": 0, "error": str(result)}
+            elif isinstance(result, BaseException):
+                raise result
+            summary[vault.md_path] = result
+        return summary
+
+    async def _next_batch(self, queue):
+        """等待文件变化，在安静窗口内合并后续变化，返回 (笔记, 变化文件路径) 集合"""
+        changed = {await queue.get()}
+        while True:
+            try:
+                changed.add(await asyncio.wait_for(queue.get(), self.quiet_seconds))
+            except asyncio.TimeoutError:
+                return changed
+
+    async def watch(self):
+        """执行初始同步后持续监控所有配置的笔记，直到任务被取消"""
+        from watchdog.observers import Observer
+        import watcher
+
+        vaults = sync_logic.configured_vaults()
+        if not await asyncio.to_thread(get_session().health_check):
+            logger.warning("CopyQ 当前不可用，同步时将自动重试连接。")
+
+        logger.info("执行初始同步...")
+        await self._drain(self.sync_all(vaults))
+
+        queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        observer = Observer()
+        router = watcher.VaultEventRouter(observer)
+        handlers = {}
+        for vault in vaults:
+            handlers[vault] = await asyncio.to_thread(watcher.SyncEventHandler, vault, _EventBridge(loop, queue, vault))
+            router.add(handlers[vault])
+        observer.start()
+        for vault in vaults:
+            logger.info(f"已启动对 {vault.md_path} 及其引用的文件监控（标签页 {vault.tab}）。")
+        try:
+            while True:
+                changes = await self._next_batch(queue)
+                changed_vaults = list(dict.fromkeys(vault for vault, _ in changes))
+                logger.info(f"合并 {len(changes)} 个文件的变化，触发 {len(changed_vaults)} 个笔记的同步...")
+                await self._drain(self.sync_all(changed_vaults))
+                for vault in changed_vaults:
+                    await asyncio.to_thread(handlers[vault].update_watched_files)
+        finally:
+            observer.stop()
+            await asyncio.to_thread(observer.join)
+            await asyncio.to_thread(sync_logic.save_caches)
+
+    @staticmethod
+    async def _drain(coro):
+        """
+        执行同步；任务在同步过程中被取消（停止监控）时，先等待同步完成（最多 SHUTDOWN_TIMEOUT 秒）再退出，
+        不在写入 CopyQ 或命令存储的中途中断
+        """
+        task = asyncio.ensure_future(coro)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            try:
+                await asyncio.wait_for(task, SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"进行中的同步未在 {SHUTDOWN_TIMEOUT} 秒内完成，已中断。")
+            except Exception:
+                logger.exception("同步任务执行失败")
+            raise
+
+# 以下函数与 sync_logic 中的同名函数接口相同，入口程序可以直接替换使用
+
+_loop = None
+_watch_task = None
+_watch_stopped = threading.Event()  # 监控任务结束（已等待同步完成并保存缓存）
+
+def run_one_time_sync(md_path=None, data_dir=None):
+    """在新的事件循环中执行一次同步"""
+    return asyncio.run(AsyncSyncEngine().sync(md_path, data_dir))
+
+def sync_all(vaults=None):
+    """在新的事件循环中同步多个笔记"""
+    return asyncio.run(AsyncSyncEngine().sync_all(vaults))
+
+async def _watch_main():
+    global _loop, _watch_task
+    _loop = asyncio.get_running_loop()
+    _watch_task = asyncio.current_task()
+    _watch_stopped.clear()
+    try:
+        await AsyncSyncEngine().watch()
+    except asyncio.CancelledError:
+        logger.info("文件监控已取消。")
+    finally:
+        _loop = None
+        _watch_task = None
+        _watch_stopped.set()
+
+def start_watching(blocking=True):
+    """
+    启动文件监控，事件循环运行在当前线程（blocking=True）或新的后台线程中
+    """
+    if _watch_task is not None:
+        logger.warning("监控已在运行中。")
+        return
+    if not blocking:
+        threading.Thread(target=start_watching, name="AsyncSyncWatcher", daemon=True).start()
+        return
+    try:
+        asyncio.run(_watch_main())
+    except KeyboardInterrupt:
+        logger.info("检测到中断信号，正在停止监控...")
+
+def stop_watching(timeout=SHUTDOWN_TIMEOUT):
+    """
+    取消监控任务，可以从任意线程调用
+    :param timeout: 等待进行中的同步完成并保存缓存的最长时间（秒），为 0 时只发送停止信号
+    """
+    loop, task = _loop, _watch_task
+    if loop is None or task is None:
+        logger.info("文件监控未在运行。")
+        return False
+    loop.call_soon_threadsafe(task.cancel)
+    logger.info("文件监控停止信号已发送。")
+    if timeout:
+        _watch_stopped.wait(timeout)
+    return True
@@ -1,32 +1,296 @@
-import subprocess
-from config import COPYQ_PATH, DEFAULT_TAB, DEFAULT_TAGS, CHECK_DUPLICATES
+import json
+import threading
+from config import DEFAULT_TAB, DEFAULT_TAGS, CHECK_DUPLICATES, EXPORT_BATCH_SIZE, USE_TAB_INDEX
+import sync_metrics
+from content_hash import content_digest
+from copyq_session import get_session, COPYQ_ERRORS
 
-def check_content_exists(content, tab=DEFAULT_TAB):
+# 内容规范化函数，规则与 content_hash.normalize_content 相同，拼接在需要比较内容的脚本开头
+NORMALIZE_JS = (
+    'function normalize(text) { '
+    '    var lines = text.replace(/\\r\\n?/g, "\\n").split("\\n"); '
+    '    for (var n = 0; n < lines.length; ++n) { '
+    '        lines[n] = lines[n].replace(/[ \\t]+$/, ""); '
+    '    } '
+    '    return lines.join("\\n").replace(/^[ \\t\\n]+|[ \\t\\n]+$/g, ""); '
+    '} '
+)
+
+# 逐条检查内容是否存在的脚本，待检查内容通过标准输入传入
+CONTENT_EXISTS_SCRIPT = NORMALIZE_JS + (
+    'var content = normalize(str(input())); '
+    'var exists = false; '
+    'for (var i = 0; i < size(); ++i) { '
+    '    if (normalize(str(read(i))) === content) { '
+    '        exists = true; '
+    '        break; '
+    '    } '
+    '} '
+    'print(exists);'
+)
+
+# 本工具写入的条目带有这个格式的标记，值为写入该条目的笔记的标识（VaultSync.marker）；
+# 对账时只删除本笔记的标记（或命令存储记录为本工具写入）的条目，同一标签页中其他笔记的条目不受影响
+MARKER_MIME = "application/x-copyq-md-sync"
+# 按笔记区分标记之前写入的条目的标记值，无法判断来自哪个笔记
+LEGACY_MARKER = "1"
+
+# 批量导出脚本：从标准输入读取 JSON，先扫描一次标签页建立（规范化的）内容集合，再依次写入不存在的内容
+EXPORT_BATCH_SCRIPT = NORMALIZE_JS + (
+    'var data = JSON.parse(str(input())); '
+    'var existing = Object.create(null); '
+    'if (data.check) { '
+    '    for (var i = 0; i < size(); ++i) { '
+    '        existing[normalize(str(read(i)))] = true; '
+    '    } '
+    '} '
+    'var inserted = []; '
+    'for (var j = 0; j < data.items.length; ++j) { '
+    '    var item = data.items[j]; '
+    '    var key = normalize(item.content); '
+    '    if (existing[key] === true) { '
+    '        inserted.push(false); '
+    '        continue; '
+    '    } '
+    '    write(0, "text/plain", item.content, "application/x-copyq-tags", item.tags, "' + MARKER_MIME + '", data.marker); '
+    '    existing[key] = true; '
+    '    inserted.push(true); '
+    '} '
+    'print(JSON.stringify(inserted));'
+)
+
+# 批量删除脚本：扫描一次标签页，删除内容（规范化后）在给定列表中、且带有给定笔记标记的条目，
+# 用户自己添加的和其他笔记写入的相同内容不受影响
+REMOVE_ITEMS_SCRIPT = NORMALIZE_JS + (
+    'var targets = Object.create(null); '
+    'var data = JSON.parse(str(input())); '
+    'for (var j = 0; j < data.contents.length; ++j) { '
+    '    targets[normalize(data.contents[j])] = true; '
+    '} '
+    'var rows = []; '
+    'for (var i = 0; i < size(); ++i) { '
+    '    if (targets[normalize(str(read(i)))] === true && str(read("' + MARKER_MIME + '", i)) === data.marker) { '
+    '        rows.push(i); '
+    '    } '
+    '} '
+    'for (var k = rows.length - 1; k >= 0; --k) { '
+    '    remove(rows[k]); '
+    '} '
+    'print(rows.length);'
+)
+
+# 对账脚本：扫描一次标签页，找出（规范化后）不在笔记中（keep）且由本笔记写入的条目
+# （带本笔记的标记或旧的标记，或没有标记但在 known 中），apply 为真时一并删除；输出这些条目的内容
+RECONCILE_SCRIPT = NORMALIZE_JS + (
+    'var data = JSON.parse(str(input())); '
+    'var keep = Object.create(null); '
+    'for (var j = 0; j < data.keep.length; ++j) { '
+    '    keep[normalize(data.keep[j])] = true; '
+    '} '
+    'var known = Object.create(null); '
+    'for (var j = 0; j < data.known.length; ++j) { '
+    '    known[normalize(data.known[j])] = true; '
+    '} '
+    'var rows = []; '
+    'var stale = []; '
+    'for (var i = 0; i < size(); ++i) { '
+    '    var text = str(read(i)); '
+    '    var key = normalize(text); '
+    '    if (keep[key] === true) { '
+    '        continue; '
+    '    } '
+    '    var marker = str(read("' + MARKER_MIME + '", i)); '
+    '    if (marker === data.marker || marker === "' + LEGACY_MARKER + '" || (marker === "" && known[key] === true)) { '
+    '        rows.push(i); '
+    '        stale.push(text); '
+    '    } '
+    '} '
+    'if (data.apply) { '
+    '    for (var k = rows.length - 1; k >= 0; --k) { '
+    '        remove(rows[k]); '
+    '    } '
+    '} '
+    'print(JSON.stringify(stale));'
+)
+
+# 批量更新标签脚本：从标准输入读取 [{content, tags}]，扫描一次标签页，按规范化内容找到条目，
+# 把缺少的标签追加到 application/x-copyq-tags（保留用户在 CopyQ 中添加的标签），不重新插入条目。
+# 输出与输入一一对应的状态：1 已更新，0 标签已齐全，-1 标签页中没有该内容
+UPDATE_TAGS_SCRIPT = NORMALIZE_JS + (
+    'var data = JSON.parse(str(input())); '
+    'var targets = Object.create(null); '
+    'var states = []; '
+    'for (var j = 0; j < data.length; ++j) { '
+    '    targets[normalize(data[j].content)] = j; '
+    '    states.push(-1); '
+    '} '
+    'for (var i = 0; i < size(); ++i) { '
+    '    var j = targets[normalize(str(read(i)))]; '
+    '    if (j === undefined) { '
+    '        continue; '
+    '    } '
+    '    var current = []; '
+    '    var existing = str(read("application/x-copyq-tags", i)).split(","); '
+    '    for (var k = 0; k < existing.length; ++k) { '
+    '        var tag = existing[k].trim(); '
+    '        if (tag && current.indexOf(tag) < 0) { '
+    '            current.push(tag); '
+    '        } '
+    '    } '
+    '    var added = false; '
+    '    var wanted = data[j].tags.split(","); '
+    '    for (var k = 0; k < wanted.length; ++k) { '
+    '        var tag = wanted[k].trim(); '
+    '        if (tag && current.indexOf(tag) < 0) { '
+    '            current.push(tag); '
+    '            added = true; '
+    '        } '
+    '    } '
+    '    if (added) { '
+    '        change(i, "application/x-copyq-tags", current.join(",")); '
+    '        states[j] = 1; '
+    '    } else if (states[j] < 0) { '
+    '        states[j] = 0; '
+    '    } '
+    '} '
+    'print(JSON.stringify(states));'
+)
+
+# 读取标签页全部文本内容的脚本，用于在本地建立内容索引
+TAB_CONTENTS_SCRIPT = (
+    'var contents = []; '
+    'for (var i = 0; i < size(); ++i) { '
+    '    contents.push(str(read(i))); '
+    '} '
+    'print(JSON.stringify(contents));'
+)
+
+# 标签页指纹脚本：只读取条目数量及首尾两条内容
+TAB_FINGERPRINT_SCRIPT = (
+    'var n = size(); '
+    'print(JSON.stringify([n, n ? str(read(0)) : "", n ? str(read(n - 1)) : ""]));'
+)
+
+def _content_key(content):
+    """计算内容规范化后的定长哈希，作为索引键，近似重复的内容视为已存在"""
+    return content_digest(content)
+
+class TabIndex:
+    """
+    标签页内容索引，在本地以 O(1) 判断内容是否已存在。
+    通过条目数量和首尾条目组成的指纹判断索引是否过期。
+    """
+    def __init__(self, tab):
+        self.tab = tab
+        self.keys = set()
+        self.fingerprint = None
+
+    @staticmethod
+    def make_fingerprint(count, first, last):
+        """由 TAB_FINGERPRINT_SCRIPT 的输出计算指纹"""
+        return (count, _content_key(first), _content_key(last)) if count else (0, None, None)
+
+    def load(self, contents):
+        """用 TAB_CONTENTS_SCRIPT 读取到的全部内容重建索引"""
+        self.keys = {_content_key(content) for content in contents}
+        if contents:
+            self.fingerprint = self.make_fingerprint(len(contents), contents[0], contents[-1])
+        else:
+            self.fingerprint = (0, None, None)
+
+    def is_current(self, fingerprint_output):
+        """判断 TAB_FINGERPRINT_SCRIPT 的输出是否与索引一致"""
+        return self.fingerprint is not None and self.make_fingerprint(*fingerprint_output) == self.fingerprint
+
+    def refresh(self):
+        """重新读取整个标签页并重建索引"""
+        self.load(_eval_json(TAB_CONTENTS_SCRIPT, tab=self.tab, retry=True))
+
+    def ensure_fresh(self):
+        """指纹变化时刷新索引"""
+        if self.fingerprint is None:
+            self.refresh()
+            return
+        if not self.is_current(_eval_json(TAB_FINGERPRINT_SCRIPT, tab=self.tab, retry=True)):
+            self.refresh()
+
+    def contains(self, content):
+        return _content_key(content) in self.keys
+
+    def record_inserted(self, contents, fingerprint_output=None):
+        """
+        记录本进程写入的内容，同步更新索引和指纹
+        :param contents: 写入的内容，未提供 fingerprint_output 时按依次插入到第 0 行的顺序计算指纹
+        :param fingerprint_output: 写入后 TAB_FINGERPRINT_SCRIPT 的输出，多个批次并发写入、顺序未知时提供
+        """
+        for content in contents:
+            self.keys.add(_content_key(content))
+        if fingerprint_output is not None:
+            self.fingerprint = self.make_fingerprint(*fingerprint_output)
+            return
+        if not contents:
+            return
+        count, first, last = self.fingerprint
+        if count == 0:
+            last = _content_key(contents[0])
+        self.fingerprint = (count + len(contents), _content_key(contents[-1]), last)
+
+_tab_indexes = {}
+# 按标签页串行化写入：多个笔记同步到同一标签页时，依次读取索引、写入和删除，索引不会被并发修改
+_tab_locks = {}
+_tab_locks_guard = threading.Lock()
+
+def tab_lock(tab=DEFAULT_TAB):
+    """获取标签页的写入锁，同一标签页始终返回同一把锁"""
+    with _tab_locks_guard:
+        lock = _tab_locks.get(tab)
+        if lock is None:
+            lock = _tab_locks[tab] = threading.Lock()
+        return lock
+
+def get_tab_index(tab=DEFAULT_TAB):
+    """
+    获取指定标签页的内容索引，必要时刷新
+    :param tab: CopyQ的标签页
+    :return: 最新的 TabIndex；读取失败或未启用索引时返回 None，调用方应退回逐条检查
+    """
+    if not USE_TAB_INDEX:
+        return None
+    index = cached_tab_index(tab)
+    try:
+        with sync_metrics.stage("tab_index"):
+            index.ensure_fresh()
+    except (*COPYQ_ERRORS, ValueError) as e:
+        print(f"读取标签页索引时发生错误: {e}")
+        discard_tab_index(tab)
+        return None
+    return index
+
+def cached_tab_index(tab=DEFAULT_TAB):
+    """获取进程内缓存的标签页索引（不刷新），不存在时创建一个空索引"""
+    index = _tab_indexes.get(tab)
+    if index is None:
+        index = _tab_indexes[tab] = TabIndex(tab)
+    return index
+
+def discard_tab_index(tab=DEFAULT_TAB):
+    """丢弃标签页索引，下次使用时重新读取"""
+    _tab_indexes.pop(tab, None)
+
+def check_content_exists(content, tab=DEFAULT_TAB, index=None):
     """
     检查内容是否已存在于指定标签页
     :param content: 要检查的内容
     :param tab: CopyQ的标签页
+    :param index: 标签页内容索引，提供时直接在本地查询，否则逐条扫描标签页
     :return: 是否存在
     """
+    if index is not None:
+        return index.contains(content)
     try:
-        result = subprocess.run(
-            [COPYQ_PATH, 'tab', tab, 'eval', 
-             f'var content = "{content.replace(chr(34), chr(92)+chr(34))}"; '
-             'var exists = false; '
-             'for (var i = 0; i < size(); ++i) { '
-             '    if (str(read(i)) === content) { '
-             '        exists = true; '
-             '        break; '
-             '    } '
-             '} '
-             'print(exists);'],
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            check=True
-        )
-        return result.stdout.strip().lower() == 'true'
-    except subprocess.CalledProcessError as e:
+        output = get_session().run(['tab', tab, 'eval', '--', CONTENT_EXISTS_SCRIPT], input=content, retry=True)
+        return output.strip().lower() == 'true'
+    except COPYQ_ERRORS as e:
         print(f"检查内容是否存在时发生错误: {e}")
         return False
 
@@ -43,29 +307,175 @@ def export_to_clipboard(content, tab=DEFAULT_TAB, tags=DEFAULT_TAGS, need_check=
         return False
         
     command = [
-        COPYQ_PATH, 'tab', tab,
+        'tab', tab,
         'write', 'text/plain', content,
         'application/x-copyq-tags', tags
     ]
-    subprocess.run(command)
+    try:
+        get_session().run(command)
+    except COPYQ_ERRORS as e:
+        print(f"写入剪贴板时发生错误: {e}")
+        return False
     return True
 
+def _eval_json(script, payload=None, tab=DEFAULT_TAB, retry=False):
+    """
+    在指定标签页执行脚本，通过标准输入传递 JSON 数据，避免命令行转义和长度限制。
+    脚本放在 `--` 之后，CopyQ 不会把其中的 \\n、\\t、\\\\ 当作转义序列展开
+    :param script: 要执行的 CopyQ 脚本，脚本需打印 JSON 结果
+    :param payload: 传给脚本的数据，为 None 时不传递输入
+    :param tab: CopyQ的标签页
+    :param retry: 失败后是否重新连接并重试，只应对只读脚本开启
+    :return: 脚本输出解析后的对象
+    """
+    output = get_session().run(
+        ['tab', tab, 'eval', '--', script],
+        input=json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+        retry=retry
+    )
+    return json.loads(output)
+
+def export_batch(items, tab=DEFAULT_TAB, need_check=CHECK_DUPLICATES, batch_size=EXPORT_BATCH_SIZE, index=None,
+                 marker=LEGACY_MARKER):
+    """
+    批量导出内容到剪贴板，每批内容只启动一次 CopyQ 进程
+    :param items: (内容, 标签) 元组列表，标签为逗号分隔的字符串
+    :param tab: CopyQ的标签页，默认为配置的DEFAULT_TAB
+    :param need_check: 是否需要检查内容是否存在，默认为配置的CHECK_DUPLICATES
+    :param batch_size: 每次 CopyQ 调用处理的最大条数
+    :param index: 标签页内容索引，提供时在本地完成重复检查，CopyQ 端不再扫描标签页
+    :param marker: 写入 MARKER_MIME 的笔记标识
+    :return: 与 items 一一对应的列表：True 表示已写入，False 表示标签页中已有该内容，
+             None 表示所在批次的调用失败、写入结果未知
+    """
+    inserted = [False] * len(items)
+    positions = list(range(len(items)))
+    if need_check and index is not None:
+        seen = set()
+        positions = []
+        for position, (content, _) in enumerate(items):
+            key = content_digest(content)
+            if key not in index.keys and key not in seen:
+                seen.add(key)
+                positions.append(position)
+
+    for start in range(0, len(positions), batch_size):
+        sync_metrics.progress(start, len(positions))
+        chunk = positions[start:start + batch_size]
+        payload = {
+            "check": need_check and index is None,
+            "marker": marker,
+            "items": [{"content": items[p][0], "tags": items[p][1]} for p in chunk]
+        }
+        sync_metrics.count("export_batches")
+        try:
+            with sync_metrics.stage("export"):
+                flags = _eval_json(EXPORT_BATCH_SCRIPT, payload, tab)
+        except (*COPYQ_ERRORS, ValueError) as e:
+            print(f"批量导出时发生错误: {e}")
+            for position in chunk:
+                inserted[position] = None
+            if index is not None:
+                # 写入结果未知，丢弃索引以便下次重新读取
+                discard_tab_index(tab)
+                index = None
+            continue
+        for position, flag in zip(chunk, flags):
+            inserted[position] = bool(flag)
+        if index is not None:
+            index.record_inserted([items[p][0] for p, flag in zip(chunk, flags) if flag])
+    sync_metrics.progress(len(positions), len(positions))
+    sync_metrics.count("items_written", inserted.count(True))
+    return inserted
+
+def unique_tag_updates(items):
+    """
+    按规范化内容合并待更新标签的条目，同一内容的标签合并为一项
+    :param items: (内容, 标签) 元组列表，标签为逗号分隔的字符串
+    :return: (传给 UPDATE_TAGS_SCRIPT 的列表, 与 items 一一对应的列表下标)
+    """
+    payload = []
+    positions = {}
+    slots = []
+    for content, tags in items:
+        key = content_digest(content)
+        slot = positions.get(key)
+        if slot is None:
+            slot = positions[key] = len(payload)
+            payload.append({"content": content, "tags": tags})
+        elif tags:
+            payload[slot]["tags"] += "," + tags
+        slots.append(slot)
+    return payload, slots
+
+def update_tags(items, tab=DEFAULT_TAB):
+    """
+    在一次 CopyQ 调用中为已存在的条目追加标签，不重新插入条目，标签页内容索引不受影响
+    :param items: (内容, 标签) 元组列表，标签为逗号分隔的字符串
+    :param tab: CopyQ的标签页，默认为配置的DEFAULT_TAB
+    :return: 与 items 一一对应的状态列表：1 已更新，0 标签已齐全，-1 标签页中没有该内容；调用失败时返回 None
+    """
+    if not items:
+        return []
+    payload, slots = unique_tag_updates(items)
+    try:
+        with sync_metrics.stage("update_tags"):
+            states = _eval_json(UPDATE_TAGS_SCRIPT, payload, tab)
+    except (*COPYQ_ERRORS, ValueError) as e:
+        print(f"批量更新标签时发生错误: {e}")
+        return None
+    sync_metrics.count("items_retagged", sum(1 for state in states if state > 0))
+    return [states[slot] for slot in slots]
+
+def remove_from_clipboard(contents, tab=DEFAULT_TAB, marker=LEGACY_MARKER):
+    """
+    从标签页中批量删除本笔记写入的内容，只启动一次 CopyQ 进程
+    :param contents: 要删除的内容列表
+    :param tab: CopyQ的标签页，默认为配置的DEFAULT_TAB
+    :param marker: 笔记标识，只删除 MARKER_MIME 为该值的条目
+    :return: 实际删除的条目数；调用失败时返回 None
+    """
+    if not contents:
+        return 0
+    try:
+        with sync_metrics.stage("remove"):
+            removed = _eval_json(REMOVE_ITEMS_SCRIPT, {"contents": list(contents), "marker": marker}, tab)
+    except (*COPYQ_ERRORS, ValueError) as e:
+        print(f"批量删除时发生错误: {e}")
+        removed = None
+    # 删除会改变标签页中间的内容，指纹无法察觉，直接丢弃索引
+    discard_tab_index(tab)
+    return removed
+
+def reconcile_tab(keep, known, tab=DEFAULT_TAB, apply=False, marker=LEGACY_MARKER):
+    """
+    在一次 CopyQ 调用中找出（并可删除）标签页中已不在笔记里的本工具条目
+    :param keep: 同步到该标签页的所有笔记中当前所有命令的内容，这些条目不会被删除
+    :param known: 命令存储记录为本工具写入的内容，用于识别加上标记之前导出的条目
+    :param tab: CopyQ的标签页，默认为配置的DEFAULT_TAB
+    :param apply: 为 True 时删除这些条目，否则只返回列表（预演）
+    :param marker: 本笔记的标识，其他笔记写入的条目不会被删除
+    :return: 这些条目的内容列表；调用失败时返回 None
+    """
+    payload = {"keep": list(keep), "known": list(known), "apply": apply, "marker": marker}
+    try:
+        with sync_metrics.stage("reconcile"):
+            stale = _eval_json(RECONCILE_SCRIPT, payload, tab)
+    except (*COPYQ_ERRORS, ValueError) as e:
+        print(f"对账时发生错误: {e}")
+        return None
+    if apply and stale:
+        discard_tab_index(tab)
+    return stale
+
 def import_from_clipboard():
     """
     从剪贴板导入内容
     :return: 返回剪贴板内容
     """
     try:
-
-        result = subprocess.run(
-            [COPYQ_PATH, 'read', '0'], 
-            capture_output=True, 
-            text=True,
-            encoding='utf-8',
-            check=True
-        )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
+        return get_session().run(['read', '0'], retry=True).strip()
+    except COPYQ_ERRORS as e:
         print(f"读取剪贴板失败: {e}")
         return None
 
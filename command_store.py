@@ -0,0 +1,318 @@
+"""
+追加写入的命令存储。
+
+命令记录保存在 JSONL 日志中，第一行是标识本次压缩生成的文件头，之后每行一个操作：
+    {"op": "header", "generation": "..."}
+    {"op": "put", "command": {...命令记录...}}
+    {"op": "del", "command": "命令内容"}
+加载时按顺序回放日志，在内存中建立以命令内容（规范化后）哈希为键的索引，查询和更新都是 O(1)。
+修改只追加到日志末尾；失效行过多时整体压缩重写（写入临时文件后替换）。首次使用时自动从旧的 commands_store.json 迁移。
+进程在追加中途退出留下的不完整行会被跳过，不影响之前和之后的记录。
+
+对账（sync_logic.reconcile）从 CopyQ 删除的命令保留为墓碑记录（deleted_at 非空），
+查询时视为不存在，再次出现在笔记中时作为新命令导出；压缩时丢弃超过 TOMBSTONE_RETENTION_DAYS 天的墓碑。
+
+内存中的记录是 CommandRecord：标签按名称驻留为整数 ID，记录只保存标签 ID 的位掩码
+（相同的标签组合共用同一个整数对象），时间戳保存为 Unix 时间（秒）；
+写入日志时转换回原有的字典格式（标签列表、ISO 时间字符串），日志格式不变。
+"""
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from content_hash import content_hash
+from config import STORE_COMPACT_RATIO, TOMBSTONE_RETENTION_DAYS
+from utils import atomic_write
+
+def command_key(content):
+    """计算命令内容规范化后的定长哈希键（见 content_hash），近似重复的命令共用一条记录"""
+    return content_hash(content)
+
+# --- 标签驻留 ---
+# 标签名 <-> 整数 ID 在进程内全局共用，ID 只增不减
+_tag_ids = {}
+_tag_names = []
+_masks = {}  # 位掩码 -> 同值的唯一整数对象，相同标签组合的记录共用
+_mask_tags = {}  # 位掩码 -> 标签元组，写日志时不必逐位解码
+_text_masks = {}  # 逗号分隔的标签文本 -> 位掩码，解析结果中同一标题下的命令标签文本相同
+_tag_lock = threading.Lock()
+
+def _intern_mask(mask):
+    return _masks.setdefault(mask, mask)
+
+def tag_mask(tags):
+    """
+    把标签转换为位掩码，新标签在此时分配 ID
+    :param tags: 逗号分隔的标签文本或标签列表
+    :return: 位掩码（整数），第 i 位表示 ID 为 i 的标签
+    """
+    if isinstance(tags, str):
+        mask = _text_masks.get(tags)
+        if mask is None:
+            mask = _text_masks[tags] = tag_mask(tags.split(',') if tags else [])
+        return mask
+    mask = 0
+    for tag in tags:
+        tag_id = _tag_ids.get(tag)
+        if tag_id is None:
+            with _tag_lock:
+                tag_id = _tag_ids.get(tag)
+                if tag_id is None:
+                    tag_id = _tag_ids[tag] = len(_tag_names)
+                    _tag_names.append(tag)
+        mask |= 1 << tag_id
+    return _intern_mask(mask)
+
+def mask_tags(mask):
+    """位掩码对应的标签列表，按标签 ID（首次出现的顺序）排列"""
+    tags = _mask_tags.get(mask)
+    if tags is None:
+        tags = []
+        remaining = mask
+        while remaining:
+            lowest = remaining & -remaining
+            tags.append(_tag_names[lowest.bit_length() - 1])
+            remaining ^= lowest
+        tags = _mask_tags[_intern_mask(mask)] = tuple(tags)
+    return list(tags)
+
+def _to_timestamp(value):
+    """日志中的 ISO 时间字符串转换为 Unix 时间，None 保持不变"""
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+def _to_isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+class CommandRecord:
+    """一条命令记录，标签为位掩码，时间为 Unix 时间（秒）"""
+    __slots__ = ("command", "tag_mask", "created_at", "last_exported", "deleted_at", "extra")
+
+    def __init__(self, command, tags, created_at=None, last_exported=None, extra=None, deleted_at=None):
+        """
+        :param command: 命令内容
+        :param tags: 逗号分隔的标签文本、标签列表或位掩码
+        :param created_at: 创建时间（Unix 时间），默认为当前时间
+        :param last_exported: 最近一次导出到 CopyQ 的时间，未导出为 None
+        :param extra: 日志中其他字段组成的字典，写回时原样保留
+        :param deleted_at: 对账时从 CopyQ 删除的时间，非空表示墓碑记录
+        """
+        self.command = command
+        self.tag_mask = _intern_mask(tags) if isinstance(tags, int) else tag_mask(tags)
+        self.created_at = datetime.now().timestamp() if created_at is None else created_at
+        self.last_exported = last_exported
+        self.deleted_at = deleted_at
+        self.extra = extra or None
+
+    @property
+    def tags(self):
+        return mask_tags(self.tag_mask)
+
+    def has_tags(self, mask):
+        """记录是否已包含掩码中的所有标签"""
+        return mask & ~self.tag_mask == 0
+
+    def add_tags(self, mask):
+        """
+        合并标签
+        :return: 新增的标签列表
+        """
+        missing = mask & ~self.tag_mask
+        self.tag_mask = _intern_mask(self.tag_mask | mask)
+        return mask_tags(missing)
+
+    @classmethod
+    def from_dict(cls, command_data):
+        """从日志或旧存储中的字典创建记录"""
+        extra = {key: value for key, value in command_data.items()
+                 if key not in ("command", "tags", "created_at", "last_exported", "deleted_at")}
+        # 标签本身不含逗号，按文本查掩码缓存，日志中相同的标签组合只转换一次
+        return cls(command_data["command"], ','.join(command_data.get("tags", [])),
+                   _to_timestamp(command_data.get("created_at")), _to_timestamp(command_data.get("last_exported")),
+                   extra, _to_timestamp(command_data.get("deleted_at")))
+
+    def to_dict(self):
+        """转换为日志中的字典格式"""
+        command_data = {
+            "command": self.command,
+            "tags": self.tags,
+            "created_at": _to_isoformat(self.created_at),
+            "last_exported": _to_isoformat(self.last_exported),
+        }
+        if self.deleted_at is not None:
+            command_data["deleted_at"] = _to_isoformat(self.deleted_at)
+        if self.extra:
+            command_data.update(self.extra)
+        return command_data
+
+def load_legacy_store(store_path):
+    """读取旧格式（整体 JSON 列表）的命令存储"""
+    if os.path.exists(store_path):
+        with open(store_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return []
+
+class CommandStore:
+    def __init__(self, log_path, legacy_path=None):
+        """
+        :param log_path: JSONL 日志路径
+        :param legacy_path: 旧的 commands_store.json 路径，日志不存在时从中迁移
+        """
+        self.log_path = str(log_path)
+        self.legacy_path = str(legacy_path) if legacy_path else None
+        self.records = {}  # 哈希键 -> CommandRecord
+        self._dirty = {}  # 待写入的哈希键 -> 操作类型（"put" 或 "del"）
+        self._deleted = {}  # 待写入删除操作的哈希键 -> 命令内容
+        self._log_lines = 0
+        self._log_offset = 0  # 已读取或写入到的日志位置，用于发现其他进程追加的内容
+        self._header = None  # 当前日志的文件头，变化说明日志已被其他进程压缩重写
+        if not os.path.exists(self.log_path) and self.legacy_path and os.path.exists(self.legacy_path):
+            self._migrate_legacy()
+        self.refresh()
+
+    def _migrate_legacy(self):
+        """一次性把旧的 JSON 存储迁移为日志，旧文件改名保留"""
+        for command_data in load_legacy_store(self.legacy_path):
+            self.records[command_key(command_data['command'])] = CommandRecord.from_dict(command_data)
+        self.compact()
+        os.replace(self.legacy_path, self.legacy_path + ".migrated")
+        print(f"已将命令存储迁移到 {self.log_path}，共 {len(self.records)} 条")
+
+    def _apply_line(self, line):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # 进程在追加中途退出留下的不完整行，跳过；下次压缩时去掉
+            print(f"跳过命令存储中损坏的行: {line[:80]!r}")
+            self._log_lines += 1
+            return
+        if entry["op"] == "header":
+            return
+        if entry["op"] == "put":
+            record = CommandRecord.from_dict(entry["command"])
+            self.records[command_key(record.command)] = record
+        elif entry["op"] == "del":
+            self.records.pop(command_key(entry["command"]), None)
+        self._log_lines += 1
+
+    def refresh(self):
+        """
+        读取其他进程追加到日志中的内容；日志被其他进程压缩重写时重新加载
+        """
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, 'rb') as f:
+            header = f.readline()
+            if header != self._header or os.fstat(f.fileno()).st_size < self._log_offset:
+                self.records = {}
+                self._log_lines = 0
+                self._log_offset = 0
+                self._header = header
+            f.seek(self._log_offset)
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'):
+                    break  # 其他进程正在写入的不完整行，下次再读
+                self._log_offset += len(raw_line)
+                if raw_line.strip():
+                    self._apply_line(raw_line.decode('utf-8'))
+
+    def get(self, content):
+        """返回命令记录，不存在或只有墓碑时返回 None"""
+        record = self.records.get(command_key(content))
+        return record if record is not None and record.deleted_at is None else None
+
+    def __contains__(self, content):
+        return self.get(content) is not None
+
+    def __len__(self):
+        return sum(1 for _ in self.values())
+
+    def values(self):
+        """所有有效（非墓碑）记录"""
+        return (record for record in self.records.values() if record.deleted_at is None)
+
+    def tombstones(self):
+        return (record for record in self.records.values() if record.deleted_at is not None)
+
+    def put(self, record):
+        """
+        新增或更新一条命令记录，flush 时写入记录的最终状态
+        :param record: CommandRecord，也接受日志格式的字典
+        """
+        if isinstance(record, dict):
+            record = CommandRecord.from_dict(record)
+        key = command_key(record.command)
+        self.records[key] = record
+        self._dirty[key] = "put"
+
+    def tombstone(self, content, deleted_at=None):
+        """
+        把有效记录标记为已删除（墓碑），flush 时写入
+        :param deleted_at: 删除时间（Unix 时间），默认为当前时间
+        :return: 是否标记了记录
+        """
+        record = self.get(content)
+        if record is None:
+            return False
+        record.deleted_at = datetime.now().timestamp() if deleted_at is None else deleted_at
+        self.put(record)
+        return True
+
+    def delete(self, content):
+        key = command_key(content)
+        if self.records.pop(key, None) is not None:
+            self._dirty[key] = "del"
+            self._deleted[key] = content
+
+    def flush(self):
+        """把待写入的修改一次性追加到日志，必要时压缩"""
+        if not self._dirty:
+            return
+        lines = []
+        for key, op in self._dirty.items():
+            if op == "put":
+                entry = {"op": "put", "command": self.records[key].to_dict()}
+            else:
+                entry = {"op": "del", "command": self._deleted[key]}
+            lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._dirty = {}
+        self._deleted = {}
+        # 先读入其他进程追加的内容，再追加本次修改并回放到内存，保证内存与日志一致
+        self.refresh()
+        if self._header is None:
+            self._header = self._new_header()
+            lines.insert(0, self._header.decode('utf-8'))
+        data = "".join(lines).encode('utf-8')
+        partial = os.path.getsize(self.log_path) - self._log_offset if os.path.exists(self.log_path) else 0
+        if partial > 0:
+            # 日志末尾有没有换行的不完整行（写入中途退出留下的），先换行，本次的记录从新的一行开始
+            data = b"\n" + data
+            self._log_offset += partial
+            self._log_lines += 1
+        with open(self.log_path, 'ab') as f:
+            f.write(data)
+        self._log_offset += len(data)
+        for line in lines:
+            self._apply_line(line)
+        if self._log_lines > STORE_COMPACT_RATIO * len(self.records) + 100:
+            self.compact()
+
+    @staticmethod
+    def _new_header():
+        header = {"op": "header", "generation": uuid.uuid4().hex}
+        return (json.dumps(header) + "\n").encode('utf-8')
+
+    def compact(self):
+        """用当前所有记录重写日志，去掉被覆盖和已删除的行以及过期的墓碑"""
+        expire_before = datetime.now().timestamp() - TOMBSTONE_RETENTION_DAYS * 86400
+        self.records = {key: record for key, record in self.records.items()
+                        if record.deleted_at is None or record.deleted_at >= expire_before}
+        header = self._new_header()
+        lines = [json.dumps({"op": "put", "command": record.to_dict()}, ensure_ascii=False) + "\n"
+                 for record in self.records.values()]
+        data = header + "".join(lines).encode('utf-8')
+        atomic_write(self.log_path, data)
+        self._header = header
+        self._log_lines = len(lines)
+        self._log_offset = len(data)
@@ -1,9 +1,12 @@
 """
 配置文件，存储所有项目常量和配置参数
 """
+import os
 
-# CopyQ 路径配置
-COPYQ_PATH = "D:\\Software\\copyq-9.1.0\\copyq.exe"
+# CopyQ 路径配置，可通过环境变量 COPYQ_PATH 覆盖（例如指向 tools/fake_copyq.py）
+COPYQ_PATH = os.environ.get("COPYQ_PATH", "D:\\Software\\copyq-9.1.0\\copyq.exe")
+COPYQ_TIMEOUT = 60  # 单次 CopyQ 调用的超时时间（秒）
+COPYQ_AUTO_START = True  # CopyQ 不可用时是否尝试启动服务器
 
 # 标签页配置
 DEFAULT_TAB = "命令"
@@ -12,7 +15,41 @@ DEFAULT_TAGS = "测试,test"
 # 文件路径配置
 DATA_DIR = "data"
 MARKDOWN_FILE = "命令管理.md"
-COMMAND_STORE_FILE = "commands_store.json"
+COMMAND_STORE_FILE = "commands_store.json"  # 旧格式的命令存储，首次运行时迁移到 COMMAND_LOG_FILE
+COMMAND_LOG_FILE = "commands_store.jsonl"  # 追加写入的命令存储日志
+STORE_COMPACT_RATIO = 2  # 日志行数超过有效记录数的这个倍数时压缩
+TOMBSTONE_RETENTION_DAYS = 30  # 对账删除的命令在存储中保留墓碑记录的天数，压缩时丢弃更早的墓碑
 
 # 功能配置
-CHECK_DUPLICATES = True  # 是否检查重复命令 
\ No newline at end of file
+CHECK_DUPLICATES = True  # 是否检查重复命令
+DELETE_REMOVED_FROM_COPYQ = False  # 命令从 Markdown 中删除后，是否同时从 CopyQ 标签页删除
+PARSE_WORKERS = 0  # 并行解析引用文件的工作进程数，0 表示串行解析
+PARSE_EXECUTOR = "process"  # 并行解析使用 "process"（进程池）或 "thread"（线程池）
+MMAP_MIN_BYTES = 1024 * 1024  # 不小于这个大小（字节）的 Markdown 文件通过内存映射逐行读取和计算哈希，不整体读入内存
+SYNC_DEBOUNCE_SECONDS = 0.5  # 文件变化后等待的安静窗口（秒），窗口内的多次变化合并为一次同步
+EXPORT_BATCH_SIZE = 500  # 批量导出时每次 CopyQ 调用处理的最大条数
+USE_TAB_INDEX = True  # 是否在本地缓存标签页内容索引，关闭后退回逐条扫描
+SKIP_UNCHANGED_VAULT = True  # 主文件及其引用文件的内容与上次同步时相同时跳过解析和同步
+SYNC_STATE_FILE = "sync_state.json"  # 记录上次同步时的笔记哈希，重启后据此跳过没有变化的初始同步
+PARSE_CACHE_FILE = "parse_cache.pickle"  # 退出时把解析缓存保存到数据目录下的这个文件，重启后沿用；None 表示不保存
+SHUTDOWN_TIMEOUT = 5  # 停止监控、退出或重启时等待进行中的同步完成的最长时间（秒）
+
+# 多笔记配置
+# 每项为 (主 Markdown 文件路径, CopyQ 标签页)，相对路径以项目目录为基准，由同一个监控进程同步；
+# 为空时只同步 DATA_DIR/MARKDOWN_FILE 到 DEFAULT_TAB。例如：
+# VAULTS = [("data/命令管理.md", "命令"), ("~/notes/snippets.md", "片段")]
+VAULTS = []
+VAULT_SYNC_WORKERS = 4  # 同时同步的笔记数上限，写入同一标签页的同步仍依次进行
+
+# 同步引擎配置
+SYNC_ENGINE = "thread"  # 默认同步引擎："thread"（sync_logic，阻塞调用）或 "asyncio"（async_sync，并发调用 CopyQ）
+ASYNC_COPYQ_CONCURRENCY = 4  # asyncio 引擎同时运行的 CopyQ 客户端进程数上限
+
+# 同步指标配置
+METRICS_HISTORY_SIZE = 50  # 保留最近多少次同步的指标，用于托盘菜单显示上次耗时和 p95
+METRICS_LOG_FILE = None  # 非空时把每次同步的指标以 JSON 行追加到该文件，相对路径以项目目录为基准，例如 "data/sync_metrics.jsonl"
+
+# 同步守护进程配置
+DAEMON_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or "/tmp", "copyq_md_sync.sock")  # 守护进程的 Unix 域套接字路径
+DAEMON_PORT = 47653  # 不支持 Unix 域套接字的系统（如 Windows）上改为监听 127.0.0.1 的这个端口
+HOST_SYNC_DAEMON = False  # 托盘程序和 watch_and_sync.py 是否默认同时运行同步守护进程
@@ -0,0 +1,32 @@
+"""
+命令内容的规范化和哈希。
+
+同一条命令在不同文件、不同编辑器里常常只有空白上的差别：Windows 换行、行尾空格、首尾空行。
+反斜杠不做任何处理，`\\\\server` 和 `\\server` 是两条不同的命令。
+比较命令时先规范化，再计算 BLAKE2 哈希，这些近似重复的命令视为同一条：
+命令存储的键、标签页内容索引和两次解析结果的比较都使用这里的哈希，
+CopyQ 端的脚本使用 clipboard_manager.NORMALIZE_JS 中规则相同的函数。
+规范化只用于比较，写入 CopyQ 和命令存储的仍是原始内容。
+"""
+import functools
+import hashlib
+
+def normalize_content(content):
+    """
+    规范化命令内容：换行统一为 \\n，去掉每行行尾的空格和制表符及首尾空白行
+    """
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    if ' \n' in content or '\t\n' in content:
+        content = '\n'.join(line.rstrip(' \t') for line in content.split('\n'))
+    return content.strip(' \t\n')
+
+# 同步时同一批内容会被反复比较（解析结果、命令存储、标签页索引），字符串对象不变时直接命中缓存
+@functools.lru_cache(maxsize=1 << 16)
+def content_digest(content):
+    """规范化后内容的 16 字节 BLAKE2 哈希"""
+    return hashlib.blake2b(normalize_content(content).encode('utf-8'), digest_size=16).digest()
+
+def content_hash(content):
+    """规范化后内容的哈希的十六进制形式，用作命令存储的键"""
+    return content_digest(content).hex()
@@ -0,0 +1,115 @@
+"""
+CopyQ 客户端会话，统一管理对 CopyQ 命令行客户端的调用。
+
+CopyQ 的命令行客户端每次调用都是一个独立进程，没有可复用的长连接模式，
+因此会话在进程内共享一个实例：统计调用次数，设置超时，并在调用失败时做健康检查、尝试启动服务器后重试。
+各线程的调用并发执行，写入同一标签页的调用由 clipboard_manager.tab_lock 串行，会话只串行化重新连接。
+"""
+import subprocess
+import threading
+import time
+
+import sync_metrics
+from config import COPYQ_PATH, COPYQ_TIMEOUT, COPYQ_AUTO_START
+
+# 健康检查脚本
+PING_SCRIPT = 'print("ok");'
+
+# 调用 CopyQ 时可能出现的错误：进程返回非零、超时、可执行文件不存在等
+COPYQ_ERRORS = (subprocess.SubprocessError, OSError)
+
+class CopyQSession:
+    def __init__(self, copyq_path=COPYQ_PATH, timeout=COPYQ_TIMEOUT, auto_start=COPYQ_AUTO_START):
+        self.copyq_path = copyq_path
+        self.timeout = timeout
+        self.auto_start = auto_start
+        self.healthy = None  # None 表示尚未检查过
+        self.call_count = 0
+        self.failure_count = 0
+        self._lock = threading.RLock()  # 串行化健康检查和重新连接，避免多个线程同时启动服务器
+
+    def _spawn(self, args, input=None):
+        """启动一次 CopyQ 客户端进程并返回标准输出"""
+        self.call_count += 1
+        sync_metrics.count("copyq_calls")
+        if input is not None:
+            sync_metrics.count("copyq_bytes_out", len(input.encode('utf-8')))
+        with sync_metrics.stage("copyq"):
+            result = subprocess.run(
+                [self.copyq_path, *args],
+                input=input,
+                stdin=subprocess.DEVNULL if input is None else None,
+                capture_output=True,
+                text=True,
+                encoding='utf-8',
+                timeout=self.timeout,
+                check=True
+            )
+        sync_metrics.count("copyq_bytes_in", len(result.stdout.encode('utf-8')))
+        return result.stdout
+
+    def ping(self):
+        """检查 CopyQ 服务器是否可用"""
+        try:
+            ok = self._spawn(['eval', '--', PING_SCRIPT]).strip() == 'ok'
+        except COPYQ_ERRORS:
+            ok = False
+        self.healthy = ok
+        return ok
+
+    def reconnect(self):
+        """
+        健康检查失败时尝试启动 CopyQ 服务器
+        :return: 服务器是否可用
+        """
+        with self._lock:
+            if self.ping():
+                return True
+            if not self.auto_start:
+                return False
+            try:
+                self._spawn(['--start-server', 'eval', '--', PING_SCRIPT])
+            except COPYQ_ERRORS as e:
+                print(f"启动 CopyQ 服务器失败: {e}")
+                return False
+            # 等待服务器就绪
+            for delay in (0.2, 0.5, 1.0):
+                time.sleep(delay)
+                if self.ping():
+                    return True
+            return False
+
+    def health_check(self):
+        """供长期运行的监控和托盘程序调用，返回 CopyQ 当前是否可用"""
+        with self._lock:
+            return self.ping() or self.reconnect()
+
+    def run(self, args, input=None, retry=False):
+        """
+        执行一条 CopyQ 命令
+        :param args: COPYQ_PATH 之后的命令行参数
+        :param input: 传给标准输入的文本
+        :param retry: 失败后是否在重新连接后重试一次，只应对只读操作开启
+        :return: 命令的标准输出
+        """
+        try:
+            output = self._spawn(args, input)
+        except COPYQ_ERRORS:
+            self.failure_count += 1
+            self.healthy = False
+            if not (self.reconnect() and retry):
+                raise
+            output = self._spawn(args, input)
+        self.healthy = True
+        return output
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """获取进程内共享的 CopyQ 会话，监控线程和托盘程序复用同一个实例"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = CopyQSession()
+        return _session
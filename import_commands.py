@@ -1,9 +1,15 @@
-import os
 from pathlib import Path
-from datetime import datetime
-import json
+import contextlib
+import logging
+import mmap
+import os
 import re
-from config import DATA_DIR, MARKDOWN_FILE, COMMAND_STORE_FILE
+import sync_metrics
+from config import DATA_DIR, MARKDOWN_FILE, COMMAND_STORE_FILE, COMMAND_LOG_FILE, MMAP_MIN_BYTES
+from command_store import CommandStore, CommandRecord
+from reference_graph import resolve_reference
+
+logger = logging.getLogger(__name__)
 
 def get_heading_tag(line):
     """获取标题级别和内容"""
@@ -11,230 +17,286 @@ def get_heading_tag(line):
     content = line.lstrip('#').strip()
     return f"{'#' * level}{content}" if content else None
 
+# 文件引用语法 [[文件路径]]
+REFERENCE_PATTERN = re.compile(r'\[\[(.*?)\]\]')
+
+# 行类型
+LINE_EMPTY, LINE_FENCE, LINE_REFERENCE, LINE_TAG, LINE_HEADING, LINE_INLINE_TAG, LINE_CONTENT = range(7)
+
+def classify_line(line, stripped):
+    """
+    判断代码块之外的一行属于哪种类型，每行只判断一次
+    :param line: 原始行
+    :param stripped: line.strip() 的结果
+    :return: (行类型, 引用路径列表)
+    """
+    if not stripped:
+        return LINE_EMPTY, None
+    if stripped.startswith('```'):
+        return LINE_FENCE, None
+    if '[[' in line:
+        matches = REFERENCE_PATTERN.findall(line)
+        if matches:
+            return LINE_REFERENCE, matches
+    if line.startswith('>'):
+        return LINE_TAG, None
+    if stripped.startswith('#'):
+        return LINE_HEADING, None
+    if ' #' in line:
+        return LINE_INLINE_TAG, None
+    return LINE_CONTENT, None
+
+def open_markdown(path):
+    """打开 Markdown 文件，换行符统一转换为 \\n"""
+    f = open(path, 'r', encoding='utf-8')
+    sync_metrics.count("bytes_read", os.fstat(f.fileno()).st_size)
+    return f
+
+def iter_buffer_lines(buffer, window=1 << 20):
+    """
+    在字节缓冲区（如 mmap）上逐行读取，结果与文本模式读入整个文件后 split('\\n') 相同：
+    \\r\\n 和单独的 \\r 也作为换行符。每次只解码以换行符结尾的一段（约 window 字节），
+    不生成整个文件的副本
+    """
+    start = 0
+    size = len(buffer)
+    while True:
+        end = -1
+        if size - start > window:
+            end = buffer.rfind(b'\n', start, start + window)
+            if end < 0:
+                end = buffer.find(b'\n', start + window)  # 超过一段长度的行
+        last = end < 0
+        text = buffer[start:size if last else end].decode('utf-8')
+        if '\r' in text:
+            if not last and text.endswith('\r'):
+                text = text[:-1]  # 与段末的 \n 组成一个换行符
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        yield from text.split('\n')
+        if last:
+            return
+        start = end + 1
+
+@contextlib.contextmanager
+def open_markdown_lines(path):
+    """
+    打开 Markdown 文件并逐行读取（不含换行符），不小于 MMAP_MIN_BYTES 的文件使用内存映射。
+    较小的文件整体读入后再分行：逐行从文件读取比一次读取慢约三分之一（2 万行的笔记），
+    而这样的文件整体读入占用的内存可以忽略。行只能在 with 块内读取
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size and size >= MMAP_MIN_BYTES:
+            sync_metrics.count("bytes_read", size)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield iter_buffer_lines(buffer)
+            return
+    with open_markdown(path) as f:
+        yield f.read().split('\n')
+
+def escape_item(item):
+    """
+    对条目的内容和标签中的反斜杠转义，结果与对整个文件转义后再解析相同。
+    只用于与 parse_md_content 保持一致：它的结果原本作为命令行参数传给 CopyQ，CopyQ 会去掉一层转义；
+    同步和导入通过标准输入传递原文，不转义
+    """
+    content, tags = item
+    return content.replace('\\', '\\\\'), tags.replace('\\', '\\\\')
+
 class MarkdownParser:
-    def __init__(self, base_path=None):
+    def __init__(self, base_path=None, expand_references=True, escape=False):
         self.items = []
+        self.item_count = 0  # 已产生的条目数（包括引用文件的条目）
         self.current_content = None
-        self.current_tags = ["命令"]  # 默认标签
-        self.heading_tags = []  # 标题标签栈
+        self.current_tags = "命令"  # 当前标签（逗号分隔），默认为“命令”
+        self.heading_stack = []  # 标题标签栈，栈顶为最近的标题，元素为 (级别, 标签)
+        self.heading_tags = ""  # 从最近到最远的标题标签（逗号分隔），标题变化时更新
         self.in_code_block = False
         self.code_block_content = []
         self.pending_code_block = None
         self.processed_files = set()  # 用于跟踪已处理的文件，避免循环引用
         self.base_path = base_path  # 当前处理文件的路径，用于解析相对引用
+        self.expand_references = expand_references  # 为 False 时只记录引用位置，不展开引用的文件
+        self.references = []  # (插入位置, 引用文件路径)，供 ParseCache 拼接各文件的解析结果
+        self.escape = escape  # 是否对本文件产生的条目转义反斜杠，引用文件的条目不转义
 
-    def _handle_empty_line(self):
-        """处理空行"""
-        if self.current_content and not self.in_code_block:
-            self.items.append((self.current_content, ','.join(self.current_tags)))
-            self.current_content = None
-
-    def _handle_code_block(self, line):
-        """处理代码块"""
-        if line.strip().startswith('```'):
-            if not self.in_code_block:
-                # 开始代码块
-                self.in_code_block = True
-                self._handle_empty_line()  # 处理之前的内容
-                self.code_block_content = []
-            else:
-                # 结束代码块
-                self.in_code_block = False
-                if self.code_block_content:
-                    # 存储代码块内容，等待下一个标签行
-                    self.pending_code_block = '\n'.join(self.code_block_content)
-                self.code_block_content = []
-            return True
-        
-        if self.in_code_block:
-            self.code_block_content.append(line)
-            return True
-            
-        return False
-
-    def _handle_file_reference(self, line):
-        """处理文件引用语法 [[文件路径]]"""
-        matches = re.findall(r'\[\[(.*?)\]\]', line)
-        if matches:
-            for file_path in matches:
-                # 解析相对路径
-                if self.base_path and not os.path.isabs(file_path):
-                    # 使用当前文件所在目录作为基准路径
-                    base_dir = os.path.dirname(self.base_path)
-                    abs_file_path = os.path.normpath(os.path.join(base_dir, file_path))
-                else:
-                    abs_file_path = file_path
-                    
-                if abs_file_path in self.processed_files:
-                    print(f"警告: 检测到循环引用 {abs_file_path}")
-                    continue
-                    
-                self.processed_files.add(abs_file_path)
-                try:
-                    with open(abs_file_path, 'r', encoding='utf-8') as f:
-                        referenced_content = f.read()
-                        # 使用新的解析器实例解析引用的文件内容，保持标题级别隔离
-                        referenced_parser = MarkdownParser(base_path=abs_file_path)
-                        referenced_parser.processed_files = self.processed_files.copy()  # 共享已处理文件列表以避免循环引用
-                        referenced_items = referenced_parser.parse(referenced_content)
-                        self.items.extend(referenced_items)
-                except FileNotFoundError:
-                    print(f"错误: 找不到引用的文件 {abs_file_path}")
-                except Exception as e:
-                    print(f"处理文件 {abs_file_path} 时出错: {str(e)}")
-            return True
-        return False
-
-    def _handle_tag_line(self, line):
-        """处理标签行（以>开头）"""
-        if line.startswith('>'):
-            tags = line[1:].strip()
-            tag_list = [tags] if tags else ["命令"]
-            
-            # 将标题标签添加到当前标签中
-            combined_tags = tag_list + self.heading_tags
-            
-            # 如果有待处理的代码块，将其与组合标签关联
-            if self.pending_code_block is not None:
-                self.items.append((self.pending_code_block, ','.join(combined_tags)))
-                self.pending_code_block = None
-            elif self.current_content:
-                self.items.append((self.current_content, ','.join(combined_tags)))
-                self.current_content = None
-                
-            self.current_tags = combined_tags
-            return True
-        return False
+    def _with_headings(self, tag):
+        """在标签后拼接标题标签"""
+        return f"{tag},{self.heading_tags}" if self.heading_tags else tag
 
     def _update_heading_stack(self, heading_tag):
-        """更新标题标签栈"""
+        """更新标题标签栈，移除同级或更低级别的标题"""
         level = len(heading_tag) - len(heading_tag.lstrip('#'))
-        # 移除同级或更低级别的标题
-        while self.heading_tags and (len(self.heading_tags[0]) - len(self.heading_tags[0].lstrip('#'))) >= level:
-            self.heading_tags.pop(0)
-        self.heading_tags.insert(0, heading_tag)
-        self.current_tags = ["命令"] + self.heading_tags
-
-    def _handle_heading(self, line):
-        """处理Markdown标题"""
-        if line.lstrip().startswith('#'):
-            if self.current_content:
-                self.items.append((self.current_content, ','.join(self.current_tags)))
-                self.current_content = None
-            elif self.pending_code_block:
-                self.items.append((self.pending_code_block, ','.join(self.current_tags)))
-                self.pending_code_block = None
-            
-            heading_tag = get_heading_tag(line)
-            if heading_tag:
-                self._update_heading_stack(heading_tag)
-            return True
-        return False
-
-    def _handle_inline_tag(self, line):
-        """处理行内标签"""
-        if ' #' in line and not line.lstrip().startswith('#'):
-            parts = line.split(' #', 1)
-            content = parts[0].strip()
-            tag = parts[1].strip()
-            if content:
-                tags = [tag] + self.heading_tags if tag else self.heading_tags
-                self.items.append((content, ','.join(tags)))
-            return True
-        return False
-
-    def _handle_normal_content(self, line):
-        """处理普通内容"""
-        if line.strip():
-            if self.current_content:
-                self.items.append((self.current_content, ','.join(self.current_tags)))
-            self.current_content = line.strip()
+        stack = self.heading_stack
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, heading_tag))
+        self.heading_tags = ','.join(tag for _, tag in reversed(stack))
+        self.current_tags = self._with_headings("命令")
 
-    def parse(self, md_content):
-        """解析markdown内容"""
-        for line in md_content.split('\n'):
-            if not line.strip() and not self.in_code_block:
-                self._handle_empty_line()
-                continue
-                
-            if self._handle_code_block(line):
+    def _iter_reference(self, abs_file_path):
+        """解析引用的文件并依次产生其中的条目"""
+        if abs_file_path in self.processed_files:
+            logger.warning(f"检测到循环引用 {abs_file_path}")
+            return
+        self.processed_files.add(abs_file_path)
+        try:
+            with open_markdown_lines(abs_file_path) as lines:
+                # 使用新的解析器实例解析引用的文件内容，保持标题级别隔离
+                referenced_parser = MarkdownParser(base_path=abs_file_path)
+                referenced_parser.processed_files = self.processed_files.copy()  # 共享已处理文件列表以避免循环引用
+                referenced_items = list(referenced_parser.iter_parse(lines))
+        except FileNotFoundError:
+            logger.error(f"找不到引用的文件 {abs_file_path}")
+            return
+        except Exception as e:
+            logger.error(f"处理文件 {abs_file_path} 时出错: {str(e)}")
+            return
+        yield from referenced_items
+
+    def iter_parse(self, lines):
+        """
+        逐行解析markdown内容，依次产生 (内容, 标签)
+        :param lines: 行的可迭代对象（不含换行符），通常来自 open_markdown_lines
+        """
+        for line in lines:
+            stripped = line.strip()
+
+            if self.in_code_block:
+                if stripped.startswith('```'):
+                    # 结束代码块，存储代码块内容，等待下一个标签行
+                    self.in_code_block = False
+                    if self.code_block_content:
+                        self.pending_code_block = '\n'.join(self.code_block_content)
+                    self.code_block_content = []
+                else:
+                    self.code_block_content.append(line)
                 continue
-                
-            if not self.in_code_block:
-                if self._handle_file_reference(line):
-                    continue
-                    
-                if self._handle_tag_line(line):
-                    continue
-                    
-                if self._handle_heading(line):
-                    continue
-                    
-                if self._handle_inline_tag(line):
-                    continue
-                    
-                self._handle_normal_content(line)
-        
+
+            line_type, matches = classify_line(line, stripped)
+            item = None
+
+            if line_type == LINE_EMPTY:
+                if self.current_content:
+                    item = (self.current_content, self.current_tags)
+                    self.current_content = None
+
+            elif line_type == LINE_FENCE:
+                # 开始代码块，之前的普通内容保留到代码块之后处理
+                self.in_code_block = True
+                self.code_block_content = []
+
+            elif line_type == LINE_REFERENCE:
+                for file_path in matches:
+                    abs_file_path = resolve_reference(self.base_path, file_path)
+                    if not self.expand_references:
+                        self.references.append((self.item_count, abs_file_path))
+                        continue
+                    for referenced_item in self._iter_reference(abs_file_path):
+                        self.item_count += 1
+                        yield referenced_item
+
+            elif line_type == LINE_TAG:
+                tags = line[1:].strip()
+                combined_tags = self._with_headings(tags if tags else "命令")
+                # 如果有待处理的代码块，将其与组合标签关联
+                if self.pending_code_block is not None:
+                    item = (self.pending_code_block, combined_tags)
+                    self.pending_code_block = None
+                elif self.current_content:
+                    item = (self.current_content, combined_tags)
+                    self.current_content = None
+                self.current_tags = combined_tags
+
+            elif line_type == LINE_HEADING:
+                if self.current_content:
+                    item = (self.current_content, self.current_tags)
+                    self.current_content = None
+                elif self.pending_code_block:
+                    item = (self.pending_code_block, self.current_tags)
+                    self.pending_code_block = None
+                heading_tag = get_heading_tag(line)
+                if heading_tag:
+                    self._update_heading_stack(heading_tag)
+
+            elif line_type == LINE_INLINE_TAG:
+                content, tag = line.split(' #', 1)
+                content = content.strip()
+                tag = tag.strip()
+                if content:
+                    item = (content, self._with_headings(tag) if tag else self.heading_tags)
+
+            else:
+                if self.current_content:
+                    item = (self.current_content, self.current_tags)
+                self.current_content = stripped
+
+            if item is not None:
+                self.item_count += 1
+                yield escape_item(item) if self.escape else item
+
+        item = None
         if self.current_content and not self.in_code_block:
-            self.items.append((self.current_content, ','.join(self.current_tags)))
+            item = (self.current_content, self.current_tags)
         elif self.pending_code_block:
-            self.items.append((self.pending_code_block, ','.join(self.current_tags)))
-        
+            item = (self.pending_code_block, self.current_tags)
+        if item is not None:
+            self.item_count += 1
+            yield escape_item(item) if self.escape else item
+
+    def parse(self, md_content):
+        """解析markdown内容"""
+        self.items.extend(self.iter_parse(md_content.split('\n')))
         return self.items
 
+def iter_parse_file(md_path, escape=True, expand_references=True, parser=None):
+    """
+    从文件逐行流式解析，依次产生 (内容, 标签)，不把整个文件读入内存
+    :param md_path: Markdown 文件路径
+    :param escape: 是否对反斜杠转义（与 parse_md_content 一致）
+    :param expand_references: 是否展开 [[...]] 引用的文件
+    :param parser: 使用的解析器实例，调用方可借此读取 references
+    """
+    if parser is None:
+        parser = MarkdownParser(base_path=md_path, expand_references=expand_references)
+    parser.escape = escape
+    with open_markdown_lines(md_path) as lines:
+        yield from parser.iter_parse(lines)
+
 def parse_md_content(md_content, base_path=None):
     """解析markdown内容，提取命令及其标签"""
-    md_content = md_content.replace('\\', '\\\\')
-    parser = MarkdownParser(base_path=base_path)
-    return parser.parse(md_content)
-
-def create_command_store(items, store_path):
-    """创建命令存储JSON文件"""
-    commands = []
-    existing_commands = set()
-    
-    # 如果文件已存在，读取现有命令
-    if os.path.exists(store_path):
-        with open(store_path, 'r', encoding='utf-8') as f:
-            existing_data = json.load(f)
-            for cmd in existing_data:
-                existing_commands.add(cmd['command'])
-            commands.extend(existing_data)
-    
+    with sync_metrics.stage("parse"):
+        parser = MarkdownParser(base_path=base_path, escape=True)
+        items = parser.parse(md_content)
+    sync_metrics.count("items_parsed", len(items))
+    return items
+
+def create_command_store(items, store):
+    """把解析出的命令写入命令存储（CommandStore）"""
     # 添加新命令
     new_count = 0
     for content, tags in items:
-        if content not in existing_commands:
-            command_data = {
-                "command": content,
-                "tags": tags.split(','),
-                "created_at": datetime.now().isoformat(),
-                "last_exported": None
-            }
-            commands.append(command_data)
-            existing_commands.add(content)
+        if content not in store:
+            store.put(CommandRecord(content, tags))
             new_count += 1
             print(f"添加新命令: {content}")
             print(f"标签: {tags}")
             print("-" * 50)
     
     # 保存到文件
-    with open(store_path, 'w', encoding='utf-8') as f:
-        json.dump(commands, f, ensure_ascii=False, indent=2)
+    store.flush()
     
     return new_count
 
 def main():
     current_dir = Path(__file__).parent
     md_path = current_dir / DATA_DIR / MARKDOWN_FILE
-    store_path = current_dir / DATA_DIR / COMMAND_STORE_FILE
-    
-    # 读取并解析markdown文件
-    with open(md_path, 'r', encoding='utf-8') as f:
-        md_content = f.read()
+    store = CommandStore(current_dir / DATA_DIR / COMMAND_LOG_FILE,
+                         legacy_path=current_dir / DATA_DIR / COMMAND_STORE_FILE)
     
-    items = parse_md_content(md_content, base_path=md_path)
-    new_items_count = create_command_store(items, store_path)
+    # 流式解析markdown文件；命令存储保存原文，与同步一致，不转义反斜杠
+    items = list(iter_parse_file(md_path, escape=False))
+    new_items_count = create_command_store(items, store)
     
     if new_items_count == 0:
         print("没有新的命令需要添加")
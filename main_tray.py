@@ -1,8 +1,10 @@
 import sys
 from PyQt5.QtWidgets import QApplication
 from tray_manager import TrayManager
+from utils import configure_logging
 
 if __name__ == '__main__':
+    configure_logging()
     app = QApplication(sys.argv)
     
     # 允许无窗口时程序继续运行
@@ -0,0 +1,330 @@
+"""
+按文件缓存 Markdown 解析结果。
+
+每个文件单独解析（不展开 [[...]] 引用），缓存其条目和引用位置，缓存以路径、修改时间和大小为键；
+修改时间或大小变化但内容哈希不变时（编辑器自动保存、touch 等）沿用缓存。
+同步时只重新解析发生变化的文件，再按引用位置把各文件的条目拼接起来，
+拼接时沿用 MarkdownParser 的 processed_files 规则处理循环引用，结果与整体解析完全一致。
+
+可选的并行模式先按层发现引用图，把同一层中需要重新解析的文件交给进程池或线程池并发解析，
+拼接仍在调用线程中按原文档顺序进行。
+
+vault_files 返回主文件及其引用的所有文件的内容哈希，combine_digests 把它们组合成一个笔记哈希，
+用于在解析之前判断整个笔记是否变化。
+
+save / load 把缓存保存到文件（pickle），程序重启后沿用：各条目仍按修改时间、大小和内容哈希校验，
+重启后只需 stat 各文件，不必重新读取和解析没有变化的文件。
+
+同步线程和监控线程（判断变化的文件是否属于笔记、更新监控的文件列表）会同时使用同一个缓存，
+公开方法由缓存自己的锁串行执行。
+"""
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import threading
+
+import sync_metrics
+from import_commands import MarkdownParser, iter_parse_file
+from reference_graph import ReferenceGraph
+from config import MMAP_MIN_BYTES
+from utils import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件格式版本，解析结果或条目结构变化时递增，旧版本的缓存文件直接丢弃
+CACHE_FORMAT = 1
+
+class FileEntry:
+    """单个文件的解析结果"""
+    def __init__(self, stamp, items, references, digest=None):
+        self.stamp = stamp  # (st_mtime_ns, st_size)
+        self.items = items  # 本文件自身的 (内容, 标签) 列表
+        self.references = references  # (插入位置, 引用文件路径) 列表
+        self.digest = digest  # 文件内容哈希
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def file_digest(path):
+    """
+    计算文件内容的哈希
+    :return: 十六进制哈希字符串；文件不存在或无法读取时返回 None
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size and size >= MMAP_MIN_BYTES:
+                # 大文件直接对内存映射计算哈希，不读入副本
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    return hashlib.blake2b(buffer, digest_size=16).hexdigest()
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
+def combine_digests(file_digests):
+    """
+    把各文件的内容哈希组合成一个笔记哈希，与文件顺序无关
+    :param file_digests: {文件路径: 内容哈希}，不存在的文件哈希为 None
+    """
+    combined = hashlib.blake2b(digest_size=16)
+    for path in sorted(file_digests):
+        combined.update(f"{path}\0{file_digests[path] or '-'}\n".encode('utf-8'))
+    return combined.hexdigest()
+
+def parse_file_local(path, escape=False):
+    """
+    解析单个文件，只记录引用位置而不展开
+    :param path: 文件路径
+    :param escape: 是否对反斜杠转义（与 parse_md_content 对主文件的处理一致）
+    :return: (条目列表, 引用列表)
+    """
+    parser = MarkdownParser(base_path=path, expand_references=False)
+    items = list(iter_parse_file(path, escape=escape, parser=parser))
+    return items, parser.references
+
+class ParseCache:
+    def __init__(self, workers=0, executor="process"):
+        """
+        :param workers: 并行解析的工作进程（线程）数，0 表示串行解析
+        :param executor: "process" 使用进程池，"thread" 使用线程池
+        """
+        self.entries = {}  # (路径, 是否转义) -> FileEntry
+        self.digests = {}  # 路径 -> (计算哈希时的 (st_mtime_ns, st_size), 内容哈希)
+        self.graph = ReferenceGraph()  # 随文件重新解析增量更新的引用关系图
+        self.parsed_count = 0  # 实际重新解析的文件数，便于观察缓存效果
+        self.workers = workers
+        self.executor = executor
+        self.dirty = False  # 上次 save / load 之后是否有变化
+        self._pool = None
+        self._lock = threading.RLock()
+
+    def _store_entry(self, key, stamp, items, references, digest=None):
+        """保存文件的解析结果并更新引用关系图"""
+        self.parsed_count += 1
+        self.dirty = True
+        sync_metrics.count("files_parsed")
+        self.graph.update(key[0], [ref_path for _, ref_path in references])
+        entry = self.entries[key] = FileEntry(stamp, items, references, digest)
+        return entry
+
+    def current_digest(self, path, stamp=None):
+        """
+        文件当前的内容哈希，修改时间和大小没变时使用缓存的哈希，不读取文件
+        :param stamp: 调用方已经取得的 (st_mtime_ns, st_size)
+        :return: 内容哈希；文件不存在时返回 None
+        """
+        path = str(path)
+        with self._lock:
+            if stamp is None:
+                try:
+                    stamp = _file_stamp(path)
+                except OSError:
+                    self.digests.pop(path, None)
+                    return None
+            cached = self.digests.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            digest = file_digest(path)
+            sync_metrics.count("files_hashed")
+            self.digests[path] = (stamp, digest)
+            self.dirty = True
+            return digest
+
+    def cached_digest(self, path):
+        """最近一次计算的内容哈希，不访问文件；没有计算过时返回 None"""
+        cached = self.digests.get(str(path))
+        return cached[1] if cached is not None else None
+
+    def _is_fresh(self, key, stamp):
+        """
+        判断缓存是否仍然有效：修改时间和大小都没变，或者内容哈希没变（此时更新缓存的时间戳）
+        :return: (是否有效, 当前内容哈希)
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry.stamp == stamp:
+            return True, entry.digest
+        digest = self.current_digest(key[0], stamp)
+        if entry is not None and digest is not None and entry.digest == digest:
+            entry.stamp = stamp
+            self.dirty = True
+            return True, digest
+        return False, digest
+
+    def _get_entry(self, path, escape=False):
+        """获取文件的解析结果，文件内容未变化时直接使用缓存"""
+        key = (str(path), escape)
+        stamp = _file_stamp(path)
+        fresh, digest = self._is_fresh(key, stamp)
+        if fresh:
+            return self.entries[key]
+
+        items, references = parse_file_local(path, escape)
+        return self._store_entry(key, stamp, items, references, digest)
+
+    def save(self, path):
+        """把缓存写入文件，没有变化时不写"""
+        with self._lock:
+            if not self.dirty:
+                return False
+            data = {"format": CACHE_FORMAT, "entries": self.entries, "digests": self.digests, "graph": self.graph}
+            atomic_write(path, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+            self.dirty = False
+            return True
+
+    def load(self, path):
+        """
+        读取 save 保存的缓存，替换当前内容
+        :return: 是否读取成功；文件不存在、损坏或格式版本不同时返回 False，缓存保持原样
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"解析缓存文件无法读取，忽略: {e}")
+            return False
+        if not isinstance(data, dict) or data.get("format") != CACHE_FORMAT:
+            return False
+        with self._lock:
+            self.entries = data["entries"]
+            self.digests = data["digests"]
+            self.graph = data["graph"]
+            self.dirty = False
+        return True
+
+    def _get_pool(self):
+        if self._pool is None:
+            # 只在并行解析时导入，进程池会加载 multiprocessing，拖慢一次性同步的启动
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            pool_class = ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor
+            self._pool = pool_class(max_workers=self.workers)
+        return self._pool
+
+    def close(self):
+        """关闭并行解析使用的进程池"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _walk(self, md_path, escape=False):
+        """
+        从主文件开始按层遍历引用图，确保所有可达文件的解析结果都是最新的。
+        并行模式下每层中需要重新解析的文件并发解析。
+        已访问集合保证存在循环引用时也能结束；无法读取的文件留给拼接阶段按原逻辑报告。
+        :param escape: 主文件的条目是否转义反斜杠，与 parse 的参数相同
+        """
+        level = [(str(md_path), escape)]
+        visited = set(level)
+        while level:
+            stale = []
+            for key in level:
+                try:
+                    stamp = _file_stamp(key[0])
+                except OSError:
+                    continue
+                fresh, digest = self._is_fresh(key, stamp)
+                if not fresh:
+                    stale.append((key, stamp, digest))
+
+            if self.workers and len(stale) > 1:
+                pool = self._get_pool()
+                futures = [(key, stamp, digest, pool.submit(parse_file_local, *key)) for key, stamp, digest in stale]
+                for key, stamp, digest, future in futures:
+                    try:
+                        items, references = future.result()
+                    except Exception:
+                        continue
+                    # 工作进程（线程）中的读取不会记录到当前同步的指标上，在这里补记
+                    sync_metrics.count("bytes_read", stamp[1])
+                    self._store_entry(key, stamp, items, references, digest)
+            else:
+                for key, stamp, digest in stale:
+                    try:
+                        self._store_entry(key, stamp, *parse_file_local(*key), digest)
+                    except Exception:
+                        continue
+
+            next_level = []
+            for key in level:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                for _, ref_path in entry.references:
+                    ref_key = (ref_path, False)
+                    if ref_key not in visited:
+                        visited.add(ref_key)
+                        next_level.append(ref_key)
+            level = next_level
+
+    def _assemble(self, path, processed_files, escape=False):
+        """按引用位置把文件及其引用文件的条目拼接起来"""
+        entry = self._get_entry(path, escape)
+        items = []
+        position = 0
+        for index, ref_path in entry.references:
+            items.extend(entry.items[position:index])
+            position = index
+            if ref_path in processed_files:
+                logger.warning(f"检测到循环引用 {ref_path}")
+                continue
+            processed_files.add(ref_path)
+            try:
+                items.extend(self._assemble(ref_path, processed_files.copy()))
+            except FileNotFoundError:
+                logger.error(f"找不到引用的文件 {ref_path}")
+            except Exception as e:
+                logger.error(f"处理文件 {ref_path} 时出错: {str(e)}")
+        items.extend(entry.items[position:])
+        return items
+
+    def parse(self, md_path, escape=False):
+        """
+        解析主文件及其引用的所有文件
+        :param md_path: 主 Markdown 文件路径
+        :param escape: 是否对主文件的条目转义反斜杠；为 True 时结果与 parse_md_content 相同。
+                       同步通过标准输入把原文写入 CopyQ，使用不转义的结果
+        :return: (内容, 标签) 元组列表
+        """
+        with sync_metrics.stage("parse"), self._lock:
+            if self.workers:
+                self._walk(md_path, escape)
+            items = self._assemble(md_path, set(), escape=escape)
+        sync_metrics.count("items_parsed", len(items))
+        return items
+
+    def referenced_files(self, md_path):
+        """
+        返回主文件直接或间接引用的所有文件（不含主文件），只重新解析变化过的文件
+        :param md_path: 主 Markdown 文件路径
+        """
+        with self._lock:
+            self._walk(md_path)
+            return self.graph.reachable(md_path) - {str(md_path)}
+
+    def dependents(self, path):
+        """
+        直接或间接引用该文件的所有文件（包括文件本身），按最近一次解析的引用关系查询，不读取任何文件
+        :param path: 文件路径
+        """
+        path = str(path)
+        with self._lock:
+            if path not in self.graph.edges and path not in self.graph.reverse:
+                # 不区分大小写的文件系统上，传入的路径可能与引用中写的大小写不同
+                target = os.path.normcase(path)
+                path = next((node for node in self.graph.nodes if os.path.normcase(node) == target), path)
+            return self.graph.dependents(path)
+
+    def vault_files(self, md_path):
+        """
+        主文件及其直接或间接引用的所有文件的内容哈希，只重新解析内容变化过的文件
+        :param md_path: 主 Markdown 文件路径
+        :return: {文件路径: 内容哈希}，不存在的引用文件哈希为 None，创建后随之变化
+        """
+        with self._lock:
+            self._walk(md_path)
+            return {path: self.current_digest(path) for path in self.graph.reachable(md_path) | {str(md_path)}}
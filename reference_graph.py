@@ -0,0 +1,74 @@
+"""
+[[...]] 引用关系图，由解析缓存和文件监控共用。
+
+节点是文件路径，边是文件中（代码块之外的）[[...]] 引用，同时维护反向依赖，
+用于找出笔记包含的所有文件、需要监控哪些文件，以及某个文件属于哪些笔记。
+"""
+import os
+
+def resolve_reference(base_path, file_path):
+    """
+    解析引用路径，相对路径以引用所在文件的目录为基准
+    :param base_path: 引用所在的文件路径
+    :param file_path: [[...]] 中的路径
+    :return: 引用文件的路径
+    """
+    if base_path and not os.path.isabs(file_path):
+        base_dir = os.path.dirname(base_path)
+        return os.path.normpath(os.path.join(base_dir, file_path))
+    return file_path
+
+class ReferenceGraph:
+    def __init__(self):
+        self.edges = {}  # 文件路径 -> 按出现顺序排列的引用文件路径列表
+        self.reverse = {}  # 文件路径 -> 引用它的文件路径集合
+
+    def __setstate__(self, state):
+        # 旧版本保存的解析缓存中没有反向依赖，按边重新建立
+        self.__dict__.update(state)
+        if "reverse" not in state:
+            self.reverse = {}
+            for path, references in self.edges.items():
+                for ref_path in references:
+                    self.reverse.setdefault(ref_path, set()).add(path)
+
+    @property
+    def nodes(self):
+        return set(self.edges) | set(self.reverse)
+
+    def update(self, path, references):
+        """更新一个文件的引用（文件重新解析后调用）"""
+        path = str(path)
+        for ref_path in self.edges.get(path, ()):
+            referrers = self.reverse.get(ref_path)
+            if referrers is not None:
+                referrers.discard(path)
+                if not referrers:
+                    del self.reverse[ref_path]
+        self.edges[path] = list(references)
+        for ref_path in self.edges[path]:
+            self.reverse.setdefault(ref_path, set()).add(path)
+
+    def reachable(self, root):
+        """从 root 出发能到达的所有文件（包括 root），存在循环引用时也能结束"""
+        visited = set()
+        pending = [str(root)]
+        while pending:
+            current = pending.pop()
+            if current in visited:
+                continue
+            visited.add(current)
+            pending.extend(self.edges.get(current, ()))
+        return visited
+
+    def dependents(self, path):
+        """直接或间接引用 path 的所有文件（包括 path 本身），存在循环引用时也能结束"""
+        affected = set()
+        pending = [str(path)]
+        while pending:
+            current = pending.pop()
+            if current in affected:
+                continue
+            affected.add(current)
+            pending.extend(self.reverse.get(current, ()))
+        return affected
@@ -0,0 +1,59 @@
+"""
+同步守护进程（sync_daemon.py）的命令行客户端，供编辑器保存钩子调用。
+
+只导入标准库的少量模块，启动快；同步在守护进程中完成，解析缓存、命令存储和 CopyQ 索引都是热的。
+用法：
+    python sync_client.py sync           同步所有配置的笔记
+    python sync_client.py sync <文件>     只同步包含该文件的笔记（供保存钩子直接传入保存的文件）
+    python sync_client.py status         查看守护进程状态
+守护进程未运行时退出码为 2，可以退回一次性同步：python sync_client.py sync || python sync_commands.py
+"""
+import json
+import os
+import socket
+import sys
+
+from config import DAEMON_SOCKET, DAEMON_PORT
+
+def get_daemon_address():
+    """
+    守护进程的监听地址：支持 Unix 域套接字时使用 DAEMON_SOCKET，否则（如 Windows）使用本机回环地址上的 DAEMON_PORT
+    :return: (地址族, 地址)
+    """
+    if hasattr(socket, "AF_UNIX"):
+        return socket.AF_UNIX, DAEMON_SOCKET
+    return socket.AF_INET, ("127.0.0.1", DAEMON_PORT)
+
+def send_request(command, timeout=None):
+    """
+    向守护进程发送一条命令并等待回复
+    :param command: 命令行，如 "sync"、"sync /path/to/file.md"、"status"
+    :param timeout: 等待回复的超时时间（秒），None 表示一直等待
+    :return: 回复解析后的字典
+    :raises OSError: 守护进程未运行或连接失败
+    """
+    family, address = get_daemon_address()
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall((command.strip() + "\n").encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as reply:
+            return json.loads(reply.readline())
+
+def main(argv):
+    if not argv or argv[0] not in ("sync", "status"):
+        print(__doc__.strip())
+        return 1
+    command = argv[0]
+    if command == "sync" and len(argv) > 1:
+        command += " " + os.path.abspath(argv[1])
+    try:
+        reply = send_request(command)
+    except OSError as e:
+        print(f"无法连接同步守护进程: {e}", file=sys.stderr)
+        return 2
+    print(json.dumps(reply, ensure_ascii=False, indent=2))
+    return 0 if reply.get("ok") else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
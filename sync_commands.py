@@ -1,14 +1,63 @@
-from sync_logic import run_one_time_sync
+import argparse
+
+from config import SYNC_ENGINE
+from utils import configure_logging
 
 def main():
     """命令行入口：执行一次性同步"""
+    parser = argparse.ArgumentParser(description="将 Markdown 文件中的命令同步到 CopyQ")
+    parser.add_argument('--async', dest='use_async', action='store_true', default=SYNC_ENGINE == "asyncio",
+                        help="使用 asyncio 同步引擎，并发调用 CopyQ")
+    parser.add_argument('--reconcile', action='store_true',
+                        help="对账：列出已不在笔记中的命令（本工具写入的 CopyQ 条目和命令存储记录），不做同步")
+    parser.add_argument('--apply', action='store_true', help="与 --reconcile 一起使用，实际删除这些条目并记录墓碑")
+    args = parser.parse_args()
+    configure_logging()
+    if args.apply and not args.reconcile:
+        parser.error("--apply 需要与 --reconcile 一起使用")
+    if args.reconcile:
+        return run_reconcile(args.apply)
+    # 同步模块在解析参数之后才导入，两个引擎互不加载对方的依赖
+    if args.use_async:
+        from async_sync import sync_all
+    else:
+        from sync_logic import sync_all
+    from sync_logic import save_caches
+
     print("开始一次性同步...")
-    result = run_one_time_sync()
-    if "error" in result:
-        print(f"发生错误: {result['error']}")
+    results = sync_all()
+    for md_path, result in results.items():
+        prefix = f"{md_path}: " if len(results) > 1 else ""
+        if "error" in result:
+            print(f"{prefix}发生错误: {result['error']}")
+        else:
+            print(f"{prefix}同步完成。新增 {result['new']} 条，更新 {result['updated']} 条"
+                  f"（CopyQ 中更新标签 {result.get('tags_updated', 0)} 条），删除 {result.get('removed', 0)} 条。")
+    print("详细信息请查看日志。")
+    # 保存解析缓存，下次同步只需检查文件的修改时间
+    save_caches()
+
+def run_reconcile(apply):
+    from sync_logic import configured_vaults
+
+    print("开始对账..." if apply else "开始对账（预演，不做修改；加 --apply 实际删除）...")
+    for vault in configured_vaults():
+        print(f"{vault.md_path} -> 标签页 {vault.tab}")
+        result = vault.reconcile(apply)
+        if "error" in result:
+            print(f"发生错误: {result['error']}")
+        else:
+            print_reconcile_result(result, apply)
+
+def print_reconcile_result(result, apply):
+    for content in result["copyq_stale"][:20]:
+        print(f"  CopyQ: {content.splitlines()[0] if content else content}")
+    if len(result["copyq_stale"]) > 20:
+        print(f"  ... 共 {len(result['copyq_stale'])} 条")
+    if apply:
+        print(f"对账完成。从 CopyQ 删除 {len(result['copyq_stale'])} 条，命令存储中标记删除 {result['tombstoned']} 条。")
     else:
-        print(f"同步完成。新增 {result['new']} 条，更新 {result['updated']} 条。")
-        print("详细信息请查看日志。")
+        print(f"CopyQ 中有 {len(result['copyq_stale'])} 条、命令存储中有 {len(result['stale'])} 条命令已不在笔记中。")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
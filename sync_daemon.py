@@ -0,0 +1,231 @@
+"""
+同步守护进程：常驻内存，保留 sync_logic 的解析缓存、命令存储和 CopyQ 标签页索引，
+在本地套接字上接受 sync_client.py 的请求，编辑器保存钩子触发的同步在毫秒级返回。
+
+协议为一行一条请求、一行 JSON 回复：
+    sync            同步所有配置的笔记
+    sync <文件>      同步包含该文件（主文件或其引用的文件）的笔记，不属于任何笔记时直接返回
+    status          守护进程状态和最近同步的指标摘要
+支持 Unix 域套接字时监听 DAEMON_SOCKET，否则（如 Windows）监听 127.0.0.1 上的 DAEMON_PORT。
+
+可以单独运行（python sync_daemon.py），也可以由托盘程序或 watch_and_sync.py --daemon 在后台线程中运行，
+与文件监控共用同一个进程和缓存；同一笔记的同步由 VaultSync.lock 串行执行。
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime
+
+import sync_logic
+import sync_metrics
+from copyq_session import get_session
+from sync_client import get_daemon_address, send_request
+
+logger = logging.getLogger(__name__)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode('utf-8', errors='replace').strip()
+        try:
+            reply = self.server.sync_daemon.handle_command(line)
+        except Exception as e:
+            logger.exception(f"处理请求 {line!r} 时出错")
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode('utf-8'))
+
+class SyncDaemon:
+    def __init__(self, md_path=None, data_dir=None):
+        """
+        :param md_path: 只服务这一个主 Markdown 文件，默认服务所有配置的笔记（VAULTS）
+        :param data_dir: 与 md_path 一起使用的命令存储目录，默认由 sync_logic.vault_data_dir 决定
+        """
+        self.md_path = md_path
+        self.data_dir = data_dir
+        self.family, self.address = get_daemon_address()
+        self.server = None
+        self.started_at = None
+        self.sync_count = 0
+        self.last_result = None
+        self._thread = None
+
+    def handle_command(self, line):
+        """
+        执行一条请求
+        :param line: 请求行，如 "sync"、"sync /path/to/file.md"、"status"
+        :return: 回复字典，ok 表示是否成功
+        """
+        command, _, argument = line.partition(" ")
+        if command == "sync":
+            return self.sync(argument.strip() or None)
+        if command == "status":
+            return self.status()
+        return {"ok": False, "error": f"未知命令: {command}"}
+
+    def vaults(self):
+        """守护进程服务的笔记"""
+        if self.md_path is not None:
+            return [sync_logic.get_vault(self.md_path, self.data_dir)]
+        return sync_logic.configured_vaults()
+
+    def sync(self, file_path=None):
+        """
+        执行一次同步
+        :param file_path: 编辑器保存的文件，只同步包含它的笔记；不属于任何笔记时不同步，回复中 skipped 为 True
+        """
+        vaults = self.vaults()
+        if file_path:
+            vaults = [vault for vault in vaults if vault.is_vault_file(file_path)]
+            if not vaults:
+                return {"ok": True, "skipped": True, "reason": f"{file_path} 不属于任何笔记"}
+        results = sync_logic.sync_all(vaults)
+        self.sync_count += 1
+        errors = [result["error"] for result in results.values() if "error" in result]
+        if errors:
+            return {"ok": False, "error": "; ".join(errors)}
+        self.last_result = {key: sum(result.get(key, 0) for result in results.values())
+                            for key in ("new", "updated", "removed", "tags_updated")}
+        self.last_result["unchanged"] = all(result.get("unchanged", False) for result in results.values())
+        reply = {"ok": True, **self.last_result}
+        if len(results) == 1:
+            reply["metrics"] = next(iter(results.values())).get("metrics")
+        else:
+            reply["vaults"] = {md_path: {key: result.get(key, 0) for key in ("new", "updated", "removed", "tags_updated")}
+                               for md_path, result in results.items()}
+        return reply
+
+    def status(self):
+        """守护进程状态、上次同步结果、各笔记的状态和最近同步的指标摘要"""
+        return {
+            "ok": True,
+            "pid": os.getpid(),
+            "address": self.address,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "uptime_s": round(time.time() - self.started_at.timestamp(), 1) if self.started_at else 0,
+            "syncs": self.sync_count,
+            "last_result": self.last_result,
+            "vaults": [vault.status() for vault in self.vaults()],
+            "copyq_healthy": get_session().healthy,
+            "metrics": sync_metrics.summary(),
+        }
+
+    @staticmethod
+    def _already_running():
+        """向监听地址发送 status 请求，能连上并收到回复说明已有守护进程（或其他程序）在使用该地址"""
+        try:
+            send_request("status", timeout=1)
+        except OSError:
+            return False
+        except ValueError:
+            pass  # 回复不是 JSON，地址被其他程序占用
+        return True
+
+    def _create_server(self):
+        if self.family == socket.AF_INET:
+            logger.warning(f"当前系统不支持 Unix 域套接字，守护进程改为监听 {self.address[0]}:{self.address[1]}")
+            if self._already_running():
+                raise RuntimeError(f"已有同步守护进程在 {self.address[0]}:{self.address[1]} 上运行")
+            server = socketserver.ThreadingTCPServer(self.address, _RequestHandler, bind_and_activate=False)
+            # Windows 上 SO_REUSEADDR 允许抢占其他进程正在监听的端口，只在其他系统上开启
+            server.allow_reuse_address = os.name != "nt"
+            server.server_bind()
+            server.server_activate()
+        else:
+            if os.path.exists(self.address):
+                # 能连上说明已有守护进程在运行；连不上则是上次异常退出留下的套接字文件
+                if self._already_running():
+                    raise RuntimeError(f"已有同步守护进程在 {self.address} 上运行")
+                os.remove(self.address)
+            server = socketserver.ThreadingUnixStreamServer(self.address, _RequestHandler)
+        server.daemon_threads = True
+        server.sync_daemon = self
+        return server
+
+    def start(self, blocking=True):
+        """
+        开始监听请求
+        :param blocking: True 时在当前线程中运行直到 stop 或 Ctrl+C，False 时在后台线程中运行
+        """
+        if self.server is not None:
+            logger.warning("同步守护进程已在运行中。")
+            return
+        self.server = self._create_server()
+        self.started_at = datetime.now()
+        logger.info(f"同步守护进程已启动，监听 {self.address}")
+        if not blocking:
+            self._thread = threading.Thread(target=self.server.serve_forever, name="SyncDaemon", daemon=True)
+            self._thread.start()
+            return
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("检测到中断信号，正在停止同步守护进程...")
+            self._close()
+
+    def stop(self):
+        """停止监听，可以从任意线程调用（但不能在请求处理中调用）"""
+        if self.server is None:
+            return False
+        self.server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close()
+        return True
+
+    def _close(self):
+        self.server.server_close()
+        self.server = None
+        if self.family != socket.AF_INET:
+            try:
+                os.remove(self.address)
+            except OSError:
+                pass
+        logger.info("同步守护进程已停止。")
+
+# 托盘程序和 watch_and_sync.py 在后台线程中运行的守护进程
+_daemon = None
+
+def start_daemon():
+    """在后台线程中启动守护进程，失败（如已有守护进程在运行）时记录错误并返回 None"""
+    global _daemon
+    if _daemon is not None:
+        return _daemon
+    daemon = SyncDaemon()
+    try:
+        daemon.start(blocking=False)
+    except (OSError, RuntimeError) as e:
+        logger.error(f"无法启动同步守护进程: {e}")
+        return None
+    _daemon = daemon
+    return daemon
+
+def stop_daemon():
+    """停止后台线程中的守护进程"""
+    global _daemon
+    if _daemon is None:
+        return False
+    _daemon.stop()
+    _daemon = None
+    # 等待请求中进行的同步完成，保存缓存
+    sync_logic.save_caches()
+    return True
+
+def main():
+    from utils import configure_logging
+    configure_logging()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        SyncDaemon().start(blocking=True)
+    except (OSError, RuntimeError) as e:
+        logger.error(f"无法启动同步守护进程: {e}")
+        return 1
+    sync_logic.save_caches()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+托盘程序的同步执行器：所有手动同步都在一个工作线程中依次执行，结果和进度通过 Qt 信号发回界面线程。
+
+同步进行中再次请求同步时不会另开线程，只记下一次待执行的后续同步；
+多次请求合并为一次，当前同步结束后按最新的笔记内容再同步一次。
+"""
+import logging
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import sync_metrics
+
+logger = logging.getLogger(__name__)
+
+class SyncExecutor(QObject):
+    started = pyqtSignal()  # 开始一次同步
+    progress = pyqtSignal(int, int)  # (已导出条数, 待导出总条数)，多个笔记并发同步时为合计
+    finished = pyqtSignal(object)  # sync_all 的结果 {主文件路径: 结果字典}
+    failed = pyqtSignal(str)  # 同步抛出异常时的错误信息
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._condition = threading.Condition()
+        self._pending_engine = None  # 待执行的同步使用的引擎模块，为 None 表示没有待执行的同步
+        self._running = False
+        self._stopped = False
+        self._progress = {}  # SyncMetrics -> (已完成数, 总数)，当前同步中各笔记的进度
+        self._thread = threading.Thread(target=self._run, name="TraySyncExecutor", daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        with self._condition:
+            return self._running or self._pending_engine is not None
+
+    def request(self, engine):
+        """
+        请求同步一次所有配置的笔记
+        :param engine: 同步引擎模块（sync_logic 或 async_sync），使用其 sync_all
+        :return: True 表示立即开始；False 表示已有同步在进行，合并为它结束后的一次后续同步
+        """
+        with self._condition:
+            queued = self._running or self._pending_engine is not None
+            self._pending_engine = engine
+            self._condition.notify_all()
+        if queued:
+            logger.info("已有同步在进行，完成后再同步一次。")
+        return not queued
+
+    def shutdown(self, timeout=None):
+        """停止执行器，丢弃待执行的同步，等待正在进行的同步结束（最多 timeout 秒）"""
+        with self._condition:
+            self._stopped = True
+            self._pending_engine = None
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _next_engine(self):
+        with self._condition:
+            while self._pending_engine is None and not self._stopped:
+                self._condition.wait()
+            if self._stopped:
+                return None
+            engine, self._pending_engine = self._pending_engine, None
+            self._running = True
+            return engine
+
+    def _run(self):
+        while True:
+            engine = self._next_engine()
+            if engine is None:
+                return
+            self._progress.clear()
+            self.started.emit()
+            try:
+                # 只报告本执行器发起的同步的进度，监控线程中的同步不影响托盘的进度提示
+                with sync_metrics.reporting_progress(self._on_progress):
+                    results = engine.sync_all()
+            except Exception as e:
+                logger.exception("同步任务执行失败")
+                self.failed.emit(str(e))
+            else:
+                self.finished.emit(results)
+            finally:
+                with self._condition:
+                    self._running = False
+
+    def _on_progress(self, metrics, done, total):
+        # 在执行同步的线程（可能是线程池中的多个线程）中调用，信号以排队方式送到界面线程
+        with self._condition:
+            self._progress[metrics] = (done, total)
+            done = sum(item[0] for item in self._progress.values())
+            total = sum(item[1] for item in self._progress.values())
+        self.progress.emit(done, total)
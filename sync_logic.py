@@ -1,197 +1,676 @@
+import contextvars
+import hashlib
 import os
+import sys
+import threading
+import time
 from pathlib import Path
 from datetime import datetime
-import json
 import logging
-import re
-import time
-
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 
-from clipboard_manager import export_to_clipboard
-from import_commands import parse_md_content
-from config import DATA_DIR, MARKDOWN_FILE, COMMAND_STORE_FILE, DEFAULT_TAB
+import sync_metrics
+from clipboard_manager import (discard_tab_index, export_batch, get_tab_index, remove_from_clipboard, reconcile_tab,
+                               tab_lock, update_tags)
+from parse_cache import ParseCache
+from command_store import CommandStore, CommandRecord, mask_tags, tag_mask
+from content_hash import content_digest
+from sync_state import SyncState
+from config import (DATA_DIR, MARKDOWN_FILE, COMMAND_STORE_FILE, COMMAND_LOG_FILE, DEFAULT_TAB,
+                    CHECK_DUPLICATES, DELETE_REMOVED_FROM_COPYQ, PARSE_WORKERS, PARSE_EXECUTOR,
+                    SKIP_UNCHANGED_VAULT, SYNC_STATE_FILE, VAULTS, VAULT_SYNC_WORKERS, PARSE_CACHE_FILE,
+                    SHUTDOWN_TIMEOUT)
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_command_store(store_path):
-    """加载已存储的命令"""
-    if os.path.exists(store_path):
-        with open(store_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
+PROJECT_DIR = Path(__file__).parent
 
-def save_command_store(commands, store_path):
-    """保存命令到存储文件"""
-    with open(store_path, 'w', encoding='utf-8') as f:
-        json.dump(commands, f, ensure_ascii=False, indent=2)
+# 命令存储在进程内保留，避免每次同步重新加载
+_command_stores = {}
+# 同步状态（上次同步时的笔记哈希），按数据目录缓存
+_sync_states = {}
+# 主文件路径 -> VaultSync，每个笔记在进程内只有一个同步引擎
+_vaults = {}
+# 多个笔记可能在不同线程中同时同步，保护上面几个缓存的创建
+_registry_lock = threading.Lock()
 
-def run_one_time_sync():
+def get_command_store(data_dir):
+    """获取数据目录对应的命令存储，进程内复用同一实例，只读取其他进程新追加的内容"""
+    log_path = str(Path(data_dir) / COMMAND_LOG_FILE)
+    with _registry_lock:
+        store = _command_stores.get(log_path)
+        if store is None:
+            Path(data_dir).mkdir(parents=True, exist_ok=True)
+            store = _command_stores[log_path] = CommandStore(log_path, legacy_path=Path(data_dir) / COMMAND_STORE_FILE)
+            return store
+    store.refresh()
+    return store
+
+def get_sync_state(data_dir):
+    """获取数据目录对应的同步状态，进程内复用同一实例"""
+    state_path = str(Path(data_dir) / SYNC_STATE_FILE)
+    with _registry_lock:
+        state = _sync_states.get(state_path)
+        if state is None:
+            state = _sync_states[state_path] = SyncState(state_path)
+        return state
+
+def snapshot_items(parsed_items):
     """
-    执行一次性同步命令。
-    从md文件解析，更新json存储，导出到剪贴板。
-    返回一个包含新命令和更新命令数量的字典。
+    把解析结果整理为 {内容哈希: (内容, [标签字符串, ...])}，保留出现顺序。
+    规范化后相同的近似重复内容合并为一项，内容取第一次出现的原文
     """
-    current_dir = Path(__file__).parent
-    md_path = current_dir / DATA_DIR / MARKDOWN_FILE
-    store_path = current_dir / DATA_DIR / COMMAND_STORE_FILE
-
-    logger.info(f"开始同步文件: {md_path}")
-    
-    try:
-        with open(md_path, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-    except FileNotFoundError:
-        logger.error(f"Markdown 文件未找到: {md_path}")
-        return {"new": 0, "updated": 0, "error": "Markdown file not found."}
-
-    parsed_items = parse_md_content(md_content, base_path=md_path)
-    stored_commands = load_command_store(store_path)
-    command_map = {cmd['command']: cmd for cmd in stored_commands}
-    
-    new_count = 0
-    update_count = 0
-    start_time = datetime.now()
-    
+    snapshot = {}
     for content, tags in parsed_items:
-        tags_list = tags.split(',')
-        if content not in command_map:
-            command_data = {
-                "command": content,
-                "tags": tags_list,
-                "created_at": datetime.now().isoformat(),
-                "last_exported": None
-            }
-            
-            if export_to_clipboard(content, tab=DEFAULT_TAB, tags=tags):
-                command_data["last_exported"] = datetime.now().isoformat()
-                logger.info(f"导出新命令: {content} | 标签: {tags}")
-            
-            stored_commands.append(command_data)
-            command_map[content] = command_data
-            new_count += 1
-        else:
-            existing_cmd = command_map[content]
-            existing_tags = set(existing_cmd['tags'])
-            new_tags = set(tags_list)
-            
-            if not new_tags.issubset(existing_tags):
-                missing_tags = new_tags - existing_tags
-                existing_cmd['tags'] = list(existing_tags | missing_tags)
-                
-                if export_to_clipboard(content, tab=DEFAULT_TAB, tags=','.join(existing_cmd['tags'])):
-                    existing_cmd["last_exported"] = datetime.now().isoformat()
-                    logger.info(f"更新命令标签: {content} | 新增标签: {','.join(missing_tags)}")
-                update_count += 1
-    
-    if new_count > 0 or update_count > 0:
-        save_command_store(stored_commands, store_path)
-        elapsed_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"同步完成。新增 {new_count} 条，更新 {update_count} 条。用时 {elapsed_time:.1f} 秒。")
-    else:
-        logger.info("同步完成。没有发现新命令或需要更新的标签。")
-        
-    return {"new": new_count, "updated": update_count}
-
-# --- Watchdog Logic ---
-
-def extract_referenced_files(md_file_path):
-    """提取Markdown文件中引用的其他文件路径"""
-    referenced_files = set()
-    try:
-        with open(md_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            matches = re.findall(r'\[\[(.*?)\]\]', content)
-            for file_path in matches:
-                if os.path.isabs(file_path):
-                    abs_path = file_path
+        entry = snapshot.get(content_digest(content))
+        if entry is None:
+            entry = snapshot[content_digest(content)] = (content, [])
+        if tags not in entry[1]:
+            entry[1].append(tags)
+    return snapshot
+
+def diff_snapshots(previous, current):
+    """
+    按内容哈希比较两次解析结果，只有空白或转义不同的内容不算变化
+    :param previous: 上一次的 snapshot_items 结果
+    :param current: 本次的 snapshot_items 结果
+    :return: 包含 added、removed、retagged 三个内容列表的字典
+    """
+    return {
+        "added": [content for key, (content, _) in current.items() if key not in previous],
+        "removed": [content for key, (content, _) in previous.items() if key not in current],
+        "retagged": [content for key, (content, tags) in current.items()
+                     if key in previous and previous[key][1] != tags],
+    }
+
+def get_main_markdown_path():
+    """主 Markdown 文件的绝对路径，解析缓存、引用关系图和文件监控都使用这一路径作为键"""
+    return os.path.abspath(PROJECT_DIR / DATA_DIR / MARKDOWN_FILE)
+
+def vault_data_dir(md_path, tab):
+    """
+    笔记的命令存储和同步状态所在目录：默认笔记（DATA_DIR/MARKDOWN_FILE 同步到 DEFAULT_TAB）沿用 DATA_DIR，
+    其他笔记各自使用 DATA_DIR/vaults 下按标签页和主文件路径命名的子目录
+    """
+    if os.path.normcase(md_path) == os.path.normcase(get_main_markdown_path()) and tab == DEFAULT_TAB:
+        return PROJECT_DIR / DATA_DIR
+    suffix = hashlib.blake2b(os.path.normcase(md_path).encode('utf-8'), digest_size=4).hexdigest()
+    name = "".join(char if char.isalnum() else "_" for char in tab)
+    return PROJECT_DIR / DATA_DIR / "vaults" / f"{name}-{suffix}"
+
+class SyncPlan:
+    """一次同步中解析和比较阶段的结果，导出到 CopyQ 之后交给 finish_sync 收尾"""
+    def __init__(self, snapshot, delta, store, pending_exports, to_remove, new_count, update_count, start_time,
+                 vault=None, vault_files=None, pending_retags=None):
+        self.snapshot = snapshot
+        self.delta = delta
+        self.store = store
+        self.pending_exports = pending_exports  # (内容, 标签, CommandRecord, 日志信息) 列表
+        self.pending_retags = pending_retags or []  # 已导出过、只需追加标签的命令，格式同 pending_exports，标签为合并后的全部标签
+        self.retag_states = []  # 与 pending_retags 一一对应的 update_tags 结果，调用失败时为 None
+        self.present_states = []  # 与 present_items 一一对应的 update_tags 结果，调用失败时为 None
+        self.to_remove = to_remove  # 需要从 CopyQ 删除的内容列表
+        self.new_count = new_count
+        self.update_count = update_count
+        self.start_time = start_time
+        self.vault = vault  # 生成本计划的 VaultSync
+        self.vault_files = vault_files  # 解析之前计算的各文件内容哈希，同步完成后记录到同步状态
+
+    @property
+    def export_items(self):
+        """待导出的 (内容, 标签) 列表，直接传给 export_batch"""
+        return [(content, tags) for content, tags, _, _ in self.pending_exports]
+
+    @property
+    def retag_items(self):
+        """待更新标签的 (内容, 标签) 列表，直接传给 update_tags"""
+        return [(content, tags) for content, tags, _, _ in self.pending_retags]
+
+    def present_items(self, inserted):
+        """
+        export_batch 结果为已存在的 (内容, 标签) 列表。导出会跳过标签页中已有的内容，
+        这些条目的标签要另外用 update_tags 追加，结果记录到 present_states
+        :param inserted: 与 pending_exports 一一对应的 export_batch 结果
+        """
+        return [(content, tags) for (content, tags, _, _), was_inserted in zip(self.pending_exports, inserted)
+                if was_inserted is False]
+
+    def apply_retag_results(self, states):
+        """
+        记录 update_tags 的结果；标签页中已经没有的命令（如在 CopyQ 中被手动删除）改为重新导出
+        :param states: 与 pending_retags 一一对应的状态列表；调用失败时为 None
+        """
+        if states is None:
+            self.retag_states = [None] * len(self.pending_retags)
+            return
+        self.retag_states = states
+        self.pending_exports.extend(entry for entry, state in zip(self.pending_retags, states) if state < 0)
+
+class VaultSync:
+    """
+    一个笔记（主 Markdown 文件及其引用的文件 -> CopyQ 标签页）的同步引擎，保存该笔记的解析缓存和上一次的解析结果。
+    同一笔记的同步由 lock 串行执行；写入 CopyQ 时再按标签页加锁（clipboard_manager.tab_lock），
+    不同笔记可以并发同步，同步到同一标签页的写入依次进行。
+    """
+    def __init__(self, md_path, tab=DEFAULT_TAB, data_dir=None):
+        """
+        :param md_path: 主 Markdown 文件的绝对路径
+        :param tab: 同步到的 CopyQ 标签页
+        :param data_dir: 命令存储和同步状态所在目录，默认由 vault_data_dir 决定
+        """
+        self.md_path = md_path
+        self.tab = tab
+        self.data_dir = Path(data_dir) if data_dir else vault_data_dir(md_path, tab)
+        # 写入 CopyQ 条目的标记值，区分同一标签页中不同笔记写入的条目
+        self.marker = hashlib.blake2b(f"{os.path.normcase(md_path)}\0{tab}".encode('utf-8'),
+                                      digest_size=8).hexdigest()
+        self.lock = threading.Lock()
+        # 解析缓存在进程内保留，监控模式下每次同步只重新解析变化的文件；退出时保存，重启后沿用
+        self.parse_cache = ParseCache(workers=PARSE_WORKERS, executor=PARSE_EXECUTOR)
+        if PARSE_CACHE_FILE:
+            self.parse_cache.load(self.data_dir / PARSE_CACHE_FILE)
+        self.previous_snapshot = None  # 上一次同步的解析结果，用于计算增量
+        # 供托盘和守护进程显示的状态
+        self.state = "idle"  # "idle"、"syncing" 或 "error"
+        self.last_sync_at = None
+        self.last_result = None
+        self.last_error = None
+
+    def plan(self):
+        """
+        同步的第一阶段：解析 md 文件，与上一次的解析结果比较，在命令存储中登记增量。
+        不调用 CopyQ，同步引擎可以在线程中执行这一阶段。
+        :return: (SyncPlan, None)；文件不存在或没有变化时返回 (None, 结果字典)
+        """
+        md_path = self.md_path
+        vault_files = None
+        if SKIP_UNCHANGED_VAULT:
+            with sync_metrics.stage("hash"):
+                recorded = get_sync_state(self.data_dir).get_vault_files(md_path, self.tab)
+                # 先按上次记录的文件列表比较内容哈希，笔记没有变化时不需要解析任何文件
+                unchanged = recorded is not None and all(
+                    self.parse_cache.current_digest(path) == digest for path, digest in recorded.items())
+                if not unchanged:
+                    vault_files = self.parse_cache.vault_files(md_path)
+            if unchanged:
+                logger.info(f"文件内容与上次同步时相同，跳过同步: {md_path}")
+                return None, {"new": 0, "updated": 0, "removed": 0, "unchanged": True,
+                              "delta": {"added": [], "removed": [], "retagged": []}}
+
+        logger.info(f"开始同步文件: {md_path} -> 标签页 {self.tab}")
+
+        try:
+            parsed_items = self.parse_cache.parse(md_path)
+        except FileNotFoundError:
+            logger.error(f"Markdown 文件未找到: {md_path}")
+            return None, {"new": 0, "updated": 0, "error": "Markdown file not found."}
+
+        parsed_count = len(parsed_items)
+        with sync_metrics.stage("diff"):
+            snapshot = snapshot_items(parsed_items)
+            delta = diff_snapshots(self.previous_snapshot or {}, snapshot)
+        if self.previous_snapshot is not None:
+            if not any(delta.values()):
+                sync_metrics.count("items_skipped", parsed_count)
+                if vault_files is not None:
+                    get_sync_state(self.data_dir).record_vault(md_path, self.tab, vault_files)
+                logger.info("同步完成。解析结果与上次相同，无需同步。")
+                return None, {"new": 0, "updated": 0, "removed": 0, "delta": delta}
+            # 只处理新增和标签变化的内容，保持原有的出现顺序
+            changed = {content_digest(content) for content in delta["added"] + delta["retagged"]}
+            parsed_items = [(content, tags) for content, tags in parsed_items if content_digest(content) in changed]
+
+        with sync_metrics.stage("store_load"):
+            store = get_command_store(self.data_dir)
+
+        new_count = 0
+        update_count = 0
+        start_time = datetime.now()
+        pending_exports = []  # (内容, 标签, 命令记录, 日志信息)
+        pending_retags = []  # 已存在的命令只在 CopyQ 中追加标签，不重新导出
+        export_positions = {}  # 本次排队导出的命令的哈希 -> 在 pending_exports 中的位置
+        retag_positions = {}  # 本次排队更新标签的命令的哈希 -> 在 pending_retags 中的位置
+
+        for content, tags in parsed_items:
+            new_tags = tag_mask(tags)
+            key = content_digest(content)
+            position = export_positions.get(key)
+            if position is not None:
+                # 本次排队导出的命令的近似重复项带来了新标签，导出时一并写入
+                export_content, export_tags, command_data, message = pending_exports[position]
+                merged_tags = tag_mask(export_tags) | new_tags
+                if merged_tags != tag_mask(export_tags):
+                    pending_exports[position] = (export_content, ','.join(mask_tags(merged_tags)), command_data, message)
+                continue
+            existing_cmd = store.get(content)
+            if existing_cmd is None:
+                command_data = CommandRecord(content, new_tags)
+                export_positions[key] = len(pending_exports)
+                pending_exports.append((content, tags, command_data, f"导出新命令: {content} | 标签: {tags}"))
+
+                store.put(command_data)
+                new_count += 1
+            elif existing_cmd.last_exported is None:
+                # 之前没有写入 CopyQ 的命令（如导出调用失败），连同新标签重新导出；
+                # 标签写入 CopyQ 之后才合并到命令存储（finish）
+                export_tags = ','.join(mask_tags(existing_cmd.tag_mask | new_tags))
+                export_positions[key] = len(pending_exports)
+                pending_exports.append((content, export_tags, existing_cmd,
+                                        f"重新导出命令: {content} | 标签: {export_tags}"))
+            elif not existing_cmd.has_tags(new_tags):
+                # 标签写入 CopyQ 之后才合并到命令存储（finish），更新失败时下次同步重试
+                position = retag_positions.get(key)
+                if position is not None:
+                    retag_content, merged_tags, _, _ = pending_retags[position]
+                    new_tags |= tag_mask(merged_tags)
                 else:
-                    abs_path = os.path.join(os.path.dirname(md_file_path), file_path)
-                
-                if os.path.exists(abs_path):
-                    referenced_files.add(abs_path)
-                    nested_refs = extract_referenced_files(abs_path)
-                    referenced_files.update(nested_refs)
+                    position = retag_positions[key] = len(pending_retags)
+                    pending_retags.append(None)
+                    retag_content = content
+                    update_count += 1
+                missing_tags = mask_tags(new_tags & ~existing_cmd.tag_mask)
+                pending_retags[position] = (retag_content, ','.join(mask_tags(existing_cmd.tag_mask | new_tags)),
+                                            existing_cmd, f"更新命令标签: {content} | 新增标签: {','.join(missing_tags)}")
+
+        sync_metrics.count("items_new", new_count)
+        sync_metrics.count("items_updated", update_count)
+        sync_metrics.count("items_skipped", parsed_count - new_count - update_count)
+
+        to_remove = []
+        if DELETE_REMOVED_FROM_COPYQ and self.previous_snapshot is not None and delta["removed"]:
+            # 同步到同一标签页的其他笔记中仍有的命令不删除
+            shared = set()
+            for vault in tab_vaults(self.tab):
+                if vault is not self and vault.previous_snapshot:
+                    shared.update(vault.previous_snapshot)
+            to_remove = [content for content in delta["removed"] if content_digest(content) not in shared]
+
+        return SyncPlan(snapshot, delta, store, pending_exports, to_remove, new_count, update_count, start_time,
+                        self, vault_files, pending_retags), None
+
+    def finish(self, plan, inserted, removed_count):
+        """
+        同步的最后阶段：记录导出结果，保存命令存储
+        :param plan: plan 返回的 SyncPlan
+        :param inserted: 与 plan.pending_exports 一一对应的 export_batch 结果（True 已写入、False 已存在、None 失败）；
+                         已存在的命令由 plan.present_states 中 update_tags 的结果决定标签是否写入
+        :param removed_count: 实际从 CopyQ 删除的条目数；删除调用失败时为 None
+        :return: 包含新命令、更新命令、删除命令数量、CopyQ 中实际更新标签的条目数（tags_updated）
+                 及增量明细（delta）的字典
+        """
+        exported_at = datetime.now().timestamp()
+        export_failed = plan.retag_states.count(None)
+        present_states = iter(plan.present_states or ())
+        for (_, tags, command_data, message), was_inserted in zip(plan.pending_exports, inserted):
+            if was_inserted is False:
+                # 标签页中已有该内容：标签追加成功才算导出完成；条目已被删除（-1）时索引已过期，下次同步重新导出
+                state = next(present_states, None)
+                if state is not None and state < 0:
+                    discard_tab_index(self.tab)
+                if state is None or state < 0:
+                    was_inserted = None
+            if was_inserted is None:
+                export_failed += 1
+                continue
+            # 新导出的命令、重新导出的命令在这里合并新标签；已存在的命令同样记录导出时间，完整同步时不再重复导出
+            self.merge_tags(plan.store, command_data, tags)
+            self.mark_exported(plan.store, command_data, exported_at)
+            if was_inserted:
+                logger.info(message)
+        tags_updated = 0
+        for (_, tags, command_data, message), state in zip(plan.pending_retags, plan.retag_states):
+            if state is None or state < 0:
+                continue
+            self.merge_tags(plan.store, command_data, tags)
+            if state > 0:
+                self.mark_exported(plan.store, command_data, exported_at)
+                logger.info(message)
+                tags_updated += 1
+        if export_failed:
+            logger.warning(f"{export_failed} 条命令或标签没有写入 CopyQ，下次同步时重试")
+
+        snapshot = plan.snapshot
+        remove_failed = bool(plan.to_remove) and removed_count is None
+        if remove_failed:
+            # 删除失败：把这些命令留在本次的解析结果中，下次同步的增量里仍是已移除，再次删除
+            logger.warning(f"{len(plan.to_remove)} 条已移除的命令没有从 CopyQ 删除，下次同步时重试")
+            removed_keys = {content_digest(content) for content in plan.to_remove}
+            snapshot = dict(snapshot)
+            snapshot.update((key, entry) for key, entry in self.previous_snapshot.items() if key in removed_keys)
+            removed_count = 0
+        elif plan.to_remove:
+            # 在存储中记录墓碑，之后重新加入的命令才会被再次导出
+            for content in plan.to_remove:
+                plan.store.tombstone(content)
+            logger.info(f"从 CopyQ 删除已移除的命令 {removed_count} 条")
+
+        # 导出失败时丢弃上一次的解析结果：下次同步与命令存储完整比较，重新导出 last_exported 为空的命令、
+        # 重新更新命令存储中还缺少的标签
+        self.previous_snapshot = None if export_failed else snapshot
+        with sync_metrics.stage("store_save"):
+            plan.store.flush()
+            # 有命令没有写入或删除时不记录文件哈希，否则重启后笔记未变化会跳过同步，不再重试
+            if plan.vault_files is not None and not export_failed and not remove_failed:
+                get_sync_state(self.data_dir).record_vault(self.md_path, self.tab, plan.vault_files)
+
+        new_count, update_count = plan.new_count, plan.update_count
+        if new_count > 0 or update_count > 0 or removed_count > 0:
+            elapsed_time = (datetime.now() - plan.start_time).total_seconds()
+            logger.info(f"同步完成。新增 {new_count} 条，更新 {update_count} 条，删除 {removed_count} 条。用时 {elapsed_time:.1f} 秒。")
+        else:
+            logger.info("同步完成。没有发现新命令或需要更新的标签。")
+
+        return {"new": new_count, "updated": update_count, "removed": removed_count, "tags_updated": tags_updated,
+                "delta": plan.delta}
+
+    @staticmethod
+    def merge_tags(store, command_data, tags):
+        """把已写入 CopyQ 的标签合并到命令记录"""
+        mask = tag_mask(tags)
+        if not command_data.has_tags(mask):
+            command_data.add_tags(mask)
+            store.put(command_data)
+
+    @staticmethod
+    def mark_exported(store, command_data, exported_at):
+        """记录命令写入 CopyQ 的时间"""
+        command_data.last_exported = exported_at
+        store.put(command_data)
+
+    def sync(self):
+        """
+        执行一次同步：解析笔记，只把增量更新到命令存储并导出到 CopyQ 标签页。
+        :return: 包含新命令、更新命令、删除命令数量、增量明细（delta）及分阶段指标（metrics）的字典
+        """
+        with self.lock, sync_metrics.collecting() as metrics:
+            self.state = "syncing"
+            try:
+                plan, result = self.plan()
+                if plan is not None:
+                    with tab_lock(self.tab):
+                        if plan.pending_retags:
+                            plan.apply_retag_results(update_tags(plan.retag_items, tab=self.tab))
+
+                        inserted = []
+                        if plan.pending_exports:
+                            index = get_tab_index(self.tab) if CHECK_DUPLICATES else None
+                            inserted = export_batch(plan.export_items, tab=self.tab, index=index, marker=self.marker)
+                            if False in inserted:
+                                plan.present_states = update_tags(plan.present_items(inserted), tab=self.tab)
+
+                        removed_count = 0
+                        if plan.to_remove:
+                            removed_count = remove_from_clipboard(plan.to_remove, tab=self.tab, marker=self.marker)
+
+                    result = self.finish(plan, inserted, removed_count)
+            except Exception as e:
+                self.record_result(error=str(e))
+                raise
+            self.record_result(result)
+        result["metrics"] = metrics.as_dict()
+        return result
+
+    def record_result(self, result=None, error=None):
+        """记录同步结果，更新显示的状态"""
+        self.last_sync_at = datetime.now()
+        self.last_error = error or (result or {}).get("error")
+        if result is not None:
+            self.last_result = {key: result.get(key, 0) for key in ("new", "updated", "removed", "tags_updated")}
+        self.state = "error" if self.last_error else "idle"
+
+    def save_caches(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        等待进行中的同步完成（最多 timeout 秒），保存命令存储中未写入的修改和解析缓存，关闭并行解析的进程池
+        :return: 是否保存；同步未在 timeout 内完成时不保存，返回 False
+        """
+        if not self.lock.acquire(timeout=timeout):
+            logger.warning(f"笔记 {self.md_path} 的同步未在 {timeout} 秒内完成，不保存缓存")
+            return False
+        try:
+            store = _command_stores.get(str(Path(self.data_dir) / COMMAND_LOG_FILE))
+            if store is not None:
+                store.flush()
+            if PARSE_CACHE_FILE:
+                self.data_dir.mkdir(parents=True, exist_ok=True)
+                self.parse_cache.save(self.data_dir / PARSE_CACHE_FILE)
+        except OSError as e:
+            logger.error(f"保存笔记 {self.md_path} 的缓存失败: {e}")
+            return False
+        finally:
+            # 之后还有同步时（如只停止了守护进程）按需重新创建
+            self.parse_cache.close()
+            self.lock.release()
+        return True
+
+    def status(self):
+        """笔记的同步状态，供托盘菜单和守护进程的 status 请求显示"""
+        return {
+            "md_path": self.md_path,
+            "tab": self.tab,
+            "state": self.state,
+            "last_sync_at": self.last_sync_at.isoformat() if self.last_sync_at else None,
+            "last_result": self.last_result,
+            "error": self.last_error,
+        }
+
+    def reconcile(self, apply=False):
+        """
+        对账：找出命令存储和 CopyQ 标签页中已不在笔记里的命令。
+        只涉及本笔记写入的条目（带本笔记的标记，或命令存储记录为本工具写入），不会删除剪贴板中的其他内容；
+        同步到同一标签页的其他笔记中仍有的命令也会保留。
+        :param apply: 为 True 时在一次 CopyQ 调用中删除这些条目，并在命令存储中记录墓碑；否则只预演
+        :return: 包含 stale（存储中过时的命令）、copyq_stale（标签页中过时的条目）、tombstoned、applied 的字典
+        """
+        # 同一标签页中其他笔记的命令，各自加锁解析，不与本笔记的锁嵌套
+        shared = set()
+        for vault in tab_vaults(self.tab):
+            if vault is self:
+                continue
+            with vault.lock:
+                try:
+                    shared.update(content for content, _ in vault.parse_cache.parse(vault.md_path))
+                except FileNotFoundError:
+                    logger.warning(f"同一标签页的笔记文件未找到: {vault.md_path}")
+
+        with self.lock, sync_metrics.collecting() as metrics:
+            try:
+                keep = {content for content, _ in self.parse_cache.parse(self.md_path)}
+            except FileNotFoundError:
+                logger.error(f"Markdown 文件未找到: {self.md_path}")
+                return {"error": "Markdown file not found."}
+            store = get_command_store(self.data_dir)
+            keep_keys = {content_digest(content) for content in keep}
+            stale = [record for record in store.values() if content_digest(record.command) not in keep_keys]
+            known = [record.command for record in stale if record.last_exported is not None]
+
+            with tab_lock(self.tab):
+                copyq_stale = reconcile_tab(keep | shared, known, tab=self.tab, apply=apply, marker=self.marker)
+            if copyq_stale is None:
+                return {"error": "CopyQ reconcile failed."}
+
+            tombstoned = 0
+            if apply:
+                for record in stale:
+                    tombstoned += store.tombstone(record.command)
+                with sync_metrics.stage("store_save"):
+                    store.flush()
+                if tombstoned or copyq_stale:
+                    # 之后重新加入笔记的命令需要再次导出：下次同步不按增量和笔记哈希跳过，与命令存储完整比较
+                    self.previous_snapshot = None
+                    get_sync_state(self.data_dir).forget_vault(self.md_path)
+                logger.info(f"对账完成（{self.md_path}）。从 CopyQ 删除 {len(copyq_stale)} 条，"
+                            f"命令存储中标记删除 {tombstoned} 条。")
+            else:
+                logger.info(f"对账预演（{self.md_path}）：CopyQ 中有 {len(copyq_stale)} 条、"
+                            f"命令存储中有 {len(stale)} 条命令已不在笔记中。")
+        return {"stale": [record.command for record in stale], "copyq_stale": copyq_stale,
+                "tombstoned": tombstoned, "applied": apply, "metrics": metrics.as_dict()}
+
+    def cached_file_digest(self, file_path):
+        """解析缓存中记录的文件内容哈希（解析之前计算），不访问文件"""
+        return self.parse_cache.cached_digest(file_path)
+
+    def referenced_files(self, include_missing=False):
+        """
+        提取主文件直接或间接引用的其他文件路径。
+        使用与解析器共用的引用关系图，只重新读取变化过的文件，循环引用不会导致无限递归。
+        :param include_missing: 是否包含尚不存在的文件，监控这些文件以便在创建后触发同步
+        """
+        referenced_files = set()
+        try:
+            for file_path in self.parse_cache.referenced_files(self.md_path):
+                if os.path.exists(file_path):
+                    referenced_files.add(file_path)
                 else:
                     logger.warning(f"引用的文件不存在: {file_path}")
+                    if include_missing:
+                        referenced_files.add(file_path)
+        except Exception as e:
+            logger.error(f"提取引用文件时出错: {str(e)}")
+
+        return referenced_files
+
+    def is_vault_file(self, file_path):
+        """
+        判断文件是否为主文件本身或其直接、间接引用的文件。
+        从该文件沿反向依赖查找主文件，不从主文件遍历整个笔记；笔记还没有解析过时先解析一次
+        """
+        if self.md_path not in self.parse_cache.graph.edges:
+            self.parse_cache.referenced_files(self.md_path)
+        return self.md_path in self.parse_cache.dependents(os.path.abspath(file_path))
+
+def configured_tabs():
+    """
+    VAULTS 中各主文件（绝对路径）对应的标签页。
+    同步引擎按主文件登记，同一主文件配置了多个标签页时会被合并成一个笔记，因此直接报错
+    :return: {主文件绝对路径: 标签页}
+    """
+    tabs = {}
+    for vault_path, tab in VAULTS:
+        md_path = os.path.abspath(PROJECT_DIR / os.path.expanduser(vault_path))
+        if md_path in tabs:
+            raise ValueError(f"VAULTS 配置错误: {md_path} 同时同步到标签页 {tabs[md_path]} 和 {tab}，"
+                             f"每个主文件只能同步到一个标签页")
+        tabs[md_path] = tab
+    return tabs
+
+def get_vault(md_path=None, data_dir=None, tab=None):
+    """
+    获取主文件对应的同步引擎，进程内每个主文件只创建一个
+    :param md_path: 主 Markdown 文件路径，默认为第一个配置的笔记
+    :param data_dir: 首次创建时使用的数据目录，默认由 vault_data_dir 决定
+    :param tab: 首次创建时使用的标签页，默认为 VAULTS 中的配置或 DEFAULT_TAB；
+                与已创建的同步引擎的标签页不同时抛出 ValueError
+    """
+    if md_path is None:
+        if VAULTS:
+            return configured_vaults()[0]
+        md_path = get_main_markdown_path()
+    md_path = os.path.abspath(os.path.expanduser(md_path))
+    with _registry_lock:
+        vault = _vaults.get(md_path)
+        if vault is None:
+            if tab is None:
+                tab = configured_tabs().get(md_path, DEFAULT_TAB)
+            vault = _vaults[md_path] = VaultSync(md_path, tab, data_dir)
+        elif tab is not None and tab != vault.tab:
+            raise ValueError(f"{md_path} 已经同步到标签页 {vault.tab}，不能再同步到 {tab}")
+    return vault
+
+def configured_vaults():
+    """配置的所有笔记（VAULTS）的同步引擎；没有配置时只有默认笔记 DATA_DIR/MARKDOWN_FILE -> DEFAULT_TAB"""
+    if not VAULTS:
+        return [get_vault()]
+    return [get_vault(md_path, tab=tab) for md_path, tab in configured_tabs().items()]
+
+def tab_vaults(tab):
+    """同步到同一标签页的所有笔记：配置的笔记和进程内已创建的同步引擎"""
+    vaults = configured_vaults() if VAULTS else []
+    with _registry_lock:
+        vaults += [vault for vault in _vaults.values() if vault not in vaults]
+    return [vault for vault in vaults if vault.tab == tab]
+
+def plan_sync(md_path=None, data_dir=None):
+    """同步的第一阶段，参见 VaultSync.plan；参数与 get_vault 相同"""
+    return get_vault(md_path, data_dir).plan()
+
+def finish_sync(plan, inserted, removed_count):
+    """同步的最后阶段，参见 VaultSync.finish"""
+    return plan.vault.finish(plan, inserted, removed_count)
+
+def run_one_time_sync(md_path=None, data_dir=None):
+    """
+    执行一次性同步命令。
+    从md文件解析，与上一次的解析结果比较，只把增量更新到命令存储并导出到剪贴板。
+    返回一个包含新命令、更新命令、删除命令数量、增量明细（delta）及分阶段指标（metrics）的字典。
+    参数与 get_vault 相同，默认同步第一个配置的笔记；同步所有笔记使用 sync_all。
+    """
+    return get_vault(md_path, data_dir).sync()
+
+def _sync_vault(vault):
+    """同步一个笔记，出错时返回错误结果，不影响其他笔记"""
+    try:
+        return vault.sync()
     except Exception as e:
-        logger.error(f"提取引用文件时出错: {str(e)}")
-    
-    return referenced_files
-
-class SyncEventHandler(FileSystemEventHandler):
-    def __init__(self, main_file_path):
-        self.main_file_path = main_file_path
-        self.watched_files = {main_file_path}
-        self.update_watched_files()
-        
-    def update_watched_files(self):
-        """更新监控的文件列表"""
-        new_files = extract_referenced_files(self.main_file_path)
-        new_files.add(self.main_file_path) # 确保主文件始终在监控列表
-        added_files = new_files - self.watched_files
-        if added_files:
-            logger.info(f"添加监控以下文件: {added_files}")
-        self.watched_files = new_files
-        
-    def on_modified(self, event):
-        file_path = event.src_path
-        if file_path in self.watched_files:
-            logger.info(f"检测到文件变化: {file_path}, 触发同步...")
-            if file_path == self.main_file_path:
-                self.update_watched_files()
-            run_one_time_sync()
-
-_observer = None
+        logger.exception(f"同步笔记 {vault.md_path} 失败")
+        return {"new": 0, "updated": 0, "error": str(e)}
+
+def sync_all(vaults=None, executor=None):
+    """
+    同步多个笔记，不同笔记在线程池中并发同步，同时进行的同步数不超过 VAULT_SYNC_WORKERS
+    :param vaults: VaultSync 列表，默认为所有配置的笔记
+    :param executor: 使用的线程池，默认临时创建
+    :return: {主文件路径: 结果字典}
+    """
+    vaults = configured_vaults() if vaults is None else vaults
+    if executor is None and len(vaults) == 1:
+        return {vaults[0].md_path: _sync_vault(vaults[0])}
+    if executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=VAULT_SYNC_WORKERS, thread_name_prefix="VaultSync") as pool:
+            return sync_all(vaults, pool)
+    # 在调用方的上下文中执行，线程池中的同步也把进度报告给调用方设置的回调（sync_metrics.reporting_progress）
+    futures = [(vault.md_path, executor.submit(contextvars.copy_context().run, _sync_vault, vault))
+               for vault in vaults]
+    return {md_path: future.result() for md_path, future in futures}
+
+def save_caches(timeout=SHUTDOWN_TIMEOUT):
+    """
+    等待各笔记进行中的同步完成（合计最多 timeout 秒），保存命令存储和解析缓存，供退出和重启前调用
+    :return: 是否全部保存
+    """
+    deadline = time.monotonic() + timeout
+    with _registry_lock:
+        vaults = list(_vaults.values())
+    saved = True
+    for vault in vaults:
+        saved = vault.save_caches(max(0.0, deadline - time.monotonic())) and saved
+    return saved
+
+def reconcile(md_path=None, data_dir=None, apply=False):
+    """对账，参见 VaultSync.reconcile；md_path、data_dir 与 get_vault 相同"""
+    return get_vault(md_path, data_dir).reconcile(apply)
+
+# --- 文件监控 ---
+# watchdog 只在启动监控时才导入（见 watcher.py），一次性同步不需要加载它
+
+def is_vault_file(file_path, md_path=None):
+    """判断文件是否属于笔记，参见 VaultSync.is_vault_file；md_path 默认为第一个配置的笔记"""
+    return get_vault(md_path).is_vault_file(file_path)
+
+def extract_referenced_files(md_file_path, include_missing=False):
+    """提取Markdown文件直接或间接引用的其他文件路径，参见 VaultSync.referenced_files"""
+    return get_vault(md_file_path).referenced_files(include_missing)
 
 def start_watching(blocking=True):
-    """启动文件监控"""
-    global _observer
-    if _observer and _observer.is_alive():
-        logger.warning("监控已在运行中。")
-        return
-
-    current_dir = Path(__file__).parent
-    md_path = current_dir / DATA_DIR / MARKDOWN_FILE
-    abs_md_path = str(md_path.resolve())
-
-    logger.info("执行初始同步...")
-    run_one_time_sync()
-
-    event_handler = SyncEventHandler(abs_md_path)
-    
-    _observer = Observer()
-    
-    watched_dirs = {os.path.dirname(p) for p in event_handler.watched_files}
-    for path in watched_dirs:
-        _observer.schedule(event_handler, path, recursive=False)
-        logger.info(f"正在监控目录: {path}")
-
-    _observer.start()
-    logger.info(f"已启动对 {abs_md_path} 及其引用的文件监控。")
-
-    if blocking:
-        # 用于命令行版本阻塞
-        try:
-            while _observer.is_alive():
-                time.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("检测到中断信号，正在停止监控...")
-        finally:
-            if _observer.is_alive():
-                _observer.stop()
-            _observer.join()
-
-def stop_watching():
-    """停止文件监控"""
-    global _observer
-    if _observer and _observer.is_alive():
-        _observer.stop()
-        logger.info("文件监控停止信号已发送。")
-        return True
-    else:
+    """启动文件监控，参见 watcher.start_watching"""
+    import watcher
+    return watcher.start_watching(blocking)
+
+def stop_watching(timeout=SHUTDOWN_TIMEOUT):
+    """停止文件监控，参见 watcher.stop_watching"""
+    # 没有导入过 watcher 说明从未启动监控，不必为此导入 watchdog
+    watcher = sys.modules.get("watcher")
+    if watcher is None:
         logger.info("文件监控未在运行。")
-        return False 
\ No newline at end of file
+        return False
+    return watcher.stop_watching(timeout)
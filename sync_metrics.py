@@ -0,0 +1,150 @@
+"""
+同步过程的分阶段计时和计数。
+
+同步入口用 collecting() 开始收集，解析、命令存储和 CopyQ 调用等环节通过 stage() 计时、count() 计数；
+没有在收集时这两个函数什么也不做。当前的收集对象保存在 contextvars 中，
+asyncio.to_thread 和 asyncio 任务会继承它，两种同步引擎都能记录到同一次同步上。
+同一阶段多次进入时耗时累加，并发的 CopyQ 调用耗时也是累加值。
+
+导出等耗时较长的环节通过 progress() 报告进度，通知 reporting_progress() 设置的回调（如托盘的进度提示）。
+回调同样保存在 contextvars 中，只收到在其 with 块内发起的同步的进度，监控等其他线程中的同步不受影响。
+
+每次同步结束后的指标保存在最近 METRICS_HISTORY_SIZE 次的滚动历史中，供托盘菜单显示；
+配置了 METRICS_LOG_FILE 时同时以 JSON 行追加写入日志文件。
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from config import METRICS_HISTORY_SIZE, METRICS_LOG_FILE
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("sync_metrics", default=None)
+_log_lock = threading.Lock()
+# 进度回调，参数为 (SyncMetrics, 已完成数, 总数)，在执行同步的线程中调用
+_progress_listener = contextvars.ContextVar("sync_progress", default=None)
+
+# 最近若干次同步的指标字典，最新的在最后；各同步线程写入、托盘和守护进程读取，读写都要持有 _history_lock
+history = deque(maxlen=METRICS_HISTORY_SIZE)
+_history_lock = threading.Lock()
+
+class SyncMetrics:
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.total_ms = None
+        self.stages = {}  # 阶段名 -> 累计耗时（毫秒）
+        self.counters = {}  # 计数名 -> 数值
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+
+    def as_dict(self):
+        return {
+            "started_at": self.started_at.isoformat(),
+            "total_ms": round(self.total_ms, 3) if self.total_ms is not None else None,
+            "stages_ms": {name: round(value, 3) for name, value in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+def stage(name):
+    """对当前同步的一个阶段计时，不在收集时返回空的上下文管理器"""
+    metrics = _current.get()
+    return metrics.stage(name) if metrics is not None else contextlib.nullcontext()
+
+def count(name, amount=1):
+    """累加当前同步的计数"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, amount)
+
+def progress(done, total):
+    """报告当前同步的进度（如已导出的条数），不在收集时什么也不做"""
+    metrics = _current.get()
+    listener = _progress_listener.get()
+    if metrics is None or listener is None:
+        return
+    try:
+        listener(metrics, done, total)
+    except Exception:
+        logger.exception("进度回调执行失败")
+
+@contextlib.contextmanager
+def reporting_progress(listener):
+    """
+    在 with 块内发起的同步（包括继承了上下文的线程和 asyncio 任务）把进度报告给 listener
+    :param listener: 回调，参数为 (SyncMetrics, 已完成数, 总数)；同一次同步的回调共用一个 SyncMetrics 对象
+    """
+    token = _progress_listener.set(listener)
+    try:
+        yield
+    finally:
+        _progress_listener.reset(token)
+
+@contextlib.contextmanager
+def collecting():
+    """
+    在 with 块内收集一次同步的指标，结束时记入滚动历史并按配置写入日志。
+    嵌套使用时沿用外层的收集对象，不重复记录。
+    """
+    outer = _current.get()
+    if outer is not None:
+        yield outer
+        return
+    metrics = SyncMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        metrics.finish()
+        record(metrics.as_dict())
+
+def record(metrics_dict):
+    """把一次同步的指标加入滚动历史，并按配置追加到 JSON 行日志"""
+    with _history_lock:
+        history.append(metrics_dict)
+    if METRICS_LOG_FILE:
+        try:
+            log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), METRICS_LOG_FILE)
+            with _log_lock, open(log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(metrics_dict, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"写入同步指标日志失败: {e}")
+
+def summary():
+    """
+    滚动历史的摘要
+    :return: 包含 count、last_at、last_ms、p95_ms 的字典；还没有同步过时返回 None
+    """
+    with _history_lock:
+        items = list(history)
+    if not items:
+        return None
+    durations = sorted(item["total_ms"] for item in items)
+    last = items[-1]
+    return {
+        "count": len(durations),
+        "last_at": last["started_at"],
+        "last_ms": last["total_ms"],
+        "p95_ms": durations[max(0, math.ceil(len(durations) * 0.95) - 1)],
+    }
@@ -0,0 +1,77 @@
+"""
+防抖合并的同步调度器，位于文件监控事件和同步之间。
+
+编辑器保存一次文件往往会产生多个修改事件，调度器在安静窗口内合并这些事件，
+只触发一次同步；同步始终在单个工作线程中串行执行，同步过程中到达的事件只会触发一次后续同步。
+"""
+import logging
+import threading
+import time
+
+from config import SYNC_DEBOUNCE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class SyncScheduler:
+    def __init__(self, sync_func, quiet_seconds=SYNC_DEBOUNCE_SECONDS):
+        """
+        :param sync_func: 同步函数，参数为本次合并的变化文件路径集合
+        :param quiet_seconds: 安静窗口（秒），最后一个事件之后等待这么久才开始同步
+        """
+        self.sync_func = sync_func
+        self.quiet_seconds = quiet_seconds
+        self._condition = threading.Condition()
+        self._pending = set()
+        self._last_event = 0.0
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="SyncScheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, path):
+        """记录一个文件变化，在安静窗口结束后合并同步"""
+        with self._condition:
+            self._pending.add(path)
+            self._last_event = time.monotonic()
+            self._condition.notify_all()
+
+    def stop(self, timeout=None):
+        """
+        停止调度器，正在执行的同步会继续完成，尚未开始的同步被丢弃
+        :param timeout: 等待正在执行的同步完成的最长时间（秒），None 表示一直等待
+        :return: 工作线程是否已经结束
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def _wait_for_batch(self):
+        """等待有待同步的文件且安静窗口结束，返回合并后的路径集合；停止时返回 None"""
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            while not self._stopped:
+                remaining = self._last_event + self.quiet_seconds - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if self._stopped:
+                return None
+            paths, self._pending = self._pending, set()
+            return paths
+
+    def _run(self):
+        while True:
+            paths = self._wait_for_batch()
+            if paths is None:
+                return
+            try:
+                self.sync_func(paths)
+            except Exception:
+                logger.exception("同步任务执行失败")
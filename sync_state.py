@@ -0,0 +1,62 @@
+"""
+持久化的同步状态，保存每个主 Markdown 文件上次成功同步时笔记中各文件的内容哈希及其组合哈希。
+
+监控程序或托盘程序重启后，只需重新计算记录中各文件的哈希：全部相同说明笔记自上次同步以来没有变化
+（引用关系由文件内容决定，也不会变化），初始同步可以直接跳过，不必解析任何文件。
+"""
+import json
+import os
+from datetime import datetime
+
+from parse_cache import combine_digests
+from utils import atomic_write
+
+class SyncState:
+    def __init__(self, path):
+        """
+        :param path: 状态文件路径（JSON）
+        """
+        self.path = str(path)
+        self.vaults = {}  # 主文件路径 -> {"hash": 组合哈希, "files": {文件路径: 内容哈希}, "tab": ..., "synced_at": ...}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.vaults = json.load(f).get("vaults", {})
+            except (OSError, ValueError):
+                # 状态文件损坏时当作没有同步过，下次同步会重新写入
+                self.vaults = {}
+
+    def get_vault_files(self, md_path, tab):
+        """
+        返回主文件同步到指定标签页时记录的各文件内容哈希
+        :return: {文件路径: 内容哈希}；没有记录或记录不完整时返回 None
+        """
+        entry = self.vaults.get(str(md_path))
+        if entry is None or entry.get("tab") != tab or not entry.get("files"):
+            return None
+        if combine_digests(entry["files"]) != entry.get("hash"):
+            return None
+        return entry["files"]
+
+    def record_vault(self, md_path, tab, file_digests):
+        """
+        记录一次成功同步时笔记中各文件的内容哈希并立即写入文件
+        :param file_digests: ParseCache.vault_files 的结果
+        """
+        if self.get_vault_files(md_path, tab) == file_digests:
+            return
+        self.vaults[str(md_path)] = {
+            "hash": combine_digests(file_digests),
+            "files": file_digests,
+            "tab": tab,
+            "synced_at": datetime.now().isoformat(),
+        }
+        self.save()
+
+    def forget_vault(self, md_path):
+        """删除主文件的记录，下次同步不会因内容未变而跳过"""
+        if self.vaults.pop(str(md_path), None) is not None:
+            self.save()
+
+    def save(self):
+        atomic_write(self.path, json.dumps({"vaults": self.vaults}, ensure_ascii=False, indent=2).encode('utf-8'))
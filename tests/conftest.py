@@ -0,0 +1,120 @@
+"""
+测试公用的夹具。
+
+所有 CopyQ 调用都交给 tools/fake_copyq.py（文件模式），每个测试使用临时目录中的状态文件、笔记和数据目录，
+不需要安装 CopyQ，也不会改动项目的 data 目录。
+"""
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+TOOLS_DIR = ROOT_DIR / "tools"
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(TOOLS_DIR))
+
+# config 在导入时读取 COPYQ_PATH，必须在导入项目模块之前设置
+os.environ["COPYQ_PATH"] = str(TOOLS_DIR / "fake_copyq.py")
+os.environ.pop("FAKE_COPYQ_SERVER", None)
+os.environ.pop("FAKE_COPYQ_LATENCY", None)
+
+import clipboard_manager
+import sync_logic
+
+TEXT = "text/plain"
+TAGS = "application/x-copyq-tags"
+
+class FakeCopyQ:
+    """读写 fake_copyq 的状态文件，检查同步结果或模拟用户在 CopyQ 中的操作"""
+    def __init__(self, state_path):
+        self.state_path = state_path
+
+    def _load(self):
+        if not self.state_path.exists():
+            return {"calls": 0, "tabs": {}}
+        return json.loads(self.state_path.read_text(encoding='utf-8'))
+
+    def _save(self, state):
+        self.state_path.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+
+    @property
+    def calls(self):
+        return self._load()["calls"]
+
+    def items(self, tab):
+        return self._load()["tabs"].get(tab, [])
+
+    def texts(self, tab):
+        return [item.get(TEXT, "") for item in self.items(tab)]
+
+    def tags(self, tab, text):
+        """条目的标签列表；没有该条目时返回 None"""
+        for item in self.items(tab):
+            if item.get(TEXT) == text:
+                return item.get(TAGS, "").split(",")
+        return None
+
+    def add(self, tab, text, **formats):
+        """像用户那样在标签页顶部添加一个条目，formats 为其他格式（MIME 类型 -> 值）"""
+        state = self._load()
+        state["tabs"].setdefault(tab, []).insert(0, {TEXT: text, **formats})
+        self._save(state)
+
+    def edit(self, tab, text, mime, value):
+        state = self._load()
+        for item in state["tabs"].get(tab, []):
+            if item.get(TEXT) == text:
+                item[mime] = value
+        self._save(state)
+
+    def remove(self, tab, text):
+        state = self._load()
+        state["tabs"][tab] = [item for item in state["tabs"].get(tab, []) if item.get(TEXT) != text]
+        self._save(state)
+
+@pytest.fixture
+def copyq(tmp_path, monkeypatch):
+    """空的 CopyQ 替身"""
+    if sys.platform == "win32":
+        pytest.skip("fake_copyq.py 需要作为可执行脚本直接运行")
+    state_path = tmp_path / "copyq.json"
+    monkeypatch.setenv("FAKE_COPYQ_STATE", str(state_path))
+    # 标签页索引在进程内缓存，各测试的 CopyQ 状态互不相干
+    monkeypatch.setattr(clipboard_manager, "_tab_indexes", {})
+    return FakeCopyQ(state_path)
+
+@pytest.fixture
+def notes(tmp_path):
+    """在临时目录中写入笔记文件，返回其绝对路径"""
+    notes_dir = tmp_path / "notes"
+    notes_dir.mkdir()
+
+    def write(name, text):
+        path = notes_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding='utf-8')
+        return str(path)
+    return write
+
+@pytest.fixture
+def make_vault(tmp_path, monkeypatch):
+    """创建使用临时数据目录的笔记同步引擎，进程内的笔记、命令存储和同步状态缓存在测试之间不共用"""
+    monkeypatch.setattr(sync_logic, "_vaults", {})
+    monkeypatch.setattr(sync_logic, "_command_stores", {})
+    monkeypatch.setattr(sync_logic, "_sync_states", {})
+
+    def make(md_path, tab="测试", name=None):
+        return sync_logic.get_vault(md_path, data_dir=tmp_path / "data" / (name or Path(md_path).stem), tab=tab)
+    return make
+
+@pytest.fixture(params=["thread", "asyncio"])
+def sync(request):
+    """分别用两种同步引擎同步一个笔记"""
+    if request.param == "thread":
+        return lambda vault: vault.sync()
+    import async_sync
+    return lambda vault: asyncio.run(async_sync.AsyncSyncEngine().sync(vault.md_path))
@@ -0,0 +1,189 @@
+"""
+最初版本（逐行 if 链、整体读入后转义）的 Markdown 解析器，原样保留，作为解析结果的参照。
+只用于测试和 tools/bench_parser.py，比较流式解析器和解析缓存的结果与它是否一致，并作为性能基线。
+"""
+import os
+import re
+
+def get_heading_tag(line):
+    """获取标题级别和内容"""
+    level = len(line) - len(line.lstrip('#'))
+    content = line.lstrip('#').strip()
+    return f"{'#' * level}{content}" if content else None
+
+class MarkdownParser:
+    def __init__(self, base_path=None):
+        self.items = []
+        self.current_content = None
+        self.current_tags = ["命令"]  # 默认标签
+        self.heading_tags = []  # 标题标签栈
+        self.in_code_block = False
+        self.code_block_content = []
+        self.pending_code_block = None
+        self.processed_files = set()  # 用于跟踪已处理的文件，避免循环引用
+        self.base_path = base_path  # 当前处理文件的路径，用于解析相对引用
+
+    def _handle_empty_line(self):
+        """处理空行"""
+        if self.current_content and not self.in_code_block:
+            self.items.append((self.current_content, ','.join(self.current_tags)))
+            self.current_content = None
+
+    def _handle_code_block(self, line):
+        """处理代码块"""
+        if line.strip().startswith('```'):
+            if not self.in_code_block:
+                # 开始代码块
+                self.in_code_block = True
+                self._handle_empty_line()  # 处理之前的内容
+                self.code_block_content = []
+            else:
+                # 结束代码块
+                self.in_code_block = False
+                if self.code_block_content:
+                    # 存储代码块内容，等待下一个标签行
+                    self.pending_code_block = '\n'.join(self.code_block_content)
+                self.code_block_content = []
+            return True
+        
+        if self.in_code_block:
+            self.code_block_content.append(line)
+            return True
+            
+        return False
+
+    def _handle_file_reference(self, line):
+        """处理文件引用语法 [[文件路径]]"""
+        matches = re.findall(r'\[\[(.*?)\]\]', line)
+        if matches:
+            for file_path in matches:
+                # 解析相对路径
+                if self.base_path and not os.path.isabs(file_path):
+                    # 使用当前文件所在目录作为基准路径
+                    base_dir = os.path.dirname(self.base_path)
+                    abs_file_path = os.path.normpath(os.path.join(base_dir, file_path))
+                else:
+                    abs_file_path = file_path
+                    
+                if abs_file_path in self.processed_files:
+                    print(f"警告: 检测到循环引用 {abs_file_path}")
+                    continue
+                    
+                self.processed_files.add(abs_file_path)
+                try:
+                    with open(abs_file_path, 'r', encoding='utf-8') as f:
+                        referenced_content = f.read()
+                        # 使用新的解析器实例解析引用的文件内容，保持标题级别隔离
+                        referenced_parser = MarkdownParser(base_path=abs_file_path)
+                        referenced_parser.processed_files = self.processed_files.copy()  # 共享已处理文件列表以避免循环引用
+                        referenced_items = referenced_parser.parse(referenced_content)
+                        self.items.extend(referenced_items)
+                except FileNotFoundError:
+                    print(f"错误: 找不到引用的文件 {abs_file_path}")
+                except Exception as e:
+                    print(f"处理文件 {abs_file_path} 时出错: {str(e)}")
+            return True
+        return False
+
+    def _handle_tag_line(self, line):
+        """处理标签行（以>开头）"""
+        if line.startswith('>'):
+            tags = line[1:].strip()
+            tag_list = [tags] if tags else ["命令"]
+            
+            # 将标题标签添加到当前标签中
+            combined_tags = tag_list + self.heading_tags
+            
+            # 如果有待处理的代码块，将其与组合标签关联
+            if self.pending_code_block is not None:
+                self.items.append((self.pending_code_block, ','.join(combined_tags)))
+                self.pending_code_block = None
+            elif self.current_content:
+                self.items.append((self.current_content, ','.join(combined_tags)))
+                self.current_content = None
+                
+            self.current_tags = combined_tags
+            return True
+        return False
+
+    def _update_heading_stack(self, heading_tag):
+        """更新标题标签栈"""
+        level = len(heading_tag) - len(heading_tag.lstrip('#'))
+        # 移除同级或更低级别的标题
+        while self.heading_tags and (len(self.heading_tags[0]) - len(self.heading_tags[0].lstrip('#'))) >= level:
+            self.heading_tags.pop(0)
+        self.heading_tags.insert(0, heading_tag)
+        self.current_tags = ["命令"] + self.heading_tags
+
+    def _handle_heading(self, line):
+        """处理Markdown标题"""
+        if line.lstrip().startswith('#'):
+            if self.current_content:
+                self.items.append((self.current_content, ','.join(self.current_tags)))
+                self.current_content = None
+            elif self.pending_code_block:
+                self.items.append((self.pending_code_block, ','.join(self.current_tags)))
+                self.pending_code_block = None
+            
+            heading_tag = get_heading_tag(line)
+            if heading_tag:
+                self._update_heading_stack(heading_tag)
+            return True
+        return False
+
+    def _handle_inline_tag(self, line):
+        """处理行内标签"""
+        if ' #' in line and not line.lstrip().startswith('#'):
+            parts = line.split(' #', 1)
+            content = parts[0].strip()
+            tag = parts[1].strip()
+            if content:
+                tags = [tag] + self.heading_tags if tag else self.heading_tags
+                self.items.append((content, ','.join(tags)))
+            return True
+        return False
+
+    def _handle_normal_content(self, line):
+        """处理普通内容"""
+        if line.strip():
+            if self.current_content:
+                self.items.append((self.current_content, ','.join(self.current_tags)))
+            self.current_content = line.strip()
+
+    def parse(self, md_content):
+        """解析markdown内容"""
+        for line in md_content.split('\n'):
+            if not line.strip() and not self.in_code_block:
+                self._handle_empty_line()
+                continue
+                
+            if self._handle_code_block(line):
+                continue
+                
+            if not self.in_code_block:
+                if self._handle_file_reference(line):
+                    continue
+                    
+                if self._handle_tag_line(line):
+                    continue
+                    
+                if self._handle_heading(line):
+                    continue
+                    
+                if self._handle_inline_tag(line):
+                    continue
+                    
+                self._handle_normal_content(line)
+        
+        if self.current_content and not self.in_code_block:
+            self.items.append((self.current_content, ','.join(self.current_tags)))
+        elif self.pending_code_block:
+            self.items.append((self.pending_code_block, ','.join(self.current_tags)))
+        
+        return self.items
+
+def parse_md_content(md_content, base_path=None):
+    """解析markdown内容，提取命令及其标签"""
+    md_content = md_content.replace('\\', '\\\\')
+    parser = MarkdownParser(base_path=base_path)
+    return parser.parse(md_content)
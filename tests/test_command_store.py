@@ -0,0 +1,118 @@
+"""命令存储：追加日志的回放、多个实例共用日志、压缩、墓碑和旧格式迁移"""
+import json
+import os
+
+import command_store
+from command_store import CommandRecord, CommandStore
+
+def log_ops(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)["op"] for line in f if line.strip()]
+
+def test_changes_are_appended_and_replayed(tmp_path):
+    log_path = tmp_path / "commands_store.jsonl"
+    store = CommandStore(log_path)
+    store.put(CommandRecord("git status", "命令,#版本"))
+    store.put(CommandRecord("ls", "命令"))
+    store.flush()
+    record = store.get("git status")
+    record.add_tags(command_store.tag_mask("#常用"))
+    store.put(record)
+    store.delete("ls")
+    store.flush()
+
+    assert log_ops(log_path) == ["header", "put", "put", "put", "del"]
+    reloaded = CommandStore(log_path)
+    assert len(reloaded) == 1
+    assert reloaded.get("git status").tags == ["命令", "#版本", "#常用"]
+    # 近似重复的内容共用一条记录
+    assert "git status  \r\n" in reloaded
+
+def test_refresh_reads_changes_from_other_instances(tmp_path):
+    log_path = tmp_path / "commands_store.jsonl"
+    first = CommandStore(log_path)
+    first.put(CommandRecord("git status", "命令"))
+    first.flush()
+    second = CommandStore(log_path)
+
+    second.put(CommandRecord("ls", "命令"))
+    second.flush()
+    first.refresh()
+
+    assert "ls" in first
+
+    # 被其他实例压缩重写后重新加载
+    second.compact()
+    first.put(CommandRecord("pwd", "命令"))
+    first.flush()
+    assert {record.command for record in CommandStore(log_path).values()} == {"git status", "ls", "pwd"}
+
+def test_partial_line_left_by_interrupted_write_is_skipped(tmp_path):
+    log_path = tmp_path / "commands_store.jsonl"
+    store = CommandStore(log_path)
+    store.put(CommandRecord("git status", "命令"))
+    store.flush()
+    with open(log_path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "put", "command": {"comm')
+
+    store = CommandStore(log_path)
+    store.put(CommandRecord("ls", "命令"))
+    store.flush()
+
+    assert {record.command for record in CommandStore(log_path).values()} == {"git status", "ls"}
+
+def test_log_is_compacted_when_mostly_stale(tmp_path, monkeypatch):
+    monkeypatch.setattr(command_store, "STORE_COMPACT_RATIO", 2)
+    log_path = tmp_path / "commands_store.jsonl"
+    store = CommandStore(log_path)
+    record = CommandRecord("git status", "命令")
+    for index in range(120):
+        record.last_exported = float(index)
+        store.put(record)
+        store.flush()
+
+    # 压缩后只剩文件头、压缩时的一条记录和之后追加的修改
+    ops = log_ops(log_path)
+    assert ops.count("header") == 1
+    assert len(ops) < 120
+    assert CommandStore(log_path).get("git status").last_exported == 119.0
+
+def test_tombstones_hide_records_and_expire_on_compaction(tmp_path):
+    log_path = tmp_path / "commands_store.jsonl"
+    store = CommandStore(log_path)
+    store.put(CommandRecord("git status", "命令"))
+    store.put(CommandRecord("ls", "命令"))
+    store.flush()
+
+    assert store.tombstone("git status")
+    assert store.tombstone("ls", deleted_at=0.0)
+    store.flush()
+    assert len(store) == 0
+    assert "git status" not in CommandStore(log_path)
+
+    store.compact()
+
+    # 超过保留期的墓碑在压缩时丢弃
+    assert [record.command for record in CommandStore(log_path).tombstones()] == ["git status"]
+
+def test_legacy_json_store_is_migrated(tmp_path):
+    legacy_path = tmp_path / "commands_store.json"
+    legacy_path.write_text(json.dumps([
+        {"command": "git status", "tags": ["命令", "#版本"], "created_at": "2024-01-02T03:04:05",
+         "last_exported": None, "note": "保留的字段"},
+        {"command": "ls", "tags": ["命令"], "created_at": "2024-01-02T03:04:05",
+         "last_exported": "2024-01-03T00:00:00"},
+    ], ensure_ascii=False), encoding='utf-8')
+    log_path = tmp_path / "commands_store.jsonl"
+
+    store = CommandStore(log_path, legacy_path=legacy_path)
+
+    assert not legacy_path.exists()
+    assert os.path.exists(str(legacy_path) + ".migrated")
+    reloaded = CommandStore(log_path, legacy_path=legacy_path)
+    assert len(reloaded) == len(store) == 2
+    record = reloaded.get("git status")
+    assert record.tags == ["命令", "#版本"]
+    assert record.to_dict()["note"] == "保留的字段"
+    assert record.to_dict()["created_at"] == "2024-01-02T03:04:05"
+    assert reloaded.get("ls").to_dict()["last_exported"] == "2024-01-03T00:00:00"
@@ -0,0 +1,133 @@
+"""
+CopyQ 端脚本与替身的一致性：用 node 和一个最小的 CopyQ 脚本 API 执行 clipboard_manager 中的脚本原文，
+结果应与 fake_copyq 的 Python 实现相同，NORMALIZE_JS 应与 content_hash.normalize_content 相同。
+没有安装 node 时跳过。
+"""
+import copy
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import clipboard_manager
+import fake_copyq
+from clipboard_manager import MARKER_MIME
+from content_hash import normalize_content
+from conftest import TEXT, TAGS
+
+NODE = shutil.which("node")
+pytestmark = pytest.mark.skipif(NODE is None, reason="需要 node 执行 CopyQ 脚本")
+
+# CopyQ 脚本 API 中本项目用到的部分；条目为 {MIME 类型: 文本}，第 0 行在最前
+COPYQ_API_JS = r"""
+const request = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const items = request.items;
+const printed = [];
+function size() { return items.length; }
+function str(value) { return String(value); }
+function input() { return request.stdin; }
+function print(value) { printed.push(String(value)); }
+function read(mime, row) {
+    if (row === undefined) { row = mime; mime = 'text/plain'; }
+    return row < items.length ? (items[row][mime] || '') : '';
+}
+function write(row) {
+    const item = {};
+    for (let k = 1; k < arguments.length; k += 2) { item[arguments[k]] = arguments[k + 1]; }
+    items.splice(row, 0, item);
+}
+function change(row, mime, value) { items[row][mime] = value; }
+function remove(row) { items.splice(row, 1); }
+eval(request.script);
+process.stdout.write(JSON.stringify({output: printed.join('\n'), items: items}));
+"""
+
+def run_js(script, items, stdin=""):
+    """用 node 执行脚本，返回 (输出, 执行后的条目)"""
+    request = json.dumps({"script": script, "items": items, "stdin": stdin}, ensure_ascii=False)
+    completed = subprocess.run([NODE, "-e", COPYQ_API_JS], input=request, capture_output=True, text=True,
+                               encoding='utf-8', check=True)
+    result = json.loads(completed.stdout)
+    return result["output"], result["items"]
+
+def run_fake(script, items, stdin=""):
+    items = copy.deepcopy(items)
+    return fake_copyq.eval_script(script, items, stdin), items
+
+def assert_same(script, items, payload):
+    stdin = json.dumps(payload, ensure_ascii=False)
+    js_output, js_items = run_js(script, items, stdin)
+    fake_output, fake_items = run_fake(script, items, stdin)
+    assert json.loads(js_output) == json.loads(fake_output)
+    assert js_items == fake_items
+    return json.loads(js_output), js_items
+
+# 只有空白或换行符不同的近似重复内容，以及反斜杠个数不同的不同内容
+SAMPLES = [
+    "git status",
+    "git status  \r\n",
+    "\n\tgit status\t\n\n",
+    "echo a\\\\b",
+    "echo a\\b",
+    "echo a\\\\\\\\b",
+    "line1  \nline2\t\r\nline3",
+    "line1\r\nline2\rline3  ",
+    "",
+    "  \t\n ",
+    "中文 命令 \\\\n",
+]
+
+def test_normalize_js_matches_normalize_content():
+    script = clipboard_manager.NORMALIZE_JS + (
+        'var data = JSON.parse(input()); '
+        'print(JSON.stringify(data.map(normalize)));'
+    )
+    output, _ = run_js(script, [], json.dumps(SAMPLES))
+    assert json.loads(output) == [normalize_content(sample) for sample in SAMPLES]
+    # 反斜杠原样保留，UNC 路径和单反斜杠路径不会被视为同一条
+    assert normalize_content("dir \\\\server\\share") != normalize_content("dir \\server\\share")
+
+def tab(*texts, **formats):
+    return [{TEXT: text, TAGS: "命令", **formats} for text in texts]
+
+def test_export_batch_script_matches_fake():
+    items = tab("git status  ", "echo a\\b")
+    payload = {"check": True, "marker": "本笔记", "items": [{"content": "git status", "tags": "命令"},
+                                        {"content": "echo a\\b", "tags": "命令"},
+                                        {"content": "echo a\\\\b", "tags": "命令"},
+                                        {"content": "ls", "tags": "命令,#文件"},
+                                        {"content": "ls\r\n", "tags": "命令"}]}
+    inserted, after = assert_same(clipboard_manager.EXPORT_BATCH_SCRIPT, items, payload)
+    assert inserted == [False, False, True, True, False]
+    assert after[0][MARKER_MIME] == "本笔记"
+
+def test_update_tags_script_matches_fake():
+    items = tab("git status", "ls", "pwd")
+    items[0][TAGS] = "命令,用户标签"
+    payload = [{"content": "git status ", "tags": "命令,#新"},
+               {"content": "ls", "tags": "命令"},
+               {"content": "不存在", "tags": "命令"}]
+    states, after = assert_same(clipboard_manager.UPDATE_TAGS_SCRIPT, items, payload)
+    assert states == [1, 0, -1]
+    assert after[0][TAGS] == "命令,用户标签,#新"
+
+def test_remove_items_script_matches_fake():
+    items = tab("git status", "ls", "pwd", "用户条目")
+    for item in items[:2]:
+        item[MARKER_MIME] = "本笔记"
+    items[2][MARKER_MIME] = "其他笔记"
+    payload = {"contents": ["ls\n", "pwd", "用户条目", "不存在"], "marker": "本笔记"}
+    removed, after = assert_same(clipboard_manager.REMOVE_ITEMS_SCRIPT, items, payload)
+    assert removed == 1
+    assert [item[TEXT] for item in after] == ["git status", "pwd", "用户条目"]
+
+@pytest.mark.parametrize("apply", [False, True])
+def test_reconcile_script_matches_fake(apply):
+    items = tab("git status", "ls", "pwd", "用户条目", "本笔记的条目", "其他笔记的条目")
+    items[1][MARKER_MIME] = clipboard_manager.LEGACY_MARKER
+    items[4][MARKER_MIME] = "本笔记"
+    items[5][MARKER_MIME] = "其他笔记"
+    payload = {"keep": ["git status"], "known": ["pwd", "其他笔记的条目"], "apply": apply, "marker": "本笔记"}
+    stale, _ = assert_same(clipboard_manager.RECONCILE_SCRIPT, items, payload)
+    assert stale == ["ls", "pwd", "本笔记的条目"]
@@ -0,0 +1,32 @@
+"""CopyQ 会话：不同线程的调用并发执行"""
+import threading
+import time
+
+from copyq_session import CopyQSession
+
+LATENCY = 0.5
+
+def test_calls_from_different_threads_overlap(copyq, monkeypatch):
+    monkeypatch.setenv("FAKE_COPYQ_LATENCY", str(LATENCY))
+    session = CopyQSession()
+    outputs = []
+    threads = [threading.Thread(target=lambda tab=tab: outputs.append(session.run(['tab', tab, 'size'])))
+               for tab in ("甲", "乙")]
+
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert outputs == ["0", "0"]
+    # 串行执行至少需要两倍的启动延迟
+    assert time.monotonic() - start < 2 * LATENCY
+    assert session.call_count == 2
+
+def test_arguments_before_double_dash_are_unescaped(copyq):
+    # 替身与 CopyQ 相同：`--` 之前展开 \n、\t、\\，其他 \x 和末尾的反斜杠不变；`--` 之后原样传递
+    session = CopyQSession()
+    session.run(['tab', '甲', 'write', 'text/plain', 'a\\nb\\tc\\\\d\\x\\'])
+    assert copyq.texts("甲") == ['a\nb\tc\\d\\x\\']
+    assert session.run(['eval', '--', 'print("ok");']) == "ok"
@@ -0,0 +1,138 @@
+"""流式解析器、内存映射读取和解析缓存的结果与最初的 parse_md_content 一致"""
+import threading
+
+import pytest
+
+import import_commands
+import legacy_parser
+from bench_parser import generate_notes
+from import_commands import iter_parse_file, parse_md_content
+from parse_cache import ParseCache
+
+EDGE_CASES = """命令 在第一个标题之前
+# 一级
+## 二级
+echo "a\\\\b" \\
+  --flag
+docker ps #容器
+只有标题标签 #
+### 三级
+```
+多行
+  代码块
+```
+> 脚本,其他
+```
+没有标签行的代码块
+```
+## 另一个二级
+>
+行内 # 后面有空格的标签
+[[sub/引用.md]] 与 [[不存在.md]]
+最后一条
+```
+未结束的代码块
+"""
+
+REFERENCED = """# 引用文件的标题
+git log --oneline
+```
+引用文件中的代码块\\n
+```
+> 引用
+[[../主文件.md]]
+[[更深.md]]
+"""
+
+DEEPER = "ls -la #深层\n[[引用.md]]\n"
+
+def legacy_parse_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return legacy_parser.parse_md_content(f.read(), base_path=path)
+
+def all_parses(path):
+    """当前各种解析方式的结果"""
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return {
+        "parse_md_content": parse_md_content(content, base_path=path),
+        "iter_parse_file": list(iter_parse_file(path)),
+        "ParseCache": ParseCache().parse(path, escape=True),
+        "ParseCache(thread)": ParseCache(workers=2, executor="thread").parse(path, escape=True),
+    }
+
+@pytest.fixture
+def vault(notes):
+    main = notes("主文件.md", EDGE_CASES)
+    notes("sub/引用.md", REFERENCED)
+    notes("sub/更深.md", DEEPER)
+    return main
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_edge_cases_match_legacy_parser(vault, mmap, monkeypatch):
+    if mmap:
+        monkeypatch.setattr(import_commands, "MMAP_MIN_BYTES", 1)
+    expected = legacy_parse_file(vault)
+    assert expected  # 参照结果本身不为空，比较才有意义
+    for name, items in all_parses(vault).items():
+        assert items == expected, name
+
+@pytest.mark.parametrize("seed", range(3))
+def test_generated_notes_match_legacy_parser(notes, seed):
+    path = notes("生成.md", generate_notes(3000, seed=seed))
+    expected = legacy_parse_file(path)
+    for name, items in all_parses(path).items():
+        assert items == expected, name
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_crlf_file_matches_legacy_parser(notes, mmap, monkeypatch):
+    if mmap:
+        monkeypatch.setattr(import_commands, "MMAP_MIN_BYTES", 1)
+    path = notes("crlf.md", "")
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(EDGE_CASES.replace("\n", "\r\n") + "单独的\r回车\r")
+    assert list(iter_parse_file(path)) == legacy_parse_file(path)
+    assert ParseCache().parse(path, escape=True) == legacy_parse_file(path)
+
+def test_parse_cache_reparses_only_changed_files(vault, notes):
+    cache = ParseCache()
+    cache.parse(vault, escape=True)
+    parsed = cache.parsed_count
+
+    notes("sub/更深.md", DEEPER + "pwd\n")
+    items = cache.parse(vault, escape=True)
+
+    assert cache.parsed_count == parsed + 1
+    assert items == legacy_parse_file(vault)
+
+def test_parse_cache_is_shared_between_threads(vault, notes):
+    # 同步线程解析的同时，监控线程查询引用的文件和内容哈希
+    cache = ParseCache(workers=2, executor="thread")
+    errors = []
+
+    def run(method):
+        try:
+            for _ in range(30):
+                method(vault)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(method,))
+               for method in (cache.parse, cache.referenced_files, cache.vault_files)]
+    for thread in threads:
+        thread.start()
+    for index in range(10):
+        notes("sub/更深.md", DEEPER + f"echo {index}\n")
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cache.parse(vault, escape=True) == legacy_parse_file(vault)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_unescaped_parse_keeps_backslashes(vault, workers):
+    # 同步使用的结果：所有文件的条目都是原文
+    items = ParseCache(workers=workers, executor="thread").parse(vault)
+    assert items == list(iter_parse_file(vault, escape=False))
+    assert ('echo "a\\\\b" \\', "命令,##二级,#一级") in items
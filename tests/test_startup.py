@@ -0,0 +1,31 @@
+"""
+一次性同步的导入开销：不加载重量级模块，导入耗时按 -X importtime 统计（不含解释器启动，不受机器负载的整体影响）。
+"""
+import subprocess
+import sys
+
+from check_startup import IMPORT_CODE
+from conftest import ROOT_DIR
+
+# sync_commands 与 sync_logic 的累计导入耗时预算（微秒），与 tools/check_startup.py 的默认预算相同
+IMPORT_BUDGET_US = 150_000
+
+def import_times(code):
+    """在新的解释器中执行代码，返回 -X importtime 统计的 {顶层导入的模块: 累计耗时（微秒）} 和标准输出"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT_DIR,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        # 缩进表示被其他模块导入的模块，只统计直接导入的
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith('  '):
+            times[parts[2].strip()] = int(parts[1])
+    return times, result.stdout
+
+def test_one_shot_sync_does_not_load_heavy_modules():
+    _, output = import_times(IMPORT_CODE)
+    assert output.strip() == ""
+
+def test_one_shot_sync_imports_within_budget():
+    times, _ = import_times("import sync_commands, sync_logic")
+    assert times["sync_commands"] + times.get("sync_logic", 0) < IMPORT_BUDGET_US
@@ -0,0 +1,327 @@
+"""同步、标签更新、对账和跳过未变化笔记，在 CopyQ 替身上端到端运行"""
+import pytest
+
+import sync_logic
+from clipboard_manager import MARKER_MIME
+from command_store import CommandStore
+from config import COMMAND_LOG_FILE
+from conftest import TAGS
+from parse_cache import ParseCache
+
+NOTES = """# 部署
+docker compose up -d
+kubectl get pods
+
+# 版本
+git status
+"""
+
+def restart(monkeypatch):
+    """模拟重启：清空进程内的笔记、命令存储和同步状态缓存"""
+    monkeypatch.setattr(sync_logic, "_vaults", {})
+    monkeypatch.setattr(sync_logic, "_command_stores", {})
+    monkeypatch.setattr(sync_logic, "_sync_states", {})
+
+def saved_records(vault):
+    """从数据目录重新读取命令存储"""
+    return {record.command: record for record in CommandStore(str(vault.data_dir / COMMAND_LOG_FILE)).values()}
+
+def test_sync_exports_new_commands_once(copyq, notes, make_vault, sync):
+    vault = make_vault(notes("命令.md", NOTES))
+
+    result = sync(vault)
+
+    assert (result["new"], result["updated"], result["removed"]) == (3, 0, 0)
+    assert sorted(copyq.texts("测试")) == ["docker compose up -d", "git status", "kubectl get pods"]
+    assert copyq.tags("测试", "git status") == ["命令", "#版本"]
+    assert all(item.get(MARKER_MIME) for item in copyq.items("测试"))
+
+    result = sync(vault)
+
+    assert result["new"] == 0
+    assert len(copyq.items("测试")) == 3
+
+def test_backslashes_are_written_verbatim(copyq, notes, make_vault, sync):
+    commands = ['printf "%s\\n" a\\tb', "dir \\\\server\\share", "dir \\server\\share"]
+    vault = make_vault(notes("命令.md", "# Windows\n" + "\n".join(commands) + "\n"))
+
+    result = sync(vault)
+
+    assert result["new"] == 3
+    # 通过 stdin 传给 CopyQ 的是原文，不能再多一层转义
+    assert sorted(copyq.texts("测试")) == sorted(commands)
+    assert sync(vault)["new"] == 0
+
+def test_retag_updates_existing_item_in_place(copyq, notes, make_vault, sync):
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+    sync(vault)
+    copyq.edit("测试", "git status", TAGS, "命令,#版本,我的标签")
+    calls = copyq.calls
+
+    with open(md_path, "a", encoding="utf-8") as f:
+        f.write("\n# 常用\ngit status\n")
+    result = sync(vault)
+
+    assert (result["new"], result["updated"], result["tags_updated"]) == (0, 1, 1)
+    assert copyq.calls == calls + 1
+    assert len(copyq.items("测试")) == 3
+    # 用户在 CopyQ 中添加的标签保留
+    assert copyq.tags("测试", "git status") == ["命令", "#版本", "我的标签", "#常用"]
+
+def test_retag_reexports_item_missing_from_tab(copyq, notes, make_vault, sync):
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+    sync(vault)
+    copyq.remove("测试", "git status")
+
+    with open(md_path, "a", encoding="utf-8") as f:
+        f.write("\n# 常用\ngit status\n")
+    result = sync(vault)
+
+    assert result["tags_updated"] == 0
+    assert copyq.tags("测试", "git status") == ["命令", "#版本", "#常用"]
+
+def test_reconcile_removes_only_stale_items_written_by_the_tool(copyq, notes, make_vault):
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+    vault.sync()
+    copyq.add("测试", "echo 用户自己的条目")
+    notes("命令.md", NOTES.replace("kubectl get pods\n", ""))
+
+    preview = vault.reconcile(apply=False)
+
+    assert preview["copyq_stale"] == ["kubectl get pods"]
+    assert preview["stale"] == ["kubectl get pods"]
+    assert len(copyq.items("测试")) == 4
+
+    result = vault.reconcile(apply=True)
+
+    assert result["tombstoned"] == 1
+    assert sorted(copyq.texts("测试")) == ["docker compose up -d", "echo 用户自己的条目", "git status"]
+    store = sync_logic.get_command_store(vault.data_dir)
+    assert "kubectl get pods" not in store
+    assert [record.command for record in store.tombstones()] == ["kubectl get pods"]
+
+    # 重新加入笔记的命令作为新命令再次导出
+    notes("命令.md", NOTES)
+    assert vault.sync()["new"] == 1
+    assert "kubectl get pods" in copyq.texts("测试")
+
+def test_unchanged_vault_is_skipped_after_restart(copyq, notes, make_vault, monkeypatch):
+    md_path = notes("命令.md", NOTES + "[[引用.md]]\n")
+    notes("引用.md", "ls -la\n")
+    vault = make_vault(md_path)
+    assert vault.sync()["new"] == 4
+    sync_logic.save_caches()
+    calls = copyq.calls
+
+    # 模拟重启：新的进程内缓存，命令存储、同步状态和解析缓存从数据目录读取
+    restart(monkeypatch)
+    vault = make_vault(md_path)
+    result = vault.sync()
+
+    assert result.get("unchanged") is True
+    assert "files_parsed" not in result["metrics"]["counters"]
+    assert copyq.calls == calls
+
+    # 引用的文件变化后不再跳过
+    notes("引用.md", "ls -la\npwd\n")
+    result = vault.sync()
+
+    assert not result.get("unchanged")
+    assert result["new"] == 1
+
+def test_failed_export_is_retried_on_next_sync(copyq, notes, make_vault, sync, monkeypatch):
+    monkeypatch.setattr(sync_logic, "SKIP_UNCHANGED_VAULT", False)
+    vault = make_vault(notes("命令.md", NOTES))
+    monkeypatch.setenv("FAKE_COPYQ_FAIL", "export")
+
+    sync(vault)
+
+    assert copyq.texts("测试") == []
+    store = sync_logic.get_command_store(vault.data_dir)
+    assert all(record.last_exported is None for record in store.values())
+
+    monkeypatch.delenv("FAKE_COPYQ_FAIL")
+    sync(vault)
+
+    assert sorted(copyq.texts("测试")) == ["docker compose up -d", "git status", "kubectl get pods"]
+    assert copyq.tags("测试", "git status") == ["命令", "#版本"]
+    assert all(record.last_exported is not None for record in store.values())
+
+def test_export_time_is_saved_to_the_store(copyq, notes, make_vault, sync, monkeypatch):
+    monkeypatch.setattr(sync_logic, "SKIP_UNCHANGED_VAULT", False)
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+    monkeypatch.setenv("FAKE_COPYQ_FAIL", "export")
+    sync(vault)
+    monkeypatch.delenv("FAKE_COPYQ_FAIL")
+
+    # 重新导出的命令同样写入导出时间
+    sync(vault)
+
+    records = saved_records(vault)
+    assert len(records) == 3
+    assert all(record.last_exported is not None for record in records.values())
+
+    restart(monkeypatch)
+    calls = copyq.calls
+    result = sync(make_vault(md_path))
+
+    assert result["new"] == 0
+    assert copyq.calls == calls
+
+def test_command_already_in_tab_gets_tags_and_is_not_exported_again(copyq, notes, make_vault, sync, monkeypatch):
+    monkeypatch.setattr(sync_logic, "SKIP_UNCHANGED_VAULT", False)
+    copyq.add("测试", "git status", **{TAGS: "我的标签"})
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+
+    sync(vault)
+
+    assert sorted(copyq.texts("测试")) == ["docker compose up -d", "git status", "kubectl get pods"]
+    # 用户自己添加的条目不会重复写入，但会追加笔记中的标签
+    assert copyq.tags("测试", "git status") == ["我的标签", "命令", "#版本"]
+    record = saved_records(vault)["git status"]
+    assert record.last_exported is not None
+    assert record.tags == ["命令", "#版本"]
+
+    # 之后的完整同步不再导出该命令
+    restart(monkeypatch)
+    calls = copyq.calls
+    sync(make_vault(md_path))
+
+    assert copyq.calls == calls
+
+def test_failed_sync_is_not_skipped_after_restart(copyq, notes, make_vault, monkeypatch):
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+    monkeypatch.setenv("FAKE_COPYQ_FAIL", "export")
+    vault.sync()
+    sync_logic.save_caches()
+    monkeypatch.delenv("FAKE_COPYQ_FAIL")
+
+    restart(monkeypatch)
+    result = make_vault(md_path).sync()
+
+    assert not result.get("unchanged")
+    assert sorted(copyq.texts("测试")) == ["docker compose up -d", "git status", "kubectl get pods"]
+
+def test_failed_retag_is_retried_on_next_sync(copyq, notes, make_vault, sync, monkeypatch):
+    monkeypatch.setattr(sync_logic, "SKIP_UNCHANGED_VAULT", False)
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+    sync(vault)
+    with open(md_path, "a", encoding="utf-8") as f:
+        f.write("\n# 常用\ngit status\n")
+    monkeypatch.setenv("FAKE_COPYQ_FAIL", "update_tags")
+
+    result = sync(vault)
+
+    assert result["tags_updated"] == 0
+    assert copyq.tags("测试", "git status") == ["命令", "#版本"]
+    # 没有写入 CopyQ 的标签也不记入命令存储
+    assert sync_logic.get_command_store(vault.data_dir).get("git status").tags == ["命令", "#版本"]
+
+    monkeypatch.delenv("FAKE_COPYQ_FAIL")
+    result = sync(vault)
+
+    assert result["tags_updated"] == 1
+    assert copyq.tags("测试", "git status") == ["命令", "#版本", "#常用"]
+    assert sync_logic.get_command_store(vault.data_dir).get("git status").tags == ["命令", "#版本", "#常用"]
+
+def test_reconcile_leaves_items_of_other_vaults_on_the_same_tab(copyq, notes, make_vault):
+    first = make_vault(notes("甲.md", "# 甲\ngit status\nls\n"), tab="共享")
+    second = make_vault(notes("乙.md", "# 乙\ngit status\npwd\n"), tab="共享")
+    first.sync()
+    second.sync()
+    assert sorted(copyq.texts("共享")) == ["git status", "ls", "pwd"]
+
+    notes("甲.md", "# 甲\n")
+    # 另一个笔记中已删除、但由它写入的条目，也不归本笔记对账
+    notes("乙.md", "# 乙\ngit status\n")
+    result = first.reconcile(apply=True)
+
+    assert result["copyq_stale"] == ["ls"]
+    assert sorted(copyq.texts("共享")) == ["git status", "pwd"]
+
+    result = second.reconcile(apply=True)
+
+    assert result["copyq_stale"] == ["pwd"]
+    assert copyq.texts("共享") == ["git status"]
+
+def test_removed_commands_are_deleted_only_where_this_vault_wrote_them(copyq, notes, make_vault, sync, monkeypatch):
+    monkeypatch.setattr(sync_logic, "DELETE_REMOVED_FROM_COPYQ", True)
+    copyq.add("共享", "echo 用户自己的条目")
+    first = make_vault(notes("甲.md", "# 甲\ngit status\nls\necho 用户自己的条目\n"), tab="共享")
+    second = make_vault(notes("乙.md", "# 乙\ngit status\n"), tab="共享")
+    sync(first)
+    sync(second)
+
+    notes("甲.md", "# 甲\n")
+    result = sync(first)
+
+    # git status 仍在另一个笔记中，用户自己的条目没有本笔记的标记
+    assert result["removed"] == 1
+    assert sorted(copyq.texts("共享")) == ["echo 用户自己的条目", "git status"]
+    store = sync_logic.get_command_store(first.data_dir)
+    assert sorted(record.command for record in store.tombstones()) == ["echo 用户自己的条目", "ls"]
+
+def test_failed_removal_is_retried_on_next_sync(copyq, notes, make_vault, sync, monkeypatch):
+    monkeypatch.setattr(sync_logic, "DELETE_REMOVED_FROM_COPYQ", True)
+    md_path = notes("命令.md", NOTES)
+    vault = make_vault(md_path)
+    sync(vault)
+    notes("命令.md", NOTES.replace("kubectl get pods\n", ""))
+    monkeypatch.setenv("FAKE_COPYQ_FAIL", "remove")
+
+    assert sync(vault)["removed"] == 0
+    assert "kubectl get pods" in copyq.texts("测试")
+    assert "kubectl get pods" in sync_logic.get_command_store(vault.data_dir)
+
+    monkeypatch.delenv("FAKE_COPYQ_FAIL")
+
+    assert sync(vault)["removed"] == 1
+    assert "kubectl get pods" not in copyq.texts("测试")
+    assert "kubectl get pods" not in sync_logic.get_command_store(vault.data_dir)
+
+def test_save_caches_closes_parse_pool(notes, make_vault):
+    vault = make_vault(notes("命令.md", NOTES + "[[甲.md]]\n[[乙.md]]\n"))
+    notes("甲.md", "ls\n")
+    notes("乙.md", "pwd\n")
+    vault.parse_cache = ParseCache(workers=2, executor="thread")
+    vault.parse_cache.parse(vault.md_path)
+    assert vault.parse_cache._pool is not None
+
+    assert vault.save_caches()
+
+    assert vault.parse_cache._pool is None
+
+def test_is_vault_file_follows_reverse_references(notes, make_vault):
+    md_path = notes("命令.md", NOTES + "[[sub/引用.md]]\n")
+    notes("sub/引用.md", "ls\n[[更深.md]]\n")
+    deeper = notes("sub/更深.md", "pwd\n")
+    other = notes("其他.md", "whoami\n")
+    vault = make_vault(md_path)
+
+    assert vault.is_vault_file(md_path)
+    assert vault.is_vault_file(deeper)
+    assert not vault.is_vault_file(other)
+
+    # 引用关系随文件重新解析增量更新，反向依赖中不再有已删除的引用
+    notes("sub/引用.md", "ls\n")
+    vault.referenced_files()
+
+    assert not vault.is_vault_file(deeper)
+    assert deeper not in vault.parse_cache.graph.reverse
+
+def test_same_note_cannot_sync_to_two_tabs(notes, make_vault, monkeypatch):
+    md_path = notes("命令.md", NOTES)
+    monkeypatch.setattr(sync_logic, "VAULTS", [(md_path, "甲"), (md_path, "乙")])
+    with pytest.raises(ValueError, match="只能同步到一个标签页"):
+        sync_logic.configured_vaults()
+
+    make_vault(md_path, tab="甲")
+    with pytest.raises(ValueError, match="已经同步到标签页 甲"):
+        make_vault(md_path, tab="乙")
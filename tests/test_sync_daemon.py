@@ -0,0 +1,45 @@
+"""守护进程启动时不会占用已有守护进程的监听地址"""
+import socket
+
+import pytest
+
+import sync_client
+import sync_daemon
+import sync_logic
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture(params=["unix", "tcp"])
+def address(request, tmp_path, monkeypatch):
+    """分别使用 Unix 域套接字和 Windows 上的 TCP 回环地址"""
+    if request.param == "tcp":
+        address = (socket.AF_INET, ("127.0.0.1", free_port()))
+    elif hasattr(socket, "AF_UNIX"):
+        address = (socket.AF_UNIX, str(tmp_path / "daemon.sock"))
+    else:
+        pytest.skip("不支持 Unix 域套接字")
+    monkeypatch.setattr(sync_client, "get_daemon_address", lambda: address)
+    monkeypatch.setattr(sync_daemon, "get_daemon_address", lambda: address)
+    # status 会创建默认笔记的同步引擎，不留给其他测试
+    monkeypatch.setattr(sync_logic, "_vaults", {})
+    return address
+
+def test_second_daemon_refuses_to_start(address):
+    first = sync_daemon.SyncDaemon()
+    first.start(blocking=False)
+    try:
+        assert sync_client.send_request("status", timeout=5)["ok"]
+        with pytest.raises(RuntimeError, match="已有同步守护进程"):
+            sync_daemon.SyncDaemon().start(blocking=False)
+        # 第一个守护进程仍在正常服务
+        assert sync_client.send_request("status", timeout=5)["ok"]
+    finally:
+        first.stop()
+
+    # 停止之后可以重新启动
+    second = sync_daemon.SyncDaemon()
+    second.start(blocking=False)
+    second.stop()
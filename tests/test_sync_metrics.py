@@ -0,0 +1,47 @@
+"""进度回调只收到在 reporting_progress 块内发起的同步的进度"""
+import threading
+
+import pytest
+
+import sync_metrics
+
+@pytest.fixture(params=["sync_logic", "async_sync"])
+def engine(request):
+    return __import__(request.param)
+
+def test_progress_is_reported_only_for_syncs_started_inside(copyq, notes, make_vault, engine):
+    reported = []
+    own = [make_vault(notes(f"{name}.md", f"# {name}\necho {name}\n"), tab=name) for name in ("甲", "乙")]
+    other = make_vault(notes("丙.md", "# 丙\necho 丙\n"), tab="丙")
+
+    # 其他线程（如文件监控）中同时进行的同步
+    outside = threading.Thread(target=other.sync)
+    with sync_metrics.reporting_progress(lambda metrics, done, total: reported.append((metrics, done, total))):
+        outside.start()
+        engine.sync_all(own)
+    outside.join()
+
+    # 两个笔记各自报告了开始和完成
+    assert len({metrics for metrics, _, _ in reported}) == 2
+    assert sorted((done, total) for _, done, total in reported) == [(0, 1), (0, 1), (1, 1), (1, 1)]
+    assert sorted(copyq.texts("丙")) == ["echo 丙"]
+
+def test_summary_while_other_threads_record(monkeypatch):
+    monkeypatch.setattr(sync_metrics, "history", sync_metrics.deque(maxlen=20))
+    monkeypatch.setattr(sync_metrics, "METRICS_LOG_FILE", "")
+    done = threading.Event()
+
+    def run():
+        for index in range(20000):
+            sync_metrics.record({"started_at": str(index), "total_ms": index})
+        done.set()
+
+    writer = threading.Thread(target=run)
+    writer.start()
+    summaries = []
+    while not done.is_set():
+        summaries.append(sync_metrics.summary())
+    writer.join()
+
+    assert sync_metrics.summary()["last_ms"] == 19999
+    assert all(summary is None or summary["count"] <= 20 for summary in summaries)
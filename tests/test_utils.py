@@ -0,0 +1,26 @@
+"""原子写入：多个线程同时写入同一文件时互不干扰，不留下临时文件"""
+import threading
+
+from utils import atomic_write
+
+def test_concurrent_atomic_writes_do_not_collide(tmp_path):
+    path = tmp_path / "state.json"
+    contents = [f"写入 {index}".encode('utf-8') * 1000 for index in range(8)]
+    errors = []
+
+    def write(data):
+        try:
+            for _ in range(20):
+                atomic_write(path, data)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(data,)) for data in contents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert path.read_bytes() in contents
+    assert [entry.name for entry in tmp_path.iterdir()] == ["state.json"]
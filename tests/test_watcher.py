@@ -0,0 +1,52 @@
+"""文件监控的启动和停止"""
+import os
+import time
+
+import pytest
+
+import sync_logic
+
+watcher = pytest.importorskip("watcher")
+
+@pytest.mark.parametrize("blocking", [True, False])
+def test_stop_during_initial_sync_does_not_start_observer(copyq, monkeypatch, blocking):
+    saved = []
+
+    def initial_sync(vaults, executor):
+        # 初始同步期间 Observer 尚未创建，停止信号仍然有效
+        assert watcher.stop_watching(timeout=0)
+
+    monkeypatch.setattr(sync_logic, "configured_vaults", lambda: [])
+    monkeypatch.setattr(sync_logic, "sync_all", initial_sync)
+    monkeypatch.setattr(sync_logic, "save_caches", lambda timeout=None: saved.append(True))
+
+    watcher.start_watching(blocking=blocking)
+
+    assert watcher._observer is None
+    assert watcher._stopped_event.is_set()
+    assert saved == [True]
+    assert not watcher.stop_watching(timeout=0)
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def test_reference_in_missing_directory_is_synced_once_created(copyq, notes, make_vault, monkeypatch):
+    md_path = notes("命令.md", "# 常用\ngit status\n[[sub/新.md]]\n")
+    vault = make_vault(md_path)
+    monkeypatch.setattr(sync_logic, "configured_vaults", lambda: [vault])
+    watcher.start_watching(blocking=False)
+    try:
+        assert copyq.texts("测试") == ["git status"]
+
+        # 目录和文件先后创建，文件可能在新目录的监控生效之前就已写入
+        os.mkdir(os.path.join(os.path.dirname(md_path), "sub"))
+        notes("sub/新.md", "ls -la\n")
+
+        assert wait_for(lambda: "ls -la" in copyq.texts("测试"))
+    finally:
+        watcher.stop_watching()
@@ -0,0 +1,78 @@
+"""
+解析器基准测试：生成约 10 万行的笔记文件，分别测量从字符串解析和从文件流式解析的耗时，
+并以 tests/legacy_parser.py 中最初版本的解析器在同一输入上的耗时作为基线。
+
+用法：python tools/bench_parser.py [行数]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tests"))
+
+import legacy_parser
+from import_commands import parse_md_content, iter_parse_file
+
+def generate_notes(line_count, seed=0):
+    """生成包含各级标题、单行命令、行内标签、标签行和代码块的笔记内容"""
+    rng = random.Random(seed)
+    lines = []
+    while len(lines) < line_count:
+        kind = rng.random()
+        if kind < 0.05:
+            lines.append('#' * rng.randint(1, 4) + f" 分组{rng.randint(0, 999)}")
+        elif kind < 0.55:
+            lines.append(f"git log --oneline -n {rng.randint(1, 99)} | grep feature/{rng.randint(0, 9999)}")
+        elif kind < 0.70:
+            lines.append(f"docker compose -f stack{rng.randint(0, 99)}.yml up -d #部署")
+        elif kind < 0.80:
+            lines.append("")
+        elif kind < 0.90:
+            lines.append(f"kubectl -n ns{rng.randint(0, 99)} get pods")
+            lines.append(f"> 运维")
+        else:
+            lines.append("```")
+            for i in range(rng.randint(1, 6)):
+                lines.append(f"for f in *.log; do gzip \"$f\"; done  # {i}")
+            lines.append("```")
+            lines.append("> 脚本")
+    return '\n'.join(lines[:line_count]) + '\n'
+
+def measure(label, func, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<24} {best * 1000:8.1f} ms  {len(result)} 条")
+    return result, best
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    content = generate_notes(line_count)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        md_path = os.path.join(tmp_dir, "notes.md")
+        with open(md_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        size_mb = os.path.getsize(md_path) / 1024 / 1024
+        print(f"生成 {line_count} 行笔记，大小 {size_mb:.1f} MB")
+
+        baseline, baseline_time = measure(
+            "legacy_parser", lambda: legacy_parser.parse_md_content(content, base_path=md_path))
+        from_string, string_time = measure("parse_md_content", lambda: parse_md_content(content, base_path=md_path))
+        from_file, file_time = measure("iter_parse_file", lambda: list(iter_parse_file(md_path)))
+        print(f"相对 legacy_parser 的加速: parse_md_content {baseline_time / string_time:.2f}x，"
+              f"iter_parse_file {baseline_time / file_time:.2f}x")
+        if not baseline == from_string == from_file:
+            print("错误: 解析结果与基线不一致")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+同步基准测试：生成笔记目录，启动内存中的 CopyQ 替身服务器，测量三种场景：
+- cold：空的命令存储和标签页，新进程首次同步（全部导入）
+- warm：命令存储和标签页已有内容，新进程再次同步（没有需要导出的命令）
+- edit：在 warm 的进程中修改一个深层引用文件的一行后同步（增量同步）
+
+每个场景报告解析时间、命令存储加载/保存时间、CopyQ 调用次数和端到端同步耗时。
+只需要 Python，需要 Unix 域套接字（Linux/macOS）。
+
+用法：python tools/bench_sync.py [--commands N] [--depth D] [--fanout F] [--latency 秒] [--async]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+sys.path.insert(0, TOOLS_DIR)
+
+import fake_copyq
+from gen_vault import generate_vault
+
+FAKE_COPYQ = os.path.join(TOOLS_DIR, "fake_copyq.py")
+
+def _elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+def measure_scenario(name, md_path, data_dir, use_async, parse_cache):
+    """在当前进程中测量一次同步，parse_cache 为与同步缓存状态相同的独立解析缓存"""
+    import sync_logic
+    from command_store import CommandStore
+    from config import COMMAND_LOG_FILE
+
+    start = time.perf_counter()
+    parse_cache.parse(md_path)
+    parse_ms = _elapsed_ms(start)
+
+    calls_before = fake_copyq.request(os.environ["FAKE_COPYQ_SERVER"], {"stats": True})["calls"]
+    start = time.perf_counter()
+    if use_async:
+        import async_sync
+        result = async_sync.run_one_time_sync(md_path, data_dir)
+    else:
+        result = sync_logic.run_one_time_sync(md_path, data_dir)
+    sync_ms = _elapsed_ms(start)
+    calls = fake_copyq.request(os.environ["FAKE_COPYQ_SERVER"], {"stats": True})["calls"] - calls_before
+
+    log_path = os.path.join(data_dir, COMMAND_LOG_FILE)
+    start = time.perf_counter()
+    store = CommandStore(log_path)
+    load_ms = _elapsed_ms(start)
+    # 在副本上测量整体重写，不影响后续场景
+    store.log_path = log_path + ".bench"
+    start = time.perf_counter()
+    store.compact()
+    save_ms = _elapsed_ms(start)
+    os.remove(store.log_path)
+
+    return {"scenario": name, "parse_ms": parse_ms, "store_load_ms": load_ms, "store_save_ms": save_ms,
+            "copyq_calls": calls, "sync_ms": sync_ms, "new": result.get("new", 0), "updated": result.get("updated", 0)}
+
+def run_child(phase, md_path, data_dir, edit_path, use_async):
+    """子进程入口：每个阶段在新进程中运行，进程内缓存从零开始"""
+    from parse_cache import ParseCache
+    import sync_logic  # noqa: F401  导入后再调整日志级别
+    logging.getLogger().setLevel(logging.WARNING)
+
+    cache = ParseCache()
+    results = []
+    if phase == "cold":
+        results.append(measure_scenario("cold", md_path, data_dir, use_async, cache))
+    else:
+        results.append(measure_scenario("warm", md_path, data_dir, use_async, cache))
+        with open(edit_path, 'a', encoding='utf-8') as f:
+            f.write("echo edited-by-bench # 基准\n")
+        results.append(measure_scenario("edit", md_path, data_dir, use_async, cache))
+    print(json.dumps(results))
+
+def start_server(address, env):
+    server = subprocess.Popen([sys.executable, FAKE_COPYQ, "--serve", address], env=env)
+    for _ in range(100):
+        if os.path.exists(address):
+            return server
+        time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("CopyQ 替身服务器启动失败")
+
+def main():
+    parser = argparse.ArgumentParser(description="同步基准测试")
+    parser.add_argument('--commands', type=int, default=2000, help="命令总数")
+    parser.add_argument('--depth', type=int, default=2, help="[[...]] 引用深度")
+    parser.add_argument('--fanout', type=int, default=3, help="每个文件引用的文件数")
+    parser.add_argument('--latency', type=float, default=0.0, help="每次 CopyQ 调用的模拟启动延迟（秒）")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="使用 asyncio 同步引擎")
+    parser.add_argument('--child', nargs=4, metavar=("PHASE", "MD", "DATA", "EDIT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child, args.use_async)
+        return 0
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_sync_")
+    try:
+        vault = os.path.join(tmp_dir, "vault")
+        md_path, paths = generate_vault(vault, args.commands, args.depth, args.fanout)
+        edit_path = paths[-1]
+        address = os.path.join(tmp_dir, "copyq.sock")
+        env = dict(os.environ, COPYQ_PATH=FAKE_COPYQ, FAKE_COPYQ_SERVER=address,
+                   FAKE_COPYQ_LATENCY=str(args.latency))
+        print(f"笔记: {len(paths)} 个文件，{args.commands} 条命令，深度 {args.depth}；"
+              f"CopyQ 延迟 {args.latency * 1000:.0f} ms；引擎: {'asyncio' if args.use_async else 'thread'}")
+
+        server = start_server(address, env)
+        try:
+            results = []
+            for phase in ("cold", "warm"):
+                command = [sys.executable, os.path.abspath(__file__), '--child', phase, md_path, vault, edit_path]
+                if args.use_async:
+                    command.append('--async')
+                output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+                results.extend(json.loads(output.strip().splitlines()[-1]))
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(f"{'场景':<6}{'解析':>10}{'存储加载':>10}{'存储保存':>10}{'CopyQ调用':>10}{'同步耗时':>12}{'新增':>7}{'更新':>6}")
+        for r in results:
+            print(f"{r['scenario']:<8}{r['parse_ms']:>9.1f}ms{r['store_load_ms']:>11.1f}ms{r['store_save_ms']:>11.1f}ms"
+                  f"{r['copyq_calls']:>12}{r['sync_ms']:>13.1f}ms{r['new']:>8}{r['updated']:>8}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
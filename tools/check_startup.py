@@ -0,0 +1,72 @@
+"""
+启动时间检查：一次性同步常由编辑器保存钩子调用，解释器启动和导入占了大部分耗时。
+本脚本检查 sync_commands.py 的导入开销，防止重新引入耗时的导入：
+- 导入 sync_commands 及一次性同步用到的 sync_logic 时，不应加载 FORBIDDEN_MODULES；
+- 导入耗时（扣除空解释器的启动时间，多次运行取最小值）不超过预算。
+
+用法：python tools/check_startup.py [预算毫秒，默认 150]
+通过时退出码为 0，否则为 1 并列出最慢的导入。
+"""
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 一次性同步不需要的重量级模块，只应在监控、托盘或 asyncio 引擎中按需导入
+FORBIDDEN_MODULES = ("watchdog", "PyQt5", "asyncio", "multiprocessing", "concurrent.futures.process")
+
+IMPORT_CODE = (
+    "import sys, sync_commands, sync_logic; "
+    f"print(','.join(m for m in {FORBIDDEN_MODULES!r} if m in sys.modules))"
+)
+
+def best_wall_time(args, repeat):
+    """多次运行命令，返回最短耗时（秒）和最后一次的标准输出"""
+    best = None
+    output = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(args, cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+def slowest_imports(limit=10):
+    """用 -X importtime 找出累计耗时最长的导入"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import sync_commands, sync_logic"],
+                            cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 150.0
+    repeat = 5
+    baseline, _ = best_wall_time([sys.executable, "-c", "pass"], repeat)
+    total, output = best_wall_time([sys.executable, "-c", IMPORT_CODE], repeat)
+    import_ms = (total - baseline) * 1000
+    loaded = [name for name in output.strip().split(',') if name]
+
+    print(f"空解释器启动 {baseline * 1000:.1f} ms，导入 sync_commands + sync_logic 额外 {import_ms:.1f} ms（预算 {budget_ms:.0f} ms）")
+    ok = True
+    if loaded:
+        print(f"失败: 一次性同步加载了不需要的模块: {', '.join(loaded)}")
+        ok = False
+    if import_ms > budget_ms:
+        print("失败: 导入耗时超出预算")
+        ok = False
+    if not ok:
+        print("累计耗时最长的导入：")
+        for cumulative_us, name in slowest_imports():
+            print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+        return 1
+    print("通过")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
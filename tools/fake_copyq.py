@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+CopyQ 命令行客户端的替身，用于在没有安装 CopyQ 的环境中验证同步逻辑。
+
+用法：将环境变量 COPYQ_PATH 指向本文件（需要可执行权限）。
+FAKE_COPYQ_LATENCY 可模拟每次调用的启动延迟（秒），FAKE_COPYQ_FAIL 可让指定的脚本调用失败（见 SCRIPT_NAMES）。
+条目有两种保存方式：
+- 文件模式（默认）：保存在 FAKE_COPYQ_STATE 指定的 JSON 文件中；多个替身进程并发运行时（asyncio 引擎）
+  用文件锁串行化对状态文件的读写，启动延迟仍然并行。
+- 服务器模式：先运行 `fake_copyq.py --serve <套接字路径>`，再把 FAKE_COPYQ_SERVER 设为同一路径，
+  条目只保存在服务器进程的内存中，与真实 CopyQ 的客户端/服务器结构一致（需要 Unix 域套接字）。
+命令行参数按 CopyQ 的规则处理：`--` 之前的参数展开转义序列，之后的参数原样传给命令（见 unescape_arguments）。
+替身不执行 JavaScript，而是按脚本原文识别本项目使用的脚本，并用 Python 实现相同的行为
+（内容比较同样先用 content_hash.normalize_content 规范化）。
+"""
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不加锁，只支持串行调用
+    fcntl = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clipboard_manager
+import copyq_session
+from content_hash import normalize_content
+
+STATE_PATH = os.environ.get("FAKE_COPYQ_STATE", os.path.join(tempfile.gettempdir(), "fake_copyq_state.json"))
+LATENCY = float(os.environ.get("FAKE_COPYQ_LATENCY", "0"))
+SERVER_ADDRESS = os.environ.get("FAKE_COPYQ_SERVER", "")
+# 逗号分隔的脚本名，执行这些脚本时以非零状态退出，模拟 CopyQ 调用失败
+FAILING_SCRIPTS = set(filter(None, os.environ.get("FAKE_COPYQ_FAIL", "").split(",")))
+TEXT = "text/plain"
+TAGS = "application/x-copyq-tags"
+
+def load_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"calls": 0, "tabs": {}}
+
+def save_state(state):
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, STATE_PATH)
+
+# FAKE_COPYQ_FAIL 中使用的脚本名
+SCRIPT_NAMES = {
+    clipboard_manager.EXPORT_BATCH_SCRIPT: "export",
+    clipboard_manager.UPDATE_TAGS_SCRIPT: "update_tags",
+    clipboard_manager.REMOVE_ITEMS_SCRIPT: "remove",
+    clipboard_manager.RECONCILE_SCRIPT: "reconcile",
+    clipboard_manager.TAB_CONTENTS_SCRIPT: "tab_contents",
+}
+
+def eval_export_batch(items, data):
+    existing = {normalize_content(item.get(TEXT, "")) for item in items} if data["check"] else set()
+    inserted = []
+    for entry in data["items"]:
+        key = normalize_content(entry["content"])
+        if key in existing:
+            inserted.append(False)
+            continue
+        items.insert(0, {TEXT: entry["content"], TAGS: entry["tags"], clipboard_manager.MARKER_MIME: data["marker"]})
+        existing.add(key)
+        inserted.append(True)
+    return inserted
+
+def eval_reconcile(items, data):
+    keep = {normalize_content(text) for text in data["keep"]}
+    known = {normalize_content(text) for text in data["known"]}
+    def owned(item):
+        marker = item.get(clipboard_manager.MARKER_MIME, "")
+        return (marker in (data["marker"], clipboard_manager.LEGACY_MARKER)
+                or (marker == "" and normalize_content(item.get(TEXT, "")) in known))
+    stale_rows = [row for row, item in enumerate(items)
+                  if normalize_content(item.get(TEXT, "")) not in keep and owned(item)]
+    stale = [items[row].get(TEXT, "") for row in stale_rows]
+    if data["apply"]:
+        for row in reversed(stale_rows):
+            del items[row]
+    return stale
+
+def eval_update_tags(items, data):
+    targets = {normalize_content(entry["content"]): position for position, entry in enumerate(data)}
+    states = [-1] * len(data)
+    for item in items:
+        position = targets.get(normalize_content(item.get(TEXT, "")))
+        if position is None:
+            continue
+        current = []
+        for tag in item.get(TAGS, "").split(","):
+            if tag.strip() and tag.strip() not in current:
+                current.append(tag.strip())
+        added = False
+        for tag in data[position]["tags"].split(","):
+            if tag.strip() and tag.strip() not in current:
+                current.append(tag.strip())
+                added = True
+        if added:
+            item[TAGS] = ",".join(current)
+            states[position] = 1
+        elif states[position] < 0:
+            states[position] = 0
+    return states
+
+def eval_script(script, items, stdin):
+    """按脚本原文分派，返回要打印的文本"""
+    if script == copyq_session.PING_SCRIPT:
+        return "ok"
+    if script == clipboard_manager.CONTENT_EXISTS_SCRIPT:
+        content = normalize_content(stdin)
+        return "true" if any(normalize_content(item.get(TEXT, "")) == content for item in items) else "false"
+    if script == clipboard_manager.TAB_CONTENTS_SCRIPT:
+        return json.dumps([item.get(TEXT, "") for item in items], ensure_ascii=False)
+    if script == clipboard_manager.TAB_FINGERPRINT_SCRIPT:
+        n = len(items)
+        return json.dumps([n, items[0].get(TEXT, "") if n else "", items[-1].get(TEXT, "") if n else ""],
+                          ensure_ascii=False)
+    if script == clipboard_manager.EXPORT_BATCH_SCRIPT:
+        return json.dumps(eval_export_batch(items, json.loads(stdin)))
+    if script == clipboard_manager.UPDATE_TAGS_SCRIPT:
+        return json.dumps(eval_update_tags(items, json.loads(stdin)))
+    if script == clipboard_manager.RECONCILE_SCRIPT:
+        return json.dumps(eval_reconcile(items, json.loads(stdin)), ensure_ascii=False)
+    if script == clipboard_manager.REMOVE_ITEMS_SCRIPT:
+        data = json.loads(stdin)
+        targets = {normalize_content(text) for text in data["contents"]}
+        kept = [item for item in items if normalize_content(item.get(TEXT, "")) not in targets
+                or item.get(clipboard_manager.MARKER_MIME) != data["marker"]]
+        removed = len(items) - len(kept)
+        items[:] = kept
+        return str(removed)
+    raise ValueError("fake_copyq 不支持的脚本: " + script[:60])
+
+def unescape_argument(argument):
+    """与 CopyQ 相同：\\n、\\t、\\\\ 分别展开为换行、制表符和反斜杠，其他 \\x 和末尾的反斜杠原样保留"""
+    if '\\' not in argument:
+        return argument
+    replacements = {'n': '\n', 't': '\t', '\\': '\\'}
+    result = []
+    position = 0
+    while position < len(argument):
+        char = argument[position]
+        if char == '\\' and position + 1 < len(argument):
+            following = argument[position + 1]
+            result.append(replacements.get(following, char + following))
+            position += 2
+        else:
+            result.append(char)
+            position += 1
+    return ''.join(result)
+
+def unescape_arguments(argv):
+    """展开 `--` 之前参数中的转义序列并去掉 `--`，之后的参数原样保留"""
+    if "--" in argv:
+        position = argv.index("--")
+        return [unescape_argument(argument) for argument in argv[:position]] + argv[position + 1:]
+    return [unescape_argument(argument) for argument in argv]
+
+def execute(state, argv, stdin):
+    """
+    在状态上执行一条命令
+    :return: (退出码, 标准输出, 标准错误)
+    """
+    state["calls"] += 1
+
+    if argv and argv[0] == "--start-server":
+        argv = argv[1:]
+    tab = "clipboard"
+    if argv[:1] == ["tab"]:
+        tab, argv = argv[1], argv[2:]
+    items = state["tabs"].setdefault(tab, [])
+
+    output = ""
+    command = argv[0] if argv else ""
+    if command == "eval":
+        try:
+            output = eval_script(argv[1], items, stdin)
+        except ValueError as e:
+            return 1, "", str(e)
+    elif command == "write":
+        pairs = argv[1:]
+        items.insert(0, dict(zip(pairs[0::2], pairs[1::2])))
+    elif command == "read":
+        row = int(argv[1]) if len(argv) > 1 else 0
+        output = items[row].get(TEXT, "") if row < len(items) else ""
+    elif command == "size":
+        output = str(len(items))
+    else:
+        return 1, "", f"fake_copyq 不支持的命令: {command}"
+    return 0, output, ""
+
+def execute_with_file(argv, stdin):
+    """文件模式：加锁读取状态文件，执行命令后写回"""
+    with open(STATE_PATH + ".lock", 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        state = load_state()
+        result = execute(state, argv, stdin)
+        save_state(state)
+        return result
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+def request(address, message):
+    """向替身服务器发送一个 JSON 请求并返回 JSON 响应"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        return json.loads(_recv_all(sock).decode('utf-8'))
+
+def serve(address):
+    """
+    服务器模式：条目只保存在内存中，客户端进程把命令转发过来执行。
+    除普通命令外还支持 {"stats": true}（返回调用次数和各标签页条目数）和 {"reset": true}（清空状态）。
+    """
+    state = {"calls": 0, "tabs": {}}
+    lock = threading.Lock()
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            message = json.loads(_recv_all(self.request).decode('utf-8'))
+            with lock:
+                if message.get("stats"):
+                    reply = {"calls": state["calls"],
+                             "tabs": {tab: len(items) for tab, items in state["tabs"].items()}}
+                elif message.get("reset"):
+                    state["calls"] = 0
+                    state["tabs"] = {}
+                    reply = {}
+                else:
+                    code, output, error = execute(state, message["argv"], message["stdin"])
+                    reply = {"code": code, "stdout": output, "stderr": error}
+            self.request.sendall(json.dumps(reply, ensure_ascii=False).encode('utf-8'))
+
+    if os.path.exists(address):
+        os.unlink(address)
+    with socketserver.ThreadingUnixStreamServer(address, Handler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(address)
+
+def main(argv):
+    # 与 copyq_session 保持一致，统一使用 UTF-8 读写
+    sys.stdin.reconfigure(encoding='utf-8')
+    sys.stdout.reconfigure(encoding='utf-8')
+    if argv[:1] == ["--serve"]:
+        serve(argv[1] if len(argv) > 1 else SERVER_ADDRESS)
+        return 0
+
+    time.sleep(LATENCY)
+    argv = unescape_arguments(argv)
+    stdin = sys.stdin.read() if "eval" in argv and not sys.stdin.isatty() else ""
+    if argv[-2:-1] == ["eval"] and SCRIPT_NAMES.get(argv[-1]) in FAILING_SCRIPTS:
+        print(f"fake_copyq: 模拟 {SCRIPT_NAMES[argv[-1]]} 脚本调用失败", file=sys.stderr)
+        return 1
+    if SERVER_ADDRESS:
+        reply = request(SERVER_ADDRESS, {"argv": argv, "stdin": stdin})
+        code, output, error = reply["code"], reply["stdout"], reply["stderr"]
+    else:
+        code, output, error = execute_with_file(argv, stdin)
+    if error:
+        print(error, file=sys.stderr)
+    sys.stdout.write(output)
+    return code
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+"""
+生成用于基准测试的笔记目录：主文件通过 [[...]] 引用组成指定深度的文件树，
+文件中包含各级标题、单行命令、行内标签（命令 # 标签）、代码块和标签行（> 标签）。
+
+用法：python tools/gen_vault.py <目录> [命令数] [引用深度] [每个文件的引用数]
+"""
+import os
+import random
+import sys
+
+MAIN_FILE = "命令管理.md"
+
+def _file_content(rng, commands, references, file_id):
+    """生成一个文件的内容，commands 为本文件分到的命令编号列表，references 为引用的相对路径列表"""
+    lines = [f"# 文件{file_id}"]
+    reference_slots = sorted(rng.sample(range(len(commands) + 1), min(len(references), len(commands) + 1)))
+    pending_references = list(references)
+    for position, number in enumerate(commands):
+        while reference_slots and reference_slots[0] == position:
+            reference_slots.pop(0)
+            lines.append(f"[[{pending_references.pop(0)}]]")
+        kind = rng.random()
+        if kind < 0.08:
+            lines.append('#' * rng.randint(2, 4) + f" 分组{rng.randint(0, 99)}")
+        if kind < 0.55:
+            lines.append(f"git log --oneline -n {number % 97 + 1} -- src/module{number}")
+        elif kind < 0.75:
+            lines.append(f"docker compose -f stack{number}.yml up -d # 部署,容器")
+        elif kind < 0.85:
+            lines.append(f"kubectl -n ns{number} get pods")
+            lines.append("> 运维")
+        else:
+            lines.append("```")
+            for i in range(rng.randint(2, 5)):
+                lines.append(f"for f in /var/log/app{number}/*.log; do gzip \"$f\"; done  # {i}")
+            lines.append("```")
+            lines.append("> 脚本")
+        if rng.random() < 0.1:
+            lines.append("")
+    lines.extend(f"[[{path}]]" for path in pending_references)
+    return '\n'.join(lines) + '\n'
+
+def generate_vault(root, commands=1000, depth=2, fanout=3, seed=0):
+    """
+    在 root 目录下生成笔记文件
+    :param commands: 命令总数，平均分配到所有文件
+    :param depth: 引用深度，0 表示只有主文件
+    :param fanout: 每个文件引用的下一层文件数
+    :return: 主文件路径和全部文件路径列表（主文件在前）
+    """
+    rng = random.Random(seed)
+    # 先确定文件树：(相对路径, 层级, 子文件相对路径列表)
+    tree = [(MAIN_FILE, 0, [])]
+    level = [0]
+    for current_depth in range(1, depth + 1):
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                rel_path = os.path.join(f"level{current_depth}", f"f{len(tree)}_{i}.md")
+                tree[parent][2].append(len(tree))
+                tree.append((rel_path, current_depth, []))
+                next_level.append(len(tree) - 1)
+        level = next_level
+
+    numbers = list(range(commands))
+    per_file = -(-commands // len(tree)) if commands else 0
+    paths = []
+    for file_id, (rel_path, _, children) in enumerate(tree):
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 引用路径相对于引用所在的文件
+        references = [os.path.relpath(os.path.join(root, tree[child][0]), os.path.dirname(path))
+                      for child in children]
+        own = numbers[file_id * per_file:(file_id + 1) * per_file]
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(_file_content(rng, own, references, file_id))
+        paths.append(path)
+    return paths[0], paths
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    root = sys.argv[1]
+    commands = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    depth = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    fanout = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+    main_path, paths = generate_vault(root, commands, depth, fanout)
+    print(f"已生成 {len(paths)} 个文件，{commands} 条命令，主文件: {main_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,13 @@
+import os
+import sys
 import threading
+import time
 from PyQt5.QtWidgets import QSystemTrayIcon, QMenu, QAction, QApplication
 from icon_creator import create_tray_icon
+from sync_executor import SyncExecutor
 from utils import restart_program, open_project_folder, open_markdown_file
-import sync_logic
+import sync_metrics
+from config import SYNC_ENGINE, HOST_SYNC_DAEMON, SHUTDOWN_TIMEOUT
 from PyQt5.QtCore import QObject, QMetaObject, Qt, pyqtSlot
 
 class TrayManager(QObject):
@@ -14,8 +19,16 @@ class TrayManager(QObject):
         self.tray_icon.setToolTip("CopyQ MD Sync")
         
         self.watcher_thread = None
+        self.watching_engine = None
         self.is_watching = False
 
+        # 手动同步都交给同一个执行器，结果和进度通过信号回到界面线程
+        self.sync_executor = SyncExecutor(self)
+        self.sync_executor.started.connect(self.on_sync_started)
+        self.sync_executor.progress.connect(self.on_sync_progress)
+        self.sync_executor.finished.connect(self.on_sync_finished)
+        self.sync_executor.failed.connect(self.on_sync_failed)
+
         # --- 菜单 ---
         self.tray_menu = QMenu()
         
@@ -23,8 +36,25 @@ class TrayManager(QObject):
         self.watch_action = QAction("开启自动监控", self)
         self.watch_action.setCheckable(True)
 
+        self.async_action = QAction("使用 asyncio 同步引擎", self)
+        self.async_action.setCheckable(True)
+        self.async_action.setChecked(SYNC_ENGINE == "asyncio")
+
         self.tray_menu.addAction(self.sync_action)
         self.tray_menu.addAction(self.watch_action)
+        self.daemon_action = QAction("本地同步服务（供编辑器调用）", self)
+        self.daemon_action.setCheckable(True)
+
+        self.tray_menu.addAction(self.async_action)
+        self.tray_menu.addAction(self.daemon_action)
+        self.tray_menu.addSeparator()
+
+        # 同步统计，只用于显示，每次打开菜单时刷新
+        self.stats_action = QAction("尚未同步", self)
+        self.stats_action.setEnabled(False)
+        self.tray_menu.addAction(self.stats_action)
+        # 各笔记的同步状态，打开子菜单时刷新
+        self.vaults_menu = self.tray_menu.addMenu("笔记状态")
         self.tray_menu.addSeparator()
         
         self.open_md_action = QAction("打开命令文件", self)
@@ -39,34 +69,118 @@ class TrayManager(QObject):
         self.tray_menu.addAction(self.quit_action)
         
         self.tray_icon.setContextMenu(self.tray_menu)
+        self.tray_menu.aboutToShow.connect(self.update_stats_action)
+        self.vaults_menu.aboutToShow.connect(self.update_vaults_menu)
         
         # --- 信号连接 ---
         self.sync_action.triggered.connect(self.run_sync_in_thread)
         self.watch_action.toggled.connect(self.toggle_watching)
+        self.daemon_action.toggled.connect(self.toggle_daemon)
         self.open_md_action.triggered.connect(open_markdown_file)
         self.open_folder_action.triggered.connect(open_project_folder)
-        self.restart_action.triggered.connect(restart_program)
+        self.restart_action.triggered.connect(self.restart_app)
         self.quit_action.triggered.connect(self.quit_app)
         
         self.tray_icon.show()
+        # 守护进程与托盘共用同一个进程，手动同步、自动监控和编辑器请求共享解析缓存和命令存储
+        self.daemon_action.setChecked(HOST_SYNC_DAEMON)
+
+    @property
+    def engine(self):
+        """
+        当前选择的同步引擎模块，两者提供相同的 run_one_time_sync / sync_all / start_watching / stop_watching。
+        同步模块在第一次使用时才导入，托盘图标可以尽快显示
+        """
+        if self.async_action.isChecked():
+            import async_sync
+            return async_sync
+        import sync_logic
+        return sync_logic
+
+    def update_stats_action(self):
+        """显示上次同步的时间和耗时，以及最近若干次同步耗时的 p95"""
+        stats = sync_metrics.summary()
+        if stats is None:
+            self.stats_action.setText("尚未同步")
+            return
+        last_time = stats["last_at"][11:19]
+        self.stats_action.setText(f"上次同步 {last_time}，用时 {stats['last_ms']:.0f} ms；"
+                                  f"最近 {stats['count']} 次 p95 {stats['p95_ms']:.0f} ms")
+
+    def update_vaults_menu(self):
+        """每个配置的笔记一行：主文件、标签页、状态和上次同步结果"""
+        import sync_logic
+        self.vaults_menu.clear()
+        for vault in sync_logic.configured_vaults():
+            status = vault.status()
+            text = f"{os.path.basename(status['md_path'])} → {status['tab']}："
+            if status["state"] == "syncing":
+                text += "同步中"
+            elif status["error"]:
+                text += f"出错 {status['last_sync_at'][11:19]}（{status['error']}）"
+            elif status["last_result"] is None:
+                text += "尚未同步"
+            else:
+                result = status["last_result"]
+                text += (f"{status['last_sync_at'][11:19]} 新增 {result['new']}，"
+                         f"更新 {result['updated']}，删除 {result['removed']}")
+            action = self.vaults_menu.addAction(text)
+            action.setToolTip(status["md_path"])
+            action.setEnabled(False)
 
     def show_message(self, title, message, mtype=QSystemTrayIcon.Information, timeout=3000):
         self.tray_icon.showMessage(title, message, mtype, timeout)
 
     def run_sync_in_thread(self):
-        """在新线程中执行一次性同步，避免UI阻塞"""
-        self.show_message("正在同步", "正在同步Markdown文件到CopyQ...")
-        sync_thread = threading.Thread(target=self.sync_and_notify)
-        sync_thread.start()
-
-    def sync_and_notify(self):
-        result = sync_logic.run_one_time_sync()
-        if "error" in result:
-            self.show_message("同步失败", result["error"], QSystemTrayIcon.Critical)
+        """把同步交给同步执行器，在其工作线程中执行，避免UI阻塞"""
+        if self.sync_executor.request(self.engine):
+            self.show_message("正在同步", "正在同步Markdown文件到CopyQ...")
+        else:
+            self.show_message("正在同步", "已有同步在进行，完成后将再同步一次。")
+
+    @pyqtSlot()
+    def on_sync_started(self):
+        self.tray_icon.setToolTip("CopyQ MD Sync - 正在同步...")
+
+    @pyqtSlot(int, int)
+    def on_sync_progress(self, done, total):
+        if total:
+            self.tray_icon.setToolTip(f"CopyQ MD Sync - 正在导出 {done}/{total}")
+
+    @pyqtSlot(object)
+    def on_sync_finished(self, results):
+        self.tray_icon.setToolTip("CopyQ MD Sync")
+        results = list(results.values())
+        errors = [result["error"] for result in results if "error" in result]
+        if errors:
+            self.show_message("同步失败", "\n".join(errors), QSystemTrayIcon.Critical)
         else:
-            msg = f"同步完成。\n新增 {result['new']} 条, 更新 {result['updated']} 条。"
+            new = sum(result['new'] for result in results)
+            updated = sum(result['updated'] for result in results)
+            removed = sum(result.get('removed', 0) for result in results)
+            msg = f"同步完成。\n新增 {new} 条, 更新 {updated} 条, 删除 {removed} 条。"
+            tags_updated = sum(result.get('tags_updated', 0) for result in results)
+            if tags_updated:
+                msg += f"\nCopyQ 中更新标签 {tags_updated} 条。"
+            if len(results) > 1:
+                msg += f"\n共 {len(results)} 个笔记。"
             self.show_message("同步成功", msg)
 
+    @pyqtSlot(str)
+    def on_sync_failed(self, error):
+        self.tray_icon.setToolTip("CopyQ MD Sync")
+        self.show_message("同步失败", error, QSystemTrayIcon.Critical)
+
+    def toggle_daemon(self, checked):
+        import sync_daemon
+        if not checked:
+            sync_daemon.stop_daemon()
+            return
+        daemon = sync_daemon.start_daemon()
+        if daemon is None:
+            self.show_message("同步服务启动失败", "无法启动本地同步服务，详见日志。", QSystemTrayIcon.Warning)
+            self.daemon_action.setChecked(False)
+
     def toggle_watching(self, checked):
         if checked:
             self.start_watching()
@@ -79,6 +193,9 @@ class TrayManager(QObject):
         self.is_watching = True
         self.show_message("监控已开启", "正在监控Markdown文件变化...")
         self.watch_action.setText("停止自动监控")
+        # 监控运行期间不允许切换引擎，停止时需要调用同一个引擎的 stop_watching
+        self.async_action.setEnabled(False)
+        self.watching_engine = self.engine
         
         # 在新线程中运行 watchdog observer
         self.watcher_thread = threading.Thread(target=self._watch_loop, daemon=True)
@@ -87,7 +204,7 @@ class TrayManager(QObject):
     def _watch_loop(self):
         # start_watching (blocking=True) will run until stop_watching is called from another thread.
         # It handles its own join.
-        sync_logic.start_watching(blocking=True)
+        self.watching_engine.start_watching(blocking=True)
         
         # When the loop finishes, update UI. Needs to be thread-safe.
         # Using postEvent or signals would be better, but this direct call might work for simple cases.
@@ -99,6 +216,7 @@ class TrayManager(QObject):
         self.is_watching = False
         self.watch_action.setChecked(False)
         self.watch_action.setText("开启自动监控")
+        self.async_action.setEnabled(True)
         self.show_message("监控已停止", "已停止自动监控文件变化。")
 
     def stop_watching(self):
@@ -106,10 +224,33 @@ class TrayManager(QObject):
             return
         
         self.show_message("正在停止", "正在停止文件监控...")
-        sync_logic.stop_watching()
+        # 只发送停止信号，监控线程等待进行中的同步完成后调用 on_watcher_stopped，界面不被阻塞
+        self.watching_engine.stop_watching(timeout=0)
 
+    def shutdown(self):
+        """
+        退出或重启前的收尾：停止监控、同步执行器和本地同步服务，
+        等待进行中的同步完成（合计最多 SHUTDOWN_TIMEOUT 秒），保存命令存储和解析缓存
+        """
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        if self.is_watching:
+            self.watching_engine.stop_watching(timeout=SHUTDOWN_TIMEOUT)
+            self.watcher_thread.join(max(0.0, deadline - time.monotonic()))
+        self.sync_executor.shutdown(timeout=max(0.0, deadline - time.monotonic()))
+        if self.daemon_action.isChecked():
+            import sync_daemon
+            sync_daemon.stop_daemon()
+        # 手动同步也会填充缓存；没有导入过 sync_logic 说明没有同步过，无需保存
+        sync_logic = sys.modules.get("sync_logic")
+        if sync_logic is not None:
+            sync_logic.save_caches(max(0.0, deadline - time.monotonic()))
+
+    def restart_app(self):
+        self.shutdown()
+        self.tray_icon.hide()
+        restart_program()
 
     def quit_app(self):
-        self.stop_watching()
+        self.shutdown()
         self.tray_icon.hide()
         QApplication.instance().quit() 
\ No newline at end of file
@@ -1,12 +1,40 @@
 import sys
 import os
+import logging
 import subprocess
 from pathlib import Path
 
 from config import DATA_DIR, MARKDOWN_FILE
 
+def configure_logging(level=logging.INFO):
+    """配置日志格式，由各入口程序在启动时调用，导入模块本身不修改日志配置"""
+    logging.basicConfig(level=level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+def atomic_write(path, data):
+    """
+    原子地写入文件：先写入同目录下的临时文件并刷到磁盘，再替换目标文件，
+    进程在写入中途退出时目标文件保持原样。临时文件名各不相同，多个进程或线程同时写入同一文件时互不覆盖
+    :param data: 要写入的 bytes
+    """
+    # tempfile 导入较慢，只在写入时才导入，不影响一次性同步的启动
+    import tempfile
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{name}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def restart_program():
-    """重启当前程序"""
+    """重启当前程序，调用前应先停止监控并保存缓存（见 TrayManager.shutdown）"""
     python = sys.executable
     os.execl(python, python, *sys.argv)
 
@@ -32,4 +60,4 @@ def open_folder(path):
     elif sys.platform == "darwin":
         subprocess.Popen(["open", path])
     else:
-        subprocess.Popen(["xdg-open", path]) 
\ No newline at end of file
+        subprocess.Popen(["xdg-open", path]) 
@@ -1,13 +1,33 @@
-from sync_logic import start_watching, stop_watching
+import argparse
 import os
 from pathlib import Path
 
+from config import SYNC_ENGINE, HOST_SYNC_DAEMON
+from utils import configure_logging
+
 def main():
     """命令行入口：启动文件监控"""
+    parser = argparse.ArgumentParser(description="监控 Markdown 文件变化并同步到 CopyQ")
+    parser.add_argument('--async', dest='use_async', action='store_true', default=SYNC_ENGINE == "asyncio",
+                        help="使用 asyncio 同步引擎，并发调用 CopyQ")
+    parser.add_argument('--daemon', action='store_true', default=HOST_SYNC_DAEMON,
+                        help="同时运行同步守护进程，接受 sync_client.py 的请求")
+    args = parser.parse_args()
+    configure_logging()
+    if args.use_async:
+        from async_sync import start_watching
+    else:
+        from sync_logic import start_watching
+
     print("启动自动监控... (按 Ctrl+C 停止)")
     os.chdir(Path(__file__).parent)
-    # start_watching from sync_logic handles the KeyboardInterrupt and stopping.
+    if args.daemon:
+        from sync_daemon import start_daemon, stop_daemon
+        start_daemon()
+    # start_watching handles the KeyboardInterrupt and stopping.
     start_watching(blocking=True)
+    if args.daemon:
+        stop_daemon()
     print("监控已停止。")
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+"""
+监控目录集合管理：根据需要监控的文件，动态添加和移除 watchdog 的目录监控。
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class WatchSetManager:
+    def __init__(self, observer, handler):
+        self.observer = observer
+        self.handler = handler
+        self.watches = {}  # 目录 -> ObservedWatch
+        self.awaited = set()  # 被引用文件所在目录中尚不存在的最上一级，创建后需要重新调用 update
+
+    def update(self, files):
+        """
+        按文件列表调整监控的目录：只监控这些文件所在的目录，不再需要的目录取消监控。
+        文件所在目录不存在时监控最近的已存在的上级目录，等待缺少的那一级目录被创建（见 awaited）
+        :param files: 需要监控的文件路径集合（可以包含尚未创建的文件）
+        """
+        needed_dirs = set()
+        awaited = set()
+        for file_path in files:
+            dir_path = os.path.dirname(file_path)
+            missing = None
+            while not os.path.isdir(dir_path):
+                parent = os.path.dirname(dir_path)
+                if parent == dir_path:
+                    break
+                missing, dir_path = dir_path, parent
+            if not os.path.isdir(dir_path):
+                continue
+            needed_dirs.add(dir_path)
+            if missing is not None:
+                if missing not in self.awaited:
+                    logger.info(f"目录不存在，监控上级目录 {dir_path}，等待创建: {missing}")
+                awaited.add(missing)
+        self.awaited = awaited
+
+        for dir_path in needed_dirs - set(self.watches):
+            self.watches[dir_path] = self.observer.schedule(self.handler, dir_path, recursive=False)
+            logger.info(f"正在监控目录: {dir_path}")
+
+        for dir_path in set(self.watches) - needed_dirs:
+            self.observer.unschedule(self.watches.pop(dir_path))
+            logger.info(f"停止监控目录: {dir_path}")
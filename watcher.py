@@ -0,0 +1,265 @@
+"""
+文件监控：用 watchdog 监控各笔记的主 Markdown 文件及其引用的文件，变化后经调度器合并触发同步。
+
+所有笔记共用一个 Observer，由 VaultEventRouter 把事件分发给各笔记的 SyncEventHandler；
+每个笔记有自己的调度器，合并后的同步提交到共用的线程池，同时进行的同步数不超过 VAULT_SYNC_WORKERS。
+
+watchdog 的导入较慢，本模块只在启动监控时才被导入，一次性同步不会加载它。
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from watchdog.observers import Observer
+from watchdog.events import (FileSystemEventHandler, EVENT_TYPE_MODIFIED, EVENT_TYPE_CREATED,
+                             EVENT_TYPE_MOVED, EVENT_TYPE_DELETED, EVENT_TYPE_CLOSED)
+
+import sync_logic
+from config import VAULT_SYNC_WORKERS, SHUTDOWN_TIMEOUT
+from copyq_session import get_session
+from parse_cache import file_digest
+from sync_scheduler import SyncScheduler
+from watch_set import WatchSetManager
+
+logger = logging.getLogger(__name__)
+
+# 会触发同步的事件类型，其余事件（如打开文件）直接忽略
+SYNC_EVENT_TYPES = {EVENT_TYPE_MODIFIED, EVENT_TYPE_CREATED, EVENT_TYPE_MOVED, EVENT_TYPE_DELETED, EVENT_TYPE_CLOSED}
+
+class SyncEventHandler(FileSystemEventHandler):
+    def __init__(self, vault, scheduler=None, router=None, executor=None):
+        """
+        :param vault: 监控的笔记（sync_logic.VaultSync）
+        :param scheduler: 为 None 时在监控线程中直接同步
+        :param router: 共用 Observer 的事件分发器，为 None 时不调整监控的目录
+        :param executor: 执行同步的线程池，为 None 时在调度器线程中直接同步
+        """
+        self.vault = vault
+        self.main_file_path = vault.md_path
+        self.watched_files = {self.main_file_path}
+        self.file_hashes = {}  # 被监控文件 -> 最近一次看到的内容哈希（文件不存在时为 None）
+        self.scheduler = scheduler
+        self.router = router
+        self.executor = executor
+        self.update_watched_files()
+        
+    def update_watched_files(self):
+        """更新监控的文件列表，并按需调整监控的目录"""
+        new_files = self.vault.referenced_files(include_missing=True)
+        new_files.add(self.main_file_path) # 确保主文件始终在监控列表
+        added_files = new_files - self.watched_files
+        if added_files:
+            logger.info(f"添加监控以下文件: {added_files}")
+        # 新监控的文件以解析缓存中的哈希为基准：它在解析之前计算，解析之后的修改一定会被当作变化
+        for file_path in new_files - set(self.file_hashes):
+            self.file_hashes[file_path] = self.vault.cached_file_digest(file_path) if os.path.exists(file_path) else None
+        self.watched_files = new_files
+        if self.router is not None:
+            self.router.update()
+
+    def dispatch(self, event):
+        """在进入任何同步逻辑之前按路径过滤事件，忽略目录中无关文件的变化"""
+        if event.is_directory or event.event_type not in SYNC_EVENT_TYPES:
+            return
+        for file_path in (event.src_path, getattr(event, 'dest_path', '')):
+            if file_path in self.watched_files:
+                self.on_watched_file_changed(file_path)
+        
+    def content_changed(self, file_path):
+        """比较文件内容哈希，过滤内容没有变化的事件（编辑器自动保存、touch、元数据变化等）"""
+        digest = file_digest(file_path)
+        if file_path in self.file_hashes and self.file_hashes[file_path] == digest:
+            return False
+        self.file_hashes[file_path] = digest
+        return True
+
+    def on_watched_file_changed(self, file_path):
+        if not self.content_changed(file_path):
+            logger.debug(f"文件内容没有变化，忽略事件: {file_path}")
+            return
+        logger.info(f"检测到文件变化: {file_path}")
+        if self.scheduler is not None:
+            self.scheduler.submit(file_path)
+        else:
+            self.sync_changes({file_path})
+
+    def sync_changes(self, changed_files):
+        """对一批合并后的文件变化执行一次同步"""
+        logger.info(f"合并 {len(changed_files)} 个文件的变化，触发同步 {self.main_file_path}...")
+        if self.executor is not None:
+            self.executor.submit(self.vault.sync).result()
+        else:
+            self.vault.sync()
+        # 任何被监控的文件都可能增删引用，同步时已按最新内容更新了引用关系图，这里直接查询
+        self.update_watched_files()
+
+class VaultEventRouter(FileSystemEventHandler):
+    """把共用 Observer 的事件分发给各笔记的处理器，监控的目录为所有笔记监控文件所在目录的并集"""
+    def __init__(self, observer):
+        self.handlers = []
+        self.watch_set = WatchSetManager(observer, self)
+        self._lock = threading.Lock()  # 各笔记的调度器线程可能同时调整监控的目录
+
+    def add(self, handler):
+        handler.router = self
+        self.handlers.append(handler)
+        self.update()
+
+    def update(self):
+        with self._lock:
+            files = set()
+            for handler in self.handlers:
+                files |= handler.watched_files
+            self.watch_set.update(files)
+
+    def dispatch(self, event):
+        if event.is_directory and event.event_type in (EVENT_TYPE_CREATED, EVENT_TYPE_MOVED):
+            created = event.dest_path if event.event_type == EVENT_TYPE_MOVED else event.src_path
+            if created in self.watch_set.awaited:
+                logger.info(f"等待的目录已创建: {created}")
+                self.update()
+                # 新监控生效之前又创建的下一级目录同样不会产生事件（如 mkdir -p）
+                while any(os.path.isdir(path) for path in self.watch_set.awaited):
+                    self.update()
+                self.scan_created_dir(created)
+        for handler in self.handlers:
+            handler.dispatch(event)
+
+    def scan_created_dir(self, dir_path):
+        """
+        新目录的监控在创建之后才生效，之前已经写入的被监控文件不会产生事件，这里主动检查一次
+        :param dir_path: 新创建的目录
+        """
+        prefix = os.path.join(dir_path, '')
+        for handler in self.handlers:
+            for file_path in list(handler.watched_files):
+                if file_path.startswith(prefix) and os.path.exists(file_path):
+                    handler.on_watched_file_changed(file_path)
+
+_observer = None
+_schedulers = []
+_executor = None
+_stop_event = threading.Event()  # stop_watching 发出的停止信号，立即唤醒阻塞的 start_watching
+_stopped_event = threading.Event()  # 收尾（等待同步完成、保存缓存）结束
+_waiting = False  # 是否有阻塞的 start_watching 负责收尾
+_starting = False  # start_watching 是否在执行初始同步（Observer 尚未启动）
+_lifecycle_lock = threading.Lock()
+
+def start_watching(blocking=True):
+    """
+    启动文件监控，监控所有配置的笔记
+    :param blocking: True 时阻塞到 stop_watching 或 Ctrl+C，并在当前线程中收尾
+    """
+    global _observer, _schedulers, _executor, _waiting, _starting
+    if _starting or (_observer and _observer.is_alive()):
+        logger.warning("监控已在运行中。")
+        return
+    _starting = True
+    _stop_event.clear()
+    _stopped_event.clear()
+
+    try:
+        vaults = sync_logic.configured_vaults()
+
+        if not get_session().health_check():
+            logger.warning("CopyQ 当前不可用，同步时将自动重试连接。")
+
+        _executor = ThreadPoolExecutor(max_workers=VAULT_SYNC_WORKERS, thread_name_prefix="VaultSync")
+        logger.info("执行初始同步...")
+        sync_logic.sync_all(vaults, _executor)
+
+        if _stop_event.is_set():
+            # 初始同步期间收到停止信号：不再启动 Observer，保存缓存后直接结束
+            logger.info("初始同步期间收到停止信号，不再启动监控。")
+            _executor.shutdown()
+            _executor = None
+            sync_logic.save_caches()
+            _stopped_event.set()
+            return
+
+        _observer = Observer()
+        router = VaultEventRouter(_observer)
+        _schedulers = []
+        for vault in vaults:
+            event_handler = SyncEventHandler(vault, executor=_executor)
+            event_handler.scheduler = SyncScheduler(event_handler.sync_changes)
+            event_handler.scheduler.start()
+            _schedulers.append(event_handler.scheduler)
+            router.add(event_handler)
+
+        _observer.start()
+        for vault in vaults:
+            logger.info(f"已启动对 {vault.md_path} 及其引用的文件监控（标签页 {vault.tab}）。")
+    finally:
+        # 先确定由谁收尾，再结束启动阶段，stop_watching 不会在两者之间看到不一致的状态
+        _waiting = blocking and _observer is not None
+        _starting = False
+
+    if not blocking and _stop_event.is_set():
+        # 启动 Observer 的同时收到的停止信号，stop_watching 正在等待收尾
+        _shutdown()
+    elif blocking:
+        # 用于命令行版本阻塞
+        try:
+            # 停止信号会立即唤醒等待；超时只是为了让 Windows 上的 Ctrl+C 和 Observer 意外退出能被及时发现
+            while not _stop_event.wait(1) and _observer.is_alive():
+                pass
+        except KeyboardInterrupt:
+            logger.info("检测到中断信号，正在停止监控...")
+        finally:
+            _waiting = False
+            _shutdown()
+
+def _shutdown(timeout=SHUTDOWN_TIMEOUT):
+    """
+    停止 Observer 和调度器，等待进行中的同步完成（最多 timeout 秒），然后保存命令存储和解析缓存
+    :return: 进行中的同步是否都已完成
+    """
+    global _observer, _executor
+    with _lifecycle_lock:
+        if _observer is None:
+            return True
+        deadline = time.monotonic() + timeout
+        _observer.stop()
+        for scheduler in _schedulers:
+            scheduler.stop(timeout=0)  # 先通知所有调度器停止，再逐个等待
+        drained = all([scheduler.stop(max(0.0, deadline - time.monotonic())) for scheduler in _schedulers])
+        if not drained:
+            logger.warning(f"进行中的同步未在 {timeout} 秒内完成，不再等待。")
+        _executor.shutdown(wait=drained)
+        _observer.join(max(0.0, deadline - time.monotonic()))
+        if drained:
+            sync_logic.save_caches(max(0.0, deadline - time.monotonic()))
+        _observer = None
+        _executor = None
+        _schedulers.clear()
+        _stopped_event.set()
+        logger.info("文件监控已停止。")
+        return drained
+
+def stop_watching(timeout=SHUTDOWN_TIMEOUT):
+    """
+    停止文件监控，可以从任意线程调用
+    :param timeout: 等待进行中的同步完成并保存缓存的最长时间（秒）；
+                    为 0 时只发送停止信号，由阻塞的 start_watching 所在线程收尾
+    :return: 监控是否在运行（包括正在执行初始同步）
+    """
+    # 先发出信号：初始同步期间 Observer 尚未创建，start_watching 在初始同步完成后检查它
+    _stop_event.set()
+    if _starting:
+        logger.info("初始同步进行中，完成后停止监控。")
+        if timeout:
+            _stopped_event.wait(timeout)
+        return True
+    if _observer is None or not _observer.is_alive():
+        logger.info("文件监控未在运行。")
+        return False
+    logger.info("文件监控停止信号已发送。")
+    if not _waiting:
+        # 非阻塞模式启动的监控由调用方收尾
+        _shutdown(timeout)
+    elif timeout:
+        _stopped_event.wait(timeout)
+    return True